@@ -1,17 +1,15 @@
 #!/usr/bin/env python
 # noinspection PyProtectedMember
 from Bio.Application import _Option, AbstractCommandline, _Switch
-from Bio.Alphabet import generic_dna
-from Bio.SeqRecord import SeqRecord
-from Bio.Seq import Seq
-from Bio import SeqIO
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import CalledProcessError, Popen, PIPE, STDOUT
 from collections import defaultdict
 import subprocess
 import datetime
+import hashlib
 import shutil
 import errno
 import shlex
+import json
 import time
 import glob
 import os
@@ -164,6 +162,20 @@ def run_subprocess(command):
     return out, err
 
 
+def run_streamcall(command):
+    """
+    Run a pipeline with bash, so that the failure of any command in the pipeline (not only the last) is detected
+    :param command: string of the pipeline
+    :return: stdout and stderr of the pipeline as strings
+    """
+    process = subprocess.run(['bash', '-o', 'pipefail', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out = process.stdout.decode('utf-8')
+    err = process.stderr.decode('utf-8')
+    if process.returncode != 0:
+        raise CalledProcessError(process.returncode, command, out, err)
+    return out, err
+
+
 def get_version(exe):
     """
     :param exe: :type list required
@@ -440,6 +452,33 @@ def relativesymlink(src_file, dest_file):
             raise
 
 
+# ioctl request to clone the extents of a file on filesystems that support copy-on-write (e.g. Btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def linkfile(src_file, dest_file):
+    """
+    Create a copy of a file without duplicating its data when possible: a hard link if both paths are on the same
+    filesystem, otherwise a copy-on-write clone (reflink), and finally a regular copy
+    :param src_file: the file to be linked
+    :param dest_file: the path and filename to which the file is to be linked
+    :return: the method used: 'hardlink', 'reflink', or 'copy'
+    """
+    try:
+        os.link(src_file, dest_file)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src_file, 'rb') as source, open(dest_file, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        shutil.copyfile(src_file, dest_file)
+        return 'copy'
+
+
 class GenObject(object):
     """Object to store static variables"""
     def __init__(self, x=None):
@@ -574,83 +613,159 @@ class MakeBlastDB(AbstractCommandline):
         AbstractCommandline.__init__(self, cmd, **kwargs)
 
 
+def fastareader(fastapath):
+    """
+    Stream the records of a FASTA file without creating Bio.SeqIO objects. Non-UTF-8 characters are ignored, and, as
+    with Bio.SeqIO, the identifier of a record is the first word of its header, and whitespace is removed from the
+    sequence
+    :param fastapath: name and path of the FASTA file
+    :return: generator of (identifier, sequence) tuples
+    """
+    identifier = None
+    sequence = list()
+    with open(fastapath, 'rb') as fasta:
+        for line in fasta:
+            line = line.decode('utf-8', 'ignore')
+            if line.startswith('>'):
+                if identifier is not None:
+                    yield identifier, ''.join(sequence).replace(' ', '').replace('\r', '')
+                header = line[1:].split(None, 1)
+                identifier = header[0] if header else str()
+                sequence = list()
+            elif identifier is not None:
+                sequence.append(line.strip())
+    if identifier is not None:
+        yield identifier, ''.join(sequence).replace(' ', '').replace('\r', '')
+
+
+def targetfingerprint(targets, fingerprint=None):
+    """
+    Create a fingerprint of target files. Files are only hashed if their size or modification time differ from the
+    supplied previous fingerprint, so checking unchanged files is inexpensive
+    :param targets: list of names and paths of the target files
+    :param fingerprint: optional previous fingerprint of the targets
+    :return: dictionary of file name: [size, modification time, SHA-256 hash]
+    """
+    fingerprint = fingerprint if fingerprint else dict()
+    current = dict()
+    for target in targets:
+        stat = os.stat(target)
+        name = os.path.basename(target)
+        previous = fingerprint.get(name)
+        if previous and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+            current[name] = previous
+            continue
+        digest = hashlib.sha256()
+        with open(target, 'rb') as targetfile:
+            for block in iter(lambda: targetfile.read(1 << 20), b''):
+                digest.update(block)
+        current[name] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return current
+
+
 def combinetargets(targets, targetpath):
     """
     Creates a set of all unique sequences in a list of supplied FASTA files. Properly formats headers and sequences
-    to be compatible with local pipelines. Splits hybrid entries. Removes illegal characters.
+    to be compatible with local pipelines. Splits hybrid entries. Removes illegal characters. A fingerprint of the
+    targets is stored in combinedtargets.json, and the combined file is only created again if the targets change.
+    The target files themselves are never modified
     :param targets: fasta gene targets to combine
     :param targetpath: folder containing the targets
+    :return: name and path of the combined targets file
     """
     make_path(targetpath)
-    with open(os.path.join(targetpath, 'combinedtargets.fasta'), 'w') as combined:
+    combinedfile = os.path.join(targetpath, 'combinedtargets.fasta')
+    fingerprintfile = os.path.join(targetpath, 'combinedtargets.json')
+    try:
+        with open(fingerprintfile) as fingerprintdata:
+            previous = json.load(fingerprintdata)
+    except (IOError, OSError, ValueError):
+        previous = dict()
+    fingerprint = targetfingerprint(targets, previous.get('targets'))
+    # Compare the hashes rather than the modification times of the targets, as copying a folder changes the times
+    hashes = {name: values[2] for name, values in fingerprint.items()}
+    try:
+        if os.path.getsize(combinedfile) == previous.get('size') and \
+                hashes == {name: values[2] for name, values in previous.get('targets', dict()).items()}:
+            # Store the new modification times of unchanged targets, so they are not hashed again
+            if fingerprint != previous.get('targets'):
+                previous['targets'] = fingerprint
+                with open(fingerprintfile, 'w') as fingerprintdata:
+                    json.dump(previous, fingerprintdata, sort_keys=True, indent=4)
+            return combinedfile
+    except (IOError, OSError):
+        pass
+    # Write the combined targets to a temporary file, so a partially written file is never used
+    temporary = '{}.{}.tmp'.format(combinedfile, os.getpid())
+    with open(temporary, 'w') as combined:
         idset = set()
+
+        def write(recordid, sequence):
+            """
+            Write a record with a cleaned identifier and sequence, if a record with the same identifier has not
+            already been written
+            """
+            # Replace and dashes in the record.id with underscores
+            recordid = recordid.replace('-', '_')
+            if recordid not in idset:
+                # Remove and dashes or 'N's from the sequence data - makeblastdb can't handle sequences with gaps
+                sequence = sequence.replace('-', '').replace('N', '')
+                combined.write('>{}\n'.format(recordid))
+                for i in range(0, len(sequence), 60):
+                    combined.write('{}\n'.format(sequence[i:i + 60]))
+                idset.add(recordid)
+
         for target in targets:
-            # Remove non-unicode characters present in the FASTA files
-            cleanedstring = str()
-            # Read in the file as binary
-            with open(target, 'rb') as fasta:
-                # Import all the text
-                text = fasta.read()
-                # Convert the binary variable to a string, ignoring non-UTF-8 characters
-                cleanedstring += text.decode('utf-8', 'ignore')
-            # Overwrite the file with the clean string
-            with open(target, 'w') as fasta:
-                fasta.write(cleanedstring)
             # Clean up each record
-            for record in SeqIO.parse(target, 'fasta'):
+            for recordid, sequence in fastareader(target):
                 # In case FASTA records have been spliced together, allow for the splitting of
                 # these records
-                if '>' in record.seq:
+                if '>' in sequence:
                     # Split the two records apart on '>' symbols
-                    record.seq, hybrid = record.seq.split('>')
+                    sequence, hybrid = sequence.split('>')
                     # Split the header from the sequence e.g. sspC:6:CP003808.1ATGGAAAGTACATTAGA...
                     # will be split into sspC:6:CP003808.1 and ATGGAAAGTACATTAGA
-                    hybridid, seq = re.findall('(.+\d+\.\d)(.+)', str(hybrid))[0]
-                    # Replace and dashes in the record.id with underscores
-                    hybridid = hybridid.replace('-', '_')
-                    # Convert the string to a seq object
-                    hybridseq = Seq(seq, generic_dna)
-                    # Create a SeqRecord of the sequence - use the sequence object and id
-                    hybridrecord = SeqRecord(hybridseq,
-                                             description='',
-                                             id=hybridid)
-
-                    # Remove and dashes or 'N's from the sequence data - makeblastdb can't handle sequences
-                    # with gaps
-                    # noinspection PyProtectedMember
-                    hybridrecord.seq._data = hybridrecord.seq._data.replace('-', '').replace('N', '')
-                    # Write the original record to the file
-                    # Extract the sequence record from each entry in the multifasta
-                    # Replace and dashes in the record.id with underscores
-                    record.id = record.id.replace('-', '_')
-                    # Remove and dashes or 'N's from the sequence data - makeblastdb can't handle sequences
-                    # with gaps
-                    # noinspection PyProtectedMember
-                    record.seq._data = record.seq._data.replace('-', '').replace('N', '')
-                    # Clear the name and description attributes of the record
-                    record.name = ''
-                    record.description = ''
-                    if record.id not in idset:
-                        SeqIO.write(record, combined, 'fasta')
-                    if hybridrecord.id not in idset:
-                        # Write the second record to file
-                        SeqIO.write(hybridrecord, combined, 'fasta')
-                        idset.add(hybridrecord.id)
-
+                    hybridid, hybridsequence = re.findall('(.+\d+\.\d)(.+)', hybrid)[0]
+                    write(recordid, sequence)
+                    write(hybridid, hybridsequence)
                 else:
-                    # Extract the sequence record from each entry in the multifasta
-                    # Replace and dashes in the record.id with underscores
-                    record.id = record.id.replace('-', '_')
-                    # Remove and dashes or 'N's from the sequence data - makeblastdb can't handle sequences
-                    # with gaps
-                    # noinspection PyProtectedMember
-                    record.seq._data = record.seq._data.replace('-', '').replace('N', '')
-                    # Clear the name and description attributes of the record
-                    record.name = ''
-                    record.description = ''
-                    if record.id not in idset:
-                        SeqIO.write(record, combined, 'fasta')
-                        idset.add(record.id)
+                    write(recordid, sequence)
+    os.replace(temporary, combinedfile)
+    # The indices of the previous combined file no longer match its contents
+    removeindices(combinedfile)
+    with open(fingerprintfile, 'w') as fingerprintdata:
+        json.dump({'targets': fingerprint, 'size': os.path.getsize(combinedfile)}, fingerprintdata,
+                  sort_keys=True, indent=4)
+    return combinedfile
+
+
+def removeindices(fastafile):
+    """
+    Remove the bowtie2 and samtools faidx indices of a FASTA file e.g. after the file has been rewritten, so that they
+    are created again from the new file
+    :param fastafile: name and path of the FASTA file
+    """
+    noext = os.path.splitext(fastafile)[0]
+    indices = glob.glob('{}.*.bt2'.format(noext)) + glob.glob('{}.*.bt2l'.format(noext)) + ['{}.fai'.format(fastafile)]
+    for indexfile in indices:
+        try:
+            os.remove(indexfile)
+        except (IOError, OSError):
+            pass
+
+
+def findcombinedtargets(targets, targetpath):
+    """
+    Find the .fasta file of a target folder. If the folder has no .fasta file, or only the combinedtargets.fasta file
+    created by combinetargets, the combined file is created from the .tfa targets, or updated if they have changed
+    :param targets: fasta gene targets to combine
+    :param targetpath: folder containing the targets
+    :return: name and path of the .fasta file, or None if there is no .fasta file, and no targets to combine
+    """
+    fastafiles = glob.glob(os.path.join(targetpath, '*.fasta'))
+    if targets and (not fastafiles or fastafiles == [os.path.join(targetpath, 'combinedtargets.fasta')]):
+        return combinetargets(targets, targetpath)
+    return fastafiles[0] if fastafiles else None
 
 
 class KeyboardInterruptError(Exception):
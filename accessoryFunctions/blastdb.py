@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+from accessoryFunctions.accessoryFunctions import run_subprocess, write_to_logfile
+import threading
+import hashlib
+import fcntl
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+# Parameters used to create the nucleotide BLAST databases of the target files
+PARAMETERS = '-parse_seqids -max_file_sz 2GB -dbtype nucl'
+
+
+def checksum(fastapath, blocksize=1 << 20):
+    """
+    Calculate the SHA-256 hash of the contents of a file
+    :param fastapath: name and path of the file
+    :param blocksize: number of bytes to read at a time
+    :return: hexadecimal digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(fastapath, 'rb') as fasta:
+        for block in iter(lambda: fasta.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlastDatabaseCache(object):
+    """
+    Creates BLAST databases of FASTA files only when required. A manifest (database name + .dbmanifest.json) is written
+    beside each database recording the SHA-256 hash of the FASTA file, and the makeblastdb parameters used to create
+    it. A database is reused only if its manifest matches the current contents of the FASTA file, so databases are
+    not rebuilt when a folder is moved or copied, but are rebuilt when a FASTA file is edited. Databases stay at their
+    existing paths, so the cache is keyed on the path of each database rather than on the contents of the FASTA file.
+    Each database is built at most once at a time: by a lock within the process, and by a lock file between processes.
+    The lock file is removed once the build is complete
+    """
+
+    def current(self, fastapath, db):
+        """
+        Determine whether the database of a FASTA file was created from the current contents of the file
+        :param fastapath: name and path of the FASTA file
+        :param db: name and path of the database (without extension)
+        :return: boolean of whether the database can be reused
+        """
+        # Multi-volume databases have an alias file (.nal) rather than a header file (.nhr)
+        if not (os.path.isfile('{}.nhr'.format(db)) or os.path.isfile('{}.nal'.format(db))):
+            return False
+        try:
+            with open(self.manifestfile(db)) as manifestfile:
+                manifest = json.load(manifestfile)
+        except (IOError, OSError, ValueError):
+            return False
+        if manifest.get('parameters') != self.parameters:
+            return False
+        stat = os.stat(fastapath)
+        # Only hash the FASTA file if it has been modified (or copied) since the manifest was written
+        if manifest.get('size') == stat.st_size and manifest.get('mtime_ns') == stat.st_mtime_ns:
+            return True
+        if manifest.get('size') != stat.st_size or manifest.get('sha256') != checksum(fastapath):
+            return False
+        # The contents are unchanged - update the manifest, so that the file does not need to be hashed next time
+        try:
+            self.writemanifest(fastapath, db, manifest['sha256'])
+        except (IOError, OSError):
+            pass
+        return True
+
+    def database(self, fastapath, db=None, logfile=None):
+        """
+        Create the BLAST database of a FASTA file if it does not exist, or if it is out of date
+        :param fastapath: name and path of the FASTA file
+        :param db: name and path of the database (without extension). Defaults to the FASTA file without its extension
+        :param logfile: optional base name of the log file to which the output of makeblastdb is written
+        :return: name and path of the database
+        """
+        db = db if db else os.path.splitext(fastapath)[0]
+        with self.lock:
+            dblock = self.locks.setdefault(os.path.abspath(db), threading.Lock())
+        with dblock:
+            if self.current(fastapath, db):
+                self.record('hits')
+                return db
+            lockfile = self.acquire(db)
+            try:
+                # Another process may have built the database while this process was waiting for the lock
+                if lockfile and self.current(fastapath, db):
+                    self.record('hits')
+                    return db
+                self.record('misses')
+                self.build(fastapath, db, logfile)
+            finally:
+                if lockfile:
+                    # Remove the lock file while it is still locked. Processes waiting on the removed file notice
+                    # that it has been replaced, and lock the new file instead
+                    try:
+                        os.remove(lockfile.name)
+                    except (IOError, OSError):
+                        pass
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+                    lockfile.close()
+        return db
+
+    @staticmethod
+    def acquire(db):
+        """
+        Lock the lock file of a database, waiting for any other process building the database
+        :param db: name and path of the database (without extension)
+        :return: the locked lock file, or None if the folder is read-only, in which case the database can only be
+        checked, not rebuilt
+        """
+        lockpath = '{}.dblock'.format(db)
+        while True:
+            try:
+                lockfile = open(lockpath, 'w')
+            except (IOError, OSError):
+                return None
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # The lock is only valid if the file was not removed by the previous holder while this process waited
+            try:
+                if os.stat(lockpath).st_ino == os.fstat(lockfile.fileno()).st_ino:
+                    return lockfile
+            except (IOError, OSError):
+                pass
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+
+    def build(self, fastapath, db, logfile=None):
+        """
+        Run makeblastdb, and write the manifest of the new database
+        :param fastapath: name and path of the FASTA file
+        :param db: name and path of the database (without extension)
+        :param logfile: optional base name of the log file to which the output of makeblastdb is written
+        """
+        # Remove the manifest first, so that an interrupted build is never mistaken for a current database
+        try:
+            os.remove(self.manifestfile(db))
+        except (IOError, OSError):
+            pass
+        # Hash the file before building, so that the manifest cannot record changes made during the build
+        sha256 = checksum(fastapath)
+        command = '{} -in {} {} -out {}'.format(self.command, fastapath, self.parameters, db)
+        out, err = run_subprocess(command)
+        if logfile:
+            with self.lock:
+                write_to_logfile(command, command, logfile)
+                write_to_logfile(out, err, logfile)
+        if os.path.isfile('{}.nhr'.format(db)) or os.path.isfile('{}.nal'.format(db)):
+            self.writemanifest(fastapath, db, sha256)
+        else:
+            self.record('failures')
+
+    def writemanifest(self, fastapath, db, sha256):
+        """
+        Write the manifest of a database to a temporary file, and rename it, so that a partially written manifest is
+        never read
+        :param fastapath: name and path of the FASTA file
+        :param db: name and path of the database (without extension)
+        :param sha256: hash of the contents of the FASTA file from which the database was created
+        """
+        stat = os.stat(fastapath)
+        manifest = {
+            'fasta': os.path.basename(fastapath),
+            'sha256': sha256,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'command': self.command,
+            'parameters': self.parameters
+        }
+        manifestfile = self.manifestfile(db)
+        temporary = '{}.{}.tmp'.format(manifestfile, os.getpid())
+        with open(temporary, 'w') as output:
+            json.dump(manifest, output, sort_keys=True, indent=4)
+        os.replace(temporary, manifestfile)
+
+    @staticmethod
+    def manifestfile(db):
+        return '{}.dbmanifest.json'.format(db)
+
+    def record(self, outcome):
+        with self.lock:
+            self.statistics[outcome] += 1
+
+    def stats(self):
+        """
+        :return: dictionary of the number of databases reused (hits), built (misses), and that failed to build
+        """
+        with self.lock:
+            return dict(self.statistics)
+
+    def __init__(self, command='makeblastdb', parameters=PARAMETERS):
+        """
+        :param command: makeblastdb executable
+        :param parameters: string of the parameters passed to makeblastdb (other than -in and -out)
+        """
+        self.command = command
+        self.parameters = parameters
+        self.lock = threading.Lock()
+        # Dictionary of database: lock, so that different databases can be built concurrently
+        self.locks = dict()
+        self.statistics = {'hits': 0, 'misses': 0, 'failures': 0}
+
+
+# Cache shared by all the analyses in the process
+databasecache = BlastDatabaseCache()
+
+
+def makeblastdb(fastapath, db=None, logfile=None):
+    """
+    Create the BLAST database of a FASTA file with the shared cache if it does not exist, or if it is out of date
+    :return: name and path of the database
+    """
+    return databasecache.database(fastapath, db, logfile)
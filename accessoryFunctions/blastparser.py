@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import numpy
+
+__author__ = 'adamkoziol'
+
+# Custom outfmt 6 used by the GeneSeekr-style BLAST analyses. Note that the doubled quotes are necessary to get it to
+# work with the Biopython command line wrappers
+OUTFMT = "'6 qseqid sseqid positive mismatch gaps evalue bitscore slen length qstart qend qseq sstart send sseq'"
+# Names of the fields in the custom outfmt 6 BLAST output
+FIELDNAMES = ['query_id', 'subject_id', 'positives', 'mismatches', 'gaps',
+              'evalue', 'bit_score', 'subject_length', 'alignment_length',
+              'query_start', 'query_end', 'query_sequence',
+              'subject_start', 'subject_end', 'subject_sequence']
+# Fields that are converted to integers and floats, respectively
+INTEGERS = {'positives', 'mismatches', 'gaps', 'subject_length', 'alignment_length', 'query_start', 'query_end',
+            'subject_start', 'subject_end'}
+FLOATS = {'evalue', 'bit_score'}
+# Some analyses (e.g. MLST) omit the subject sequence from the output to reduce the size of the reports
+MINIMUMFIELDS = len(FIELDNAMES) - 1
+
+
+class BlastRecord(object):
+    """
+    A single row of the custom outfmt 6 BLAST output, with numerical fields converted once on creation. Fields can
+    be accessed either as attributes (record.subject_id) or, for compatibility with code written for csv.DictReader
+    rows, as keys (record['subject_id'])
+    """
+    __slots__ = FIELDNAMES + ['percentidentity', 'low', 'high', 'reverse']
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def todict(self):
+        """
+        :return: dictionary of field name: value for every field in the record. Used when records are stored in the
+        metadata, as the objects are not JSON-serializable
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __init__(self, fields):
+        self.query_id = fields[0]
+        self.subject_id = fields[1]
+        self.positives = int(fields[2])
+        self.mismatches = int(fields[3])
+        self.gaps = int(fields[4])
+        self.evalue = float(fields[5])
+        self.bit_score = float(fields[6])
+        self.subject_length = int(fields[7])
+        self.alignment_length = int(fields[8])
+        self.query_start = int(fields[9])
+        self.query_end = int(fields[10])
+        self.query_sequence = fields[11]
+        self.subject_start = int(fields[12])
+        self.subject_end = int(fields[13])
+        self.subject_sequence = fields[14] if len(fields) > MINIMUMFIELDS else str()
+        # Percent identity is the (number of positives - number of gaps) / total subject length
+        self.percentidentity = (self.positives - self.gaps) / self.subject_length * 100
+        # The range of the hit in the query, and whether the query is in a different frame than the subject
+        self.low = min(self.query_start, self.query_end)
+        self.high = max(self.query_start, self.query_end)
+        self.reverse = self.subject_end < self.subject_start
+
+
+def parse(report):
+    """
+    Stream the custom outfmt 6 BLAST output
+    :param report: name and path of the BLAST report
+    :return: generator of BlastRecord objects
+    """
+    with open(report) as blastreport:
+        for line in blastreport:
+            fields = line.rstrip('\n').split('\t')
+            # Skip blank and truncated lines
+            if len(fields) >= MINIMUMFIELDS:
+                yield BlastRecord(fields)
+
+
+def parsecolumns(report, fields=None):
+    """
+    Read the custom outfmt 6 BLAST output into columns. Numerical fields are converted to numpy arrays, and string
+    fields to lists
+    :param report: name and path of the BLAST report
+    :param fields: optional list of the fields to keep. Discarding the sequence fields greatly reduces memory usage
+    :return: dictionary of field name: column. The 'percentidentity' column is always included
+    """
+    fields = fields if fields else FIELDNAMES
+    # Extract the indices of the requested fields, as well as the fields required to calculate percent identity
+    required = sorted(set(FIELDNAMES.index(field) for field in fields) |
+                      {FIELDNAMES.index(field) for field in ('positives', 'gaps', 'subject_length')})
+    rows = list()
+    with open(report) as blastreport:
+        for line in blastreport:
+            data = line.rstrip('\n').split('\t')
+            if len(data) >= MINIMUMFIELDS:
+                # Pad reports without subject sequences
+                data.extend([str()] * (len(FIELDNAMES) - len(data)))
+                rows.append([data[index] for index in required])
+    columns = dict()
+    # Transpose the rows into columns - handle empty reports by creating empty columns
+    for index, values in zip(required, zip(*rows) if rows else [()] * len(required)):
+        field = FIELDNAMES[index]
+        if field in INTEGERS:
+            columns[field] = numpy.array(values, dtype=numpy.int64)
+        elif field in FLOATS:
+            columns[field] = numpy.array(values, dtype=numpy.float64)
+        else:
+            columns[field] = list(values)
+    columns['percentidentity'] = (columns['positives'] - columns['gaps']) / columns['subject_length'] * 100
+    # Remove the fields that were only required to calculate percent identity
+    return {field: column for field, column in columns.items() if field in fields or field == 'percentidentity'}
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+from accessoryFunctions.accessoryFunctions import make_path
+import threading
+import hashlib
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+# Name of the manifest file in the output directory of each sample
+MANIFEST = 'checkpoints.json'
+
+
+def fingerprint(path, previous=None):
+    """
+    Create the fingerprint of a file. The file is only hashed if its size or modification time differs from the
+    supplied previous fingerprint, so checking unchanged files is inexpensive
+    :param path: name and path of the file
+    :param previous: optional previous fingerprint of the file
+    :return: list of the size, the modification time (ns), and the SHA-256 hash of the file
+    """
+    stat = os.stat(path)
+    if previous and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return previous
+    digest = hashlib.sha256()
+    with open(path, 'rb') as checkfile:
+        for block in iter(lambda: checkfile.read(1 << 20), b''):
+            digest.update(block)
+    return [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+
+class CheckpointManifest(object):
+    """
+    Records the stages completed for a sample. For each stage, the manifest stores the command that was run, and the
+    fingerprints of its input and output files. A stage is only considered complete if the command is unchanged, the
+    inputs have the same contents, and the outputs are the files written by the stage. Outputs that exist without a
+    record (e.g. a file partially written when the pipeline crashed), outputs modified since, and stages with changed
+    parameters or inputs are all run again
+    """
+
+    def complete(self, stage, command, inputs, outputs):
+        """
+        Determine whether a stage can be skipped
+        :param stage: name of the stage
+        :param command: string of the command of the stage e.g. sample.commands.assemble
+        :param inputs: list of the names and paths of the input files of the stage
+        :param outputs: list of the names and paths of the output files of the stage
+        :return: boolean of whether the recorded results of the stage are still valid
+        """
+        with self.lock:
+            entry = self.entries.get(stage)
+            if not entry or entry['command'] != str(command) \
+                    or sorted(entry['inputs']) != sorted(inputs) or sorted(entry['outputs']) != sorted(outputs):
+                return False
+            updated = False
+            for category in ('inputs', 'outputs'):
+                for path, previous in entry[category].items():
+                    try:
+                        current = fingerprint(path, previous)
+                    except (IOError, OSError):
+                        return False
+                    if current[2] != previous[2]:
+                        return False
+                    # The contents are unchanged e.g. the file was copied - store the new modification time, so that
+                    # the file does not need to be hashed next time
+                    if current != previous:
+                        entry[category][path] = current
+                        updated = True
+            if updated:
+                self.write()
+            return True
+
+    def record(self, stage, command, inputs, outputs):
+        """
+        Record the completion of a stage. Should be called once the outputs have been written. If an output is
+        missing, the stage is considered incomplete, and is removed from the manifest
+        :param stage: name of the stage
+        :param command: string of the command of the stage
+        :param inputs: list of the names and paths of the input files of the stage
+        :param outputs: list of the names and paths of the output files of the stage
+        :return: boolean of whether the stage was recorded
+        """
+        try:
+            entry = {
+                'command': str(command),
+                'inputs': {path: fingerprint(path) for path in inputs},
+                'outputs': {path: fingerprint(path) for path in outputs}
+            }
+        except (IOError, OSError):
+            self.invalidate(stage)
+            return False
+        with self.lock:
+            self.entries[stage] = entry
+            self.write()
+        return True
+
+    def invalidate(self, stage):
+        """
+        Remove a stage from the manifest, so that it is run again
+        :param stage: name of the stage
+        """
+        with self.lock:
+            if self.entries.pop(stage, None) is not None:
+                self.write()
+
+    def write(self):
+        """
+        Write the manifest to a temporary file, and rename it, so that a partially written manifest is never read. Must
+        be called with the lock held
+        """
+        temporary = '{}.{}.tmp'.format(self.manifestfile, os.getpid())
+        with open(temporary, 'w') as output:
+            json.dump(self.entries, output, sort_keys=True, indent=4)
+        os.replace(temporary, self.manifestfile)
+
+    def __init__(self, manifestfile):
+        """
+        :param manifestfile: name and path of the manifest file
+        """
+        self.manifestfile = manifestfile
+        self.lock = threading.Lock()
+        try:
+            with open(manifestfile) as manifest:
+                self.entries = json.load(manifest)
+        except (IOError, OSError, ValueError):
+            self.entries = dict()
+
+
+# Dictionary of manifest file: CheckpointManifest shared by all the stages of the process
+manifests = dict()
+manifestlock = threading.Lock()
+
+
+def checkpoint(sample):
+    """
+    Find the checkpoint manifest of a sample, which is stored in its output directory
+    :param sample: metadata object
+    :return: CheckpointManifest of the sample
+    """
+    manifestfile = os.path.abspath(os.path.join(sample.general.outputdirectory, MANIFEST))
+    with manifestlock:
+        if manifestfile not in manifests:
+            make_path(sample.general.outputdirectory)
+            manifests[manifestfile] = CheckpointManifest(manifestfile)
+        return manifests[manifestfile]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+from bisect import bisect_left, bisect_right, insort
+
+__author__ = 'adamkoziol'
+
+
+class IntervalIndex(object):
+    """
+    Index of half-open [low, high) intervals on a single sequence e.g. the ranges of BLAST hits on a contig. The
+    intervals are kept in insertion order in .intervals, and their starts and ends are additionally kept in sorted
+    lists, so intervals with nearby endpoints can be found with a binary search rather than a scan of every interval
+    """
+
+    def add(self, low, high):
+        """
+        Add a new interval to the index
+        :return: index of the new interval in .intervals
+        """
+        index = len(self.intervals)
+        self.intervals.append([low, high])
+        insort(self.starts, (low, index))
+        insort(self.ends, (high, index))
+        return index
+
+    def update(self, index, low, high):
+        """
+        Change the endpoints of an interval in place
+        :param index: index of the interval in .intervals
+        :param low: new start of the interval
+        :param high: new end of the interval
+        """
+        interval = self.intervals[index]
+        if low != interval[0]:
+            del self.starts[bisect_left(self.starts, (interval[0], index))]
+            insort(self.starts, (low, index))
+            interval[0] = low
+        if high != interval[1]:
+            del self.ends[bisect_left(self.ends, (interval[1], index))]
+            insort(self.ends, (high, index))
+            interval[1] = high
+
+    def near(self, low, high, distance):
+        """
+        Find the intervals with a start within distance of low, or with an end within distance of high
+        :return: sorted list of the indices of the intervals
+        """
+        indices = set()
+        for endpoints, value in ((self.starts, low), (self.ends, high)):
+            first = bisect_left(endpoints, (value - distance, -1))
+            last = bisect_right(endpoints, (value + distance, len(self.intervals)))
+            indices.update(index for _, index in endpoints[first:last])
+        return sorted(indices)
+
+    def overlapping(self, intervals):
+        """
+        Find every pair of overlapping intervals between the index and the supplied intervals with a single sweep of
+        the sorted starts. As the intervals are half-open, back-to-back genes e.g. [2557, 3393] and [3393, 4196] do
+        not overlap
+        :param intervals: list of (low, high) intervals
+        :return: dictionary of index in .intervals: sorted list of indices of the overlapping supplied intervals
+        """
+        # Empty intervals cannot overlap anything
+        events = sorted([(start, 0, index, end) for index, (start, end) in enumerate(self.intervals) if start < end] +
+                        [(start, 1, index, end) for index, (start, end) in enumerate(intervals) if start < end])
+        active = (list(), list())
+        overlaps = dict()
+        for start, kind, index, end in events:
+            # Discard the intervals of the other kind that end before the current interval starts - all the remaining
+            # intervals started before the current one, and therefore overlap it
+            active[1 - kind][:] = [(other, otherend) for other, otherend in active[1 - kind] if otherend > start]
+            for other, _ in active[1 - kind]:
+                indexed, supplied = (index, other) if kind == 0 else (other, index)
+                overlaps.setdefault(indexed, list()).append(supplied)
+            active[kind].append((index, end))
+        for supplied in overlaps.values():
+            supplied.sort()
+        return overlaps
+
+    def __init__(self, intervals=None):
+        """
+        :param intervals: optional list of [low, high] intervals to index
+        """
+        self.intervals = list()
+        self.starts = list()
+        self.ends = list()
+        for low, high in intervals if intervals else list():
+            self.add(low, high)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+from accessoryFunctions.accessoryFunctions import printtime
+from multiprocessing.pool import ThreadPool
+import threading
+import resource
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+def physicalmemory():
+    """
+    :return: total physical memory of the system in megabytes
+    """
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+def childcputime():
+    """
+    :return: combined user and system CPU time in seconds of all the finished child processes (e.g. the bbtools calls)
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def batches(items, memory, batchmemory, maxsize=None):
+    """
+    Split items into batches, each processed by one instance of a memory-intensive tool e.g. a classifier that loads
+    its database into memory. As many batches are created as can run at once within the memory budget, and large sets
+    of items are split further, so that the results of the first batches are available sooner
+    :param items: list of the items to split
+    :param memory: memory budget in megabytes
+    :param batchmemory: memory in megabytes used by the tool for each batch
+    :param maxsize: optional maximum number of items in each batch
+    :return: list of lists of items. The items keep their order, and the batches differ in size by at most one
+    """
+    if not items:
+        return list()
+    count = max(1, min(len(items), memory // batchmemory))
+    if maxsize:
+        count = max(count, -(-len(items) // maxsize))
+    size, remainder = divmod(len(items), count)
+    split = list()
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < remainder else 0)
+        split.append(items[start:end])
+        start = end
+    return split
+
+
+class StageScheduler(object):
+    """
+    Runs the samples of a pipeline stage concurrently. Tools such as tadpole and bbnorm do not scale linearly with the
+    number of threads, so rather than giving each sample every CPU in turn, several samples are processed at once, and
+    the CPUs and the memory budget are split evenly between them
+    """
+
+    def allocate(self, jobs, minthreads=1, minmemory=1000, concurrency=None):
+        """
+        Determine the number of samples to process at once, and the resources of each
+        :param jobs: number of samples in the stage
+        :param minthreads: minimum number of threads for each sample
+        :param minmemory: minimum memory in megabytes for each sample
+        :param concurrency: optional number of samples to process at once. Defaults to as many as the CPUs allow
+        :return: number of concurrent samples, threads per sample, memory (MB) per sample
+        """
+        workers = concurrency if concurrency else self.cpus // minthreads
+        # Never process more samples at once than the memory budget allows
+        workers = max(1, min(workers, jobs, self.memory // minmemory))
+        return workers, max(1, self.cpus // workers), self.memory // workers
+
+    def run(self, stage, function, samples, minthreads=1, minmemory=1000, concurrency=None):
+        """
+        Run a function on each sample in a pool of threads. As the work is done by external tools, threads are
+        sufficient. Records the wall-clock time, and the CPU time of the child processes of the stage
+        :param stage: name of the stage
+        :param function: function called with each sample, the number of threads, and the memory (MB) for the sample
+        :param samples: list of the samples to process
+        :param minthreads: minimum number of threads for each sample
+        :param minmemory: minimum memory in megabytes for each sample
+        :param concurrency: optional number of samples to process at once
+        """
+        workers, threads, memory = self.allocate(len(samples), minthreads, minmemory, concurrency)
+        started = time.time()
+        cputime = childcputime()
+        if samples:
+            pool = ThreadPool(workers)
+            try:
+                # Consume the results in order to raise any exceptions from the workers
+                list(pool.imap_unordered(lambda sample: function(sample, threads, memory), samples))
+            finally:
+                pool.close()
+                pool.join()
+        wallclock = time.time() - started
+        cputime = childcputime() - cputime
+        self.stages[stage] = {
+            'samples': len(samples),
+            'workers': workers,
+            'threads': threads,
+            'memory': memory,
+            'wallclock': round(wallclock, 2),
+            'cputime': round(cputime, 2),
+            # Fraction of the available CPU time used by the stage
+            'utilisation': round(cputime / (wallclock * self.cpus), 3) if wallclock else 0
+        }
+        if self.start is not None:
+            printtime('{stage}: {samples} samples, {workers} at a time with {threads} threads and {memory} MB each, '
+                      '{wallclock:.1f} s wall-clock, {utilisation:.0%} CPU utilisation'
+                      .format(stage=stage, **self.stages[stage]), self.start)
+
+    def __init__(self, cpus, memory=None, start=None):
+        """
+        :param cpus: number of CPUs available to the pipeline
+        :param memory: optional memory budget in megabytes. Defaults to 85% of the physical memory of the system
+        :param start: optional start time of the pipeline - the summary of each stage is printed if provided
+        """
+        self.cpus = max(1, int(cpus))
+        self.memory = int(memory) if memory else int(physicalmemory() * 0.85)
+        self.start = start
+        # Dictionary of stage name: statistics
+        self.stages = dict()
+
+
+class TaskScheduler(object):
+    """
+    Runs a graph of tasks with dependencies within global CPU and memory limits. Each task declares the CPUs and memory
+    it requires, and is started in its own thread as soon as its dependencies have finished and the resources are free.
+    Stages can therefore overlap: with per-sample tasks, a sample can be typed while another is still being assembled.
+    If a task fails, the tasks that depend on it are skipped, the independent tasks are completed, and the first
+    exception is raised once the graph has finished
+    """
+
+    def add(self, name, function, args=(), cpus=1, memory=0, dependencies=()):
+        """
+        Add a task to the graph
+        :param name: unique name of the task e.g. ('assemble', sample.name)
+        :param function: function called with the arguments when the task runs
+        :param args: tuple of the arguments of the function
+        :param cpus: number of CPUs used by the task. Limited to the CPUs of the scheduler
+        :param memory: memory in megabytes used by the task. Limited to the memory budget of the scheduler
+        :param dependencies: names of the tasks that must finish before this task starts
+        :return: name of the task
+        """
+        assert name not in self.tasks, 'Task {} has already been added'.format(name)
+        for dependency in dependencies:
+            assert dependency in self.tasks, 'Task {} depends on unknown task {}'.format(name, dependency)
+        self.tasks[name] = {
+            'function': function,
+            'args': tuple(args),
+            'cpus': max(1, min(int(cpus), self.cpus)),
+            'memory': max(0, min(int(memory), self.memory)),
+            'dependencies': list(dependencies),
+            'status': 'waiting',
+            'wallclock': None
+        }
+        self.order.append(name)
+        return name
+
+    def stage(self, stage, function, samples, cpus=1, memory=0, after=()):
+        """
+        Add a task for each sample. The task of a sample depends only on the tasks of the same sample in the preceding
+        stages, and not on the other samples
+        :param stage: name of the stage
+        :param function: function called with each sample
+        :param samples: list of the samples to process
+        :param cpus: number of CPUs used by the task of each sample
+        :param memory: memory in megabytes used by the task of each sample
+        :param after: names of the stages that must be complete for a sample before its task starts. Samples without
+        a task in a preceding stage do not wait for it
+        :return: list of the names of the tasks
+        """
+        names = list()
+        for sample in samples:
+            dependencies = [(previous, sample.name) for previous in after if (previous, sample.name) in self.tasks]
+            names.append(self.add((stage, sample.name), function, (sample,), cpus, memory, dependencies))
+        return names
+
+    def run(self):
+        """
+        Run the tasks, and wait for all of them to finish
+        :return: dictionary of task name: status (complete, failed, or skipped)
+        """
+        started = time.time()
+        with self.condition:
+            while True:
+                self.schedule()
+                if not any(self.tasks[name]['status'] in ('waiting', 'running') for name in self.order):
+                    break
+                self.condition.wait()
+        if self.start is not None:
+            completed = sum(1 for name in self.order if self.tasks[name]['status'] == 'complete')
+            printtime('Completed {} of {} tasks in {:.1f} s'.format(completed, len(self.order), time.time() - started),
+                      self.start)
+        if self.errors:
+            raise self.errors[0]
+        return {name: self.tasks[name]['status'] for name in self.order}
+
+    def schedule(self):
+        """
+        Start every waiting task whose dependencies are complete, and whose resources are available, in the order in
+        which the tasks were added. Smaller tasks may start ahead of a larger task that does not yet fit. Must be
+        called with the condition held
+        """
+        for name in self.order:
+            task = self.tasks[name]
+            if task['status'] != 'waiting':
+                continue
+            statuses = [self.tasks[dependency]['status'] for dependency in task['dependencies']]
+            if any(status in ('failed', 'skipped') for status in statuses):
+                task['status'] = 'skipped'
+                continue
+            if any(status != 'complete' for status in statuses):
+                continue
+            if task['cpus'] > self.freecpus or task['memory'] > self.freememory:
+                continue
+            task['status'] = 'running'
+            self.freecpus -= task['cpus']
+            self.freememory -= task['memory']
+            worker = threading.Thread(target=self.execute, args=(name,))
+            worker.daemon = True
+            worker.start()
+
+    def execute(self, name):
+        """
+        Run a task, release its resources, and notify the scheduler
+        :param name: name of the task
+        """
+        task = self.tasks[name]
+        started = time.time()
+        error = None
+        try:
+            task['function'](*task['args'])
+        except Exception as exception:
+            error = exception
+        with self.condition:
+            if error is not None:
+                self.errors.append(error)
+            task['status'] = 'failed' if error is not None else 'complete'
+            task['wallclock'] = round(time.time() - started, 2)
+            self.freecpus += task['cpus']
+            self.freememory += task['memory']
+            self.condition.notify()
+
+    def __init__(self, cpus, memory=None, start=None):
+        """
+        :param cpus: number of CPUs available to the pipeline
+        :param memory: optional memory budget in megabytes. Defaults to 85% of the physical memory of the system
+        :param start: optional start time of the pipeline - a summary is printed when the tasks are complete
+        """
+        self.cpus = max(1, int(cpus))
+        self.memory = int(memory) if memory else int(physicalmemory() * 0.85)
+        self.start = start
+        self.freecpus = self.cpus
+        self.freememory = self.memory
+        # Dictionary of task name: task, and the names of the tasks in the order in which they were added
+        self.tasks = dict()
+        self.order = list()
+        self.errors = list()
+        self.condition = threading.Condition()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+from spadespipeline.genomesize import estimate
+from biotools import bbtools
+from argparse import ArgumentParser
+from subprocess import CalledProcessError
+import tempfile
+import random
+import shutil
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+"""
+Compares the genome size estimated from the k-mer spectrum of a sample of the reads against the haploid genome size
+reported by kmercountexact (bbtools.genome_size), as well as the wall time of each. Runs on the supplied FASTQ files
+(the test FASTQ files of the repository by default), or on reads simulated from a random genome of a known size
+"""
+
+
+def simulate(path, size, coverage, readlength=150, errorrate=0.005, seed=1):
+    """
+    Create paired FASTQ files of reads with substitution errors sampled from both strands of a random genome
+    :return: list of the names of the FASTQ files
+    """
+    random.seed(seed)
+    genome = ''.join(random.choice('ACGT') for _ in range(size))
+    complement = str.maketrans('ACGT', 'TGCA')
+    fastqfiles = [os.path.join(path, 'simulated_R{}.fastq'.format(read)) for read in (1, 2)]
+    pairs = int(size * coverage / (2 * readlength))
+    with open(fastqfiles[0], 'w') as forward, open(fastqfiles[1], 'w') as reverse:
+        for pair in range(pairs):
+            start = random.randrange(size - 500)
+            fragment = genome[start:start + random.randint(300, 500)]
+            if random.random() < 0.5:
+                fragment = fragment.translate(complement)[::-1]
+            for output, sequence in ((forward, fragment[:readlength]),
+                                     (reverse, fragment[-readlength:].translate(complement)[::-1])):
+                sequence = ''.join(random.choice('ACGT') if random.random() < errorrate else base
+                                   for base in sequence)
+                output.write('@read{}\n{}\n+\n{}\n'.format(pair, sequence, 'I' * len(sequence)))
+    return fastqfiles
+
+
+def kmercountexact(fastqfiles, path):
+    """
+    :return: haploid genome size reported by kmercountexact, or None if kmercountexact could not be run
+    """
+    peaksfile = os.path.join(path, 'peaks.txt')
+    reverse = fastqfiles[1] if len(fastqfiles) == 2 else 'NA'
+    try:
+        bbtools.kmercountexact(forward_in=fastqfiles[0], reverse_in=reverse, peaks=peaksfile)
+        return bbtools.genome_size(peaksfile)
+    except (CalledProcessError, IOError, OSError):
+        return None
+
+
+def benchmark(fastqfiles, fractions, truesize=None):
+    path = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        reference = kmercountexact(fastqfiles, path)
+        elapsed = time.time() - start
+        if reference is None:
+            print('kmercountexact: not available')
+        else:
+            print('kmercountexact: {} bp in {:.2f} seconds'.format(reference, elapsed))
+        if truesize:
+            print('true genome size: {} bp'.format(truesize))
+        # Compare against the true size of simulated genomes, otherwise against kmercountexact
+        expected = truesize if truesize else reference
+        for fraction in fractions:
+            start = time.time()
+            result = estimate(fastqfiles, fraction)
+            elapsed = time.time() - start
+            error = ', {:+.2%} difference'.format(result['genomesize'] / expected - 1) if expected else ''
+            print('k-mer spectrum ({:.0%} of reads): {} bp in {:.2f} seconds, coverage peaks {}{}'
+                  .format(fraction, result['genomesize'], elapsed, result['coverage'], error))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    testfastq = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'dummy_fastq')
+    parser = ArgumentParser(description='Benchmark the k-mer spectrum genome size estimator against kmercountexact')
+    parser.add_argument('-f', '--fastq',
+                        nargs='+',
+                        default=[os.path.join(testfastq, 'test_R1.fastq'), os.path.join(testfastq, 'test_R2.fastq')],
+                        help='Forward (and reverse) FASTQ files. Default is the test FASTQ files of the repository')
+    parser.add_argument('-s', '--simulate',
+                        type=int,
+                        help='Simulate reads from a random genome of this size instead of using FASTQ files')
+    parser.add_argument('-c', '--coverage',
+                        default=60,
+                        type=float,
+                        help='Coverage of the simulated reads. Default is 60')
+    parser.add_argument('-r', '--fractions',
+                        nargs='+',
+                        default=[1.0, 0.5, 0.25],
+                        type=float,
+                        help='Fractions of the reads to sample. Default is 1.0 0.5 0.25')
+    args = parser.parse_args()
+    if args.simulate:
+        simulatedpath = tempfile.mkdtemp()
+        try:
+            benchmark(simulate(simulatedpath, args.simulate, args.coverage), args.fractions, args.simulate)
+        finally:
+            shutil.rmtree(simulatedpath)
+    else:
+        benchmark(args.fastq, args.fractions)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+from spadespipeline.mMLST import blastbatch, blastresources
+from multiprocessing.pool import ThreadPool
+from argparse import ArgumentParser
+from glob import glob
+import multiprocessing
+import tempfile
+import shutil
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+"""
+Compares the throughput of the MLST BLAST searches of a folder of assemblies run serially (one search per assembly,
+all CPUs given to BLAST) against the concurrent worker pool, with and without concatenated queries
+"""
+
+
+def run(assemblies, db, cpus, batchsize, workers=None):
+    """
+    Search the assemblies against the database in batches of batchsize assemblies
+    :return: elapsed time in seconds
+    """
+    outputpath = tempfile.mkdtemp()
+    queries = [(assembly, os.path.join(outputpath, '{}_rawresults.csv'.format(os.path.basename(assembly))))
+               for assembly in assemblies]
+    batches = [queries[i:i + batchsize] for i in range(0, len(queries), batchsize)]
+    poolworkers, threads = blastresources(len(batches), cpus) if workers is None else (workers, cpus // workers)
+    start = time.time()
+    pool = ThreadPool(poolworkers)
+    pool.map(lambda batch: blastbatch(batch, db, threads, outputpath), batches)
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+    shutil.rmtree(outputpath)
+    return elapsed, poolworkers, threads
+
+
+def benchmark(assemblies, db, cpus, batchsize):
+    size = sum(os.path.getsize(assembly) for assembly in assemblies) / 1000000
+    for name, kwargs in (('serial', {'batchsize': 1, 'workers': 1}),
+                         ('concurrent', {'batchsize': 1}),
+                         ('concurrent, batches of {}'.format(batchsize), {'batchsize': batchsize})):
+        elapsed, workers, threads = run(assemblies, db, cpus, **kwargs)
+        print('{name}: {workers} workers x {threads} threads: {time:.1f} seconds, {samples:.1f} samples/min, '
+              '{mbp:.1f} Mbp/min'.format(name=name, workers=workers, threads=threads, time=elapsed,
+                                         samples=len(assemblies) / elapsed * 60, mbp=size / elapsed * 60))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the throughput of the MLST BLAST searches')
+    parser.add_argument('-s', '--sequencepath',
+                        required=True,
+                        help='Folder of assemblies (.fasta)')
+    parser.add_argument('-d', '--database',
+                        required=True,
+                        help='Combined allele BLAST database (path and name without extension)')
+    parser.add_argument('-c', '--cpus',
+                        default=multiprocessing.cpu_count(),
+                        type=int,
+                        help='Number of CPUs to use. Default is all the CPUs in the system')
+    parser.add_argument('-b', '--batchsize',
+                        default=8,
+                        type=int,
+                        help='Number of assemblies to concatenate into each query in the batched run. Default is 8')
+    args = parser.parse_args()
+    benchmark(sorted(glob(os.path.join(args.sequencepath, '*.fasta'))), args.database, args.cpus, args.batchsize)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from sipprCommon.pileup import pileup, summarise
+from argparse import ArgumentParser
+from collections import Counter
+from multiprocessing import Process, Queue
+import resource
+import random
+import pysam
+import numpy
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+"""
+Compares the wall time and peak RSS of the count matrix pileup engine against the previous dictionary of lists
+implementation of Sippr.reduce/Sippr.parsebam on a synthetic BAM file
+"""
+
+
+def synthetic(path, reads, targets, length, readlength, seed=1):
+    """
+    Create a sorted, indexed BAM file of random reads aligned to random targets. Roughly 5% of reads contain an
+    insertion, a deletion, or soft clipping
+    :return: name of the BAM file, faidx-style dictionary of target lengths, dictionary of reference sequences
+    """
+    random.seed(seed)
+    references = {'target{}'.format(i): ''.join(random.choice('ACGT') for _ in range(length)) for i in range(targets)}
+    names = sorted(references)
+    bamfile = os.path.join(path, 'synthetic_sorted.bam')
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': name, 'LN': length} for name in names]}
+    perreference = reads // targets
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as bam:
+        for refid, name in enumerate(names):
+            refseq = references[name]
+            # Ensure that the start of each target is covered
+            starts = sorted([0] + [random.randint(0, length - readlength - 5) for _ in range(perreference - 1)])
+            for count, start in enumerate(starts):
+                feature = random.random()
+                if feature < 0.02:
+                    sequence = refseq[start:start + 50] + 'AC' + refseq[start + 50:start + readlength - 2]
+                    cigar = [(0, 50), (1, 2), (0, readlength - 52)]
+                elif feature < 0.04:
+                    sequence = refseq[start:start + 50] + refseq[start + 53:start + readlength + 3]
+                    cigar = [(0, 50), (2, 3), (0, readlength - 50)]
+                elif feature < 0.05:
+                    sequence = 'T' * 10 + refseq[start:start + readlength - 10]
+                    cigar = [(4, 10), (0, readlength - 10)]
+                else:
+                    sequence = refseq[start:start + readlength]
+                    cigar = [(0, readlength)]
+                record = pysam.AlignedSegment()
+                record.query_name = '{}_{}'.format(name, count)
+                record.query_sequence = sequence
+                record.reference_id = refid
+                record.reference_start = start
+                record.mapping_quality = 60
+                record.cigartuples = cigar
+                bam.write(record)
+    pysam.index(bamfile)
+    return bamfile, {name: length for name in names}, references
+
+
+def legacy(bamfile, faidict, references):
+    """
+    The dictionary of lists implementation used by Sippr.reduce and Sippr.parsebam prior to the count matrices
+    """
+    sequence = dict()
+    features = dict()
+    bam = pysam.AlignmentFile(bamfile, 'rb')
+    for record in bam.fetch():
+        readpos = 0
+        contig = record.reference_name
+        refpos = record.reference_start
+        for cigartype, cigarlength in record.cigartuples:
+            if cigartype == 0:
+                for i in range(readpos, readpos + cigarlength):
+                    sequence.setdefault(contig, dict()).setdefault(refpos, list()).append(record.query_sequence[i])
+                    refpos += 1
+                readpos += cigarlength
+            elif cigartype == 1:
+                for i in range(readpos, readpos + cigarlength):
+                    sequence.setdefault(contig, dict()).setdefault(refpos, list()).append(record.query_sequence[i])
+                    features.setdefault(contig, dict()).setdefault(refpos, list()).append('insertion')
+                readpos += cigarlength
+            elif cigartype == 2:
+                for _ in range(cigarlength):
+                    sequence.setdefault(contig, dict()).setdefault(refpos, list()).append('-')
+                    refpos += 1
+            elif cigartype == 4:
+                record_length = float(faidict[contig])
+                record_length_ninety = record_length * 0.95
+                if float(record.reference_start) >= (record_length - record_length_ninety) \
+                        and float(record.reference_end) <= record_length_ninety:
+                    features.setdefault(contig, dict()).setdefault(refpos, list()).append('internal soft clip')
+                readpos += cigarlength
+    results = dict()
+    for contig, poslist in sorted(sequence.items()):
+        refseq = references[contig]
+        refpos = 0
+        matches = 0
+        depthtotal = 0
+        seq = str()
+        deviation = list()
+        for pos, baselist in poslist.items():
+            if pos == refpos:
+                querybase = Counter(baselist).most_common()[0][0]
+                depth = len(baselist)
+                seq += querybase
+                depthtotal += depth
+                deviation.append(depth)
+                if querybase == refseq[pos]:
+                    matches += 1
+            refpos += 1
+        results[contig] = (matches, depthtotal, seq, numpy.std(deviation, ddof=1))
+    return results
+
+
+def current(bamfile, faidict, references):
+    """
+    The count matrix implementation
+    """
+    counts, features = pileup(bamfile, faidict)
+    return {contig: summarise(matrix, references[contig]) for contig, matrix in counts.items()}
+
+
+def measure(function, bamfile, faidict, references, queue):
+    """
+    Run the supplied implementation, and report the wall time and peak RSS of this process
+    """
+    start = time.time()
+    function(bamfile, faidict, references)
+    elapsed = time.time() - start
+    # ru_maxrss is reported in kilobytes on Linux
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def benchmark(bamfile, faidict, references):
+    """
+    Run each implementation in a fresh process, so that the peak RSS values are independent
+    """
+    results = dict()
+    for name, function in (('legacy', legacy), ('pileup', current)):
+        queue = Queue()
+        process = Process(target=measure, args=(function, bamfile, faidict, references, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+        print('{name}: {time:.2f} seconds, peak RSS {rss:.1f} MB'
+              .format(name=name, time=results[name][0], rss=results[name][1]))
+    print('Speedup: {:.1f}X'.format(results['legacy'][0] / results['pileup'][0]))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the Sippr pileup engine against the previous implementation')
+    parser.add_argument('-p', '--path',
+                        default=os.getcwd(),
+                        help='Folder in which to create the synthetic BAM file')
+    parser.add_argument('-r', '--reads',
+                        default=1000000,
+                        type=int,
+                        help='Number of synthetic reads. Default is 1000000')
+    parser.add_argument('-n', '--targets',
+                        default=53,
+                        type=int,
+                        help='Number of synthetic targets. Default is 53')
+    parser.add_argument('-l', '--length',
+                        default=1500,
+                        type=int,
+                        help='Length of the synthetic targets. Default is 1500')
+    parser.add_argument('-s', '--readlength',
+                        default=150,
+                        type=int,
+                        help='Length of the synthetic reads. Default is 150')
+    args = parser.parse_args()
+    synthbam, synthfai, synthrefs = synthetic(args.path, args.reads, args.targets, args.length, args.readlength)
+    benchmark(synthbam, synthfai, synthrefs)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from accessoryFunctions.accessoryFunctions import run_streamcall
+from spadespipeline.quality import streamcall
+from argparse import ArgumentParser
+import multiprocessing
+import resource
+import tempfile
+import shutil
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+"""
+Compares the file-based trimming (bbduk) and error correction (tadpole) of paired reads to the streaming mode, in which
+the trimmed reads are piped directly into tadpole. Reports the wall-clock time, and the bytes read from and written to
+disk by the tools of each mode, as well as the size of the trimmed intermediate files avoided by streaming
+"""
+
+
+def diskio():
+    """
+    :return: bytes read, bytes written by the finished child processes
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def bbdukcall(forward, reverse, output):
+    return 'bbduk.sh -Xmx1g in1={} in2={} {} qtrim=w trimq=10 k=25 minlength=50 ref=adapters tbo'\
+        .format(forward, reverse, output)
+
+
+def measure(commands):
+    """
+    Run the commands in order, and measure the elapsed time and disk I/O
+    :return: elapsed time in seconds, bytes read, bytes written
+    """
+    readstart, writestart = diskio()
+    start = time.time()
+    for command in commands:
+        run_streamcall(command)
+    elapsed = time.time() - start
+    read, written = diskio()
+    return elapsed, read - readstart, written - writestart
+
+
+def benchmark(forward, reverse, threads, memory):
+    outputpath = tempfile.mkdtemp()
+    trimmed = [os.path.join(outputpath, 'trimmed_R{}.fastq.gz'.format(read)) for read in (1, 2)]
+    corrected = [os.path.join(outputpath, 'corrected_R{}.fastq.gz'.format(read)) for read in (1, 2)]
+    # File-based: bbduk writes the trimmed reads, which tadpole reads back
+    filebased = measure([bbdukcall(forward, reverse, 'out1={} out2={}'.format(*trimmed)),
+                         'tadpole.sh -Xmx{}m in1={} in2={} out1={} out2={} mode=correct threads={}'
+                        .format(memory, trimmed[0], trimmed[1], corrected[0], corrected[1], threads)])
+    intermediate = sum(os.path.getsize(fastq) for fastq in trimmed)
+    for fastq in trimmed + corrected:
+        os.remove(fastq)
+    # Streaming: only the corrected reads are written
+    streaming = measure([streamcall(bbdukcall(forward, reverse, 'out=stdout.fq'), corrected, True, threads, memory)])
+    shutil.rmtree(outputpath)
+    for name, (elapsed, read, written) in (('file-based', filebased), ('streaming', streaming)):
+        print('{name}: {time:.1f} seconds, {read:.1f} MB read, {written:.1f} MB written'
+              .format(name=name, time=elapsed, read=read / 1000000, written=written / 1000000))
+    # The trimmed files are written once, and read once
+    print('Trimmed intermediate files avoided: {:.1f} MB ({:.1f} MB of disk I/O)'
+          .format(intermediate / 1000000, 2 * intermediate / 1000000))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the disk I/O saved by streaming trimmed reads into error '
+                                        'correction')
+    parser.add_argument('-f', '--forward',
+                        required=True,
+                        help='Forward reads (.fastq.gz)')
+    parser.add_argument('-r', '--reverse',
+                        required=True,
+                        help='Reverse reads (.fastq.gz)')
+    parser.add_argument('-t', '--threads',
+                        default=multiprocessing.cpu_count(),
+                        type=int,
+                        help='Number of threads for tadpole. Default is all the CPUs in the system')
+    parser.add_argument('-m', '--memory',
+                        default=4000,
+                        type=int,
+                        help='Maximum Java heap size of tadpole in megabytes. Default is 4000')
+    args = parser.parse_args()
+    benchmark(args.forward, args.reverse, args.threads, args.memory)
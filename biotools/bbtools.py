@@ -11,7 +11,11 @@ def kwargs_to_string(kwargs):
     """
     outstr = ''
     for arg in kwargs:
-        outstr += ' {}={}'.format(arg, kwargs[arg])
+        # Java heap options (e.g. Xmx='4000m') are passed to the bbtools scripts as flags (-Xmx4000m)
+        if arg in ('Xmx', 'Xms'):
+            outstr += ' -{}{}'.format(arg, kwargs[arg])
+        else:
+            outstr += ' {}={}'.format(arg, kwargs[arg])
     return outstr
 
 
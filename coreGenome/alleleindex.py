@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import threading
+import hashlib
+import sqlite3
+import os
+
+__author__ = 'adamkoziol'
+
+# Name of the index database in the folder of core gene allele files
+INDEXFILE = 'alleleindex.sqlite'
+
+
+def sequencedigest(sequence):
+    """
+    :param sequence: string or bytes of the sequence
+    :return: 20-byte SHA-1 digest of the sequence. Sequences are compared exactly, so the case of the bases matters
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    return hashlib.sha1(sequence).digest()
+
+
+def fastarecords(allelefile, offset=0):
+    """
+    Parse the records of a FASTA file from a byte offset
+    :param allelefile: name and path of the FASTA file of the alleles of a gene
+    :param offset: byte offset of the start of a record
+    :return: generator of (record ID, bytes of the sequence). As with SeqIO, the ID is the header up to the first
+    whitespace
+    """
+    with open(allelefile, 'rb') as alleles:
+        alleles.seek(offset)
+        name = None
+        sequence = list()
+        for line in alleles:
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(sequence)
+                header = line[1:].split(None, 1)
+                name = header[0].decode() if header else str()
+                sequence = list()
+            elif name is not None:
+                sequence.append(line.strip())
+        if name is not None:
+            yield name, b''.join(sequence)
+
+
+def prefixdigest(allelefile, size):
+    """
+    :param allelefile: name and path of the FASTA file
+    :param size: number of bytes from the start of the file to hash
+    :return: hex digest of the first size bytes of the file
+    """
+    digest = hashlib.sha256()
+    remaining = size
+    with open(allelefile, 'rb') as alleles:
+        while remaining:
+            block = alleles.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def startsrecord(allelefile, offset):
+    """
+    :param allelefile: name and path of the FASTA file
+    :param offset: byte offset in the file
+    :return: boolean of whether a record header starts at the offset
+    """
+    with open(allelefile, 'rb') as alleles:
+        alleles.seek(offset)
+        return alleles.read(1) == b'>'
+
+
+class AlleleIndex(object):
+    """
+    Persistent index of sequence digest: allele for the core genes of a scheme, stored in a SQLite database beside the
+    allele files. Typing a sample is a single lookup per gene rather than a parse of the allele file of every gene.
+    The files are checked against the size and modification time recorded when they were indexed: files with new
+    alleles appended are updated incrementally, and any other changed file is indexed again
+    """
+
+    def allele(self, gene, sequence):
+        """
+        Find the allele of a gene with a sequence identical to the query
+        :param gene: name of the gene
+        :param sequence: sequence of the query
+        :return: name of the matching allele e.g. 'gene-12', or None if there is no exact match
+        """
+        with self.lock:
+            match = self.connection.execute('SELECT allele FROM alleles WHERE gene = ? AND digest = ?',
+                                            (gene, sequencedigest(sequence))).fetchone()
+        return match[0] if match else None
+
+    def update(self, allelefiles):
+        """
+        Index the allele files that have been added or changed since the index was last updated
+        :param allelefiles: list of names and paths of the allele FASTA files. The gene name is the file name up to
+        the first '.'
+        """
+        with self.lock, self.connection:
+            for allelefile in allelefiles:
+                gene = os.path.basename(allelefile).split('.')[0]
+                stat = os.stat(allelefile)
+                indexed = self.connection.execute('SELECT size, mtime, digest FROM files WHERE gene = ?',
+                                                  (gene,)).fetchone()
+                if indexed and indexed[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                # Alleles appended to a file are added to the index without parsing the existing alleles, as long as
+                # the previously indexed part of the file is unchanged, and the appended part starts a new record
+                if indexed and stat.st_size > indexed[0] and startsrecord(allelefile, indexed[0]) \
+                        and prefixdigest(allelefile, indexed[0]) == indexed[2]:
+                    offset = indexed[0]
+                else:
+                    offset = 0
+                    self.connection.execute('DELETE FROM alleles WHERE gene = ?', (gene,))
+                # As with comparing every allele in order, the last of any identical alleles is the match
+                self.connection.executemany('INSERT OR REPLACE INTO alleles VALUES (?, ?, ?)',
+                                            ((gene, sequencedigest(sequence), name)
+                                             for name, sequence in fastarecords(allelefile, offset)))
+                self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                        (gene, stat.st_size, stat.st_mtime_ns,
+                                         prefixdigest(allelefile, stat.st_size)))
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def connect(database):
+        """
+        Open the index database, and create its tables if necessary
+        :param database: name and path of the database file, or ':memory:'
+        :return: sqlite3 connection to the database
+        """
+        connection = sqlite3.connect(database, check_same_thread=False)
+        try:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS files '
+                                   '(gene TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT)')
+                connection.execute('CREATE TABLE IF NOT EXISTS alleles '
+                                   '(gene TEXT, digest BLOB, allele TEXT, PRIMARY KEY (gene, digest)) WITHOUT ROWID')
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def __init__(self, allelefolder, allelefiles=None):
+        """
+        :param allelefolder: name and path of the folder of allele files in which to store the index
+        :param allelefiles: optional list of the allele files to index. Defaults to the .fasta files in the folder
+        """
+        self.lock = threading.Lock()
+        try:
+            self.connection = self.connect(os.path.join(allelefolder, INDEXFILE))
+        # The alleles may be in a read-only location - the index is then created in memory for this run
+        except sqlite3.Error:
+            self.connection = self.connect(':memory:')
+        if allelefiles is None:
+            allelefiles = sorted(os.path.join(allelefolder, allelefile) for allelefile in os.listdir(allelefolder)
+                                 if allelefile.endswith('.fasta'))
+        try:
+            self.update(allelefiles)
+        # An existing index in a read-only location cannot be updated with changed allele files
+        except sqlite3.OperationalError:
+            self.connection.close()
+            self.connection = self.connect(':memory:')
+            self.update(allelefiles)
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 from accessoryFunctions.accessoryFunctions import MetadataObject, printtime
+from accessoryFunctions.blastparser import FIELDNAMES, parsecolumns
 from spadespipeline.GeneSeekr import GeneSeekr
 from Bio import SeqIO
-from csv import DictReader
 from glob import glob
 import operator
+import numpy
 import os
 
 __author__ = 'adamkoziol'
@@ -13,8 +14,8 @@ __author__ = 'adamkoziol'
 class CoreGenome(GeneSeekr):
 
     def blastparser(self, report, sample):
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
+        # Only the subject names and percent identities are required - load them as columns
+        blastcolumns = parsecolumns(report, fields=['subject_id'])
         resultdict = dict()
         coregenomes = list()
         # Create a list of all the names of the database files - glob, replace - with _, remove path and extension
@@ -29,15 +30,14 @@ class CoreGenome(GeneSeekr):
             resultdict[genome] = int()
         # A set to store the number of core genes
         coregenes = set()
+        # If the percent identity is greater than the cutoff - adjust the cutoff to 90% for these analyses
+        self.cutoff = 90
+        # Round the percent identity - (length of the alignment - number of mismatches) / total subject length
+        passing = numpy.round(blastcolumns['percentidentity'], 2) >= self.cutoff
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            # noinspection PyTypeChecker
-            percentidentity = float('{:0.2f}'.format((float(row['positives']) - float(row['gaps'])) /
-                                                     float(row['subject_length']) * 100))
+        for subject, passed in zip(blastcolumns['subject_id'], passing):
             # Split off any | from the sample name
-            target = row['subject_id'].split('|')[0]
+            target = subject.split('|')[0]
             # As there are variable numbers of _ in the name, try to split off the last one only if there are multiple
             # and only keep the first part of the split if there is one _ in the name
             underscored = '_'.join(target.split('_')[:-1]) if len(target.split('_')) > 2 else target.split('_')[0]
@@ -45,9 +45,7 @@ class CoreGenome(GeneSeekr):
                 # Since the number of core genes is the same for each reference strain, only need to determine it once
                 if underscored == sorted(coregenomes)[0]:
                     coregenes.add(target)
-                # If the percent identity is greater than the cutoff - adjust the cutoff to 90% for these analyses
-                self.cutoff = 90
-                if percentidentity >= self.cutoff:
+                if passed:
                     # Update the dictionary with the target and the number of hits
                     resultdict[underscored] += 1
             except (KeyError, IndexError):
@@ -140,25 +138,20 @@ class AnnotatedCore(object):
         :param report: the name and path of the BLAST outputs
         :param sample: the sample object
         """
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         # Create a list of all the names of the database files - glob, remove path and extension
         self.coregenomes = list(map(lambda x: os.path.basename(x).split('.')[0],
                                     glob(os.path.join(self.reffilepath,
                                                       self.analysistype,
                                                       sample.general.referencegenus,
                                                       '*.tfa'))))
-        # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            percentidentity = float('{:0.2f}'.format((float(row['positives']) - float(row['gaps'])) /
-                                                     float(row['subject_length']) * 100))
-            # Split off any | and - from the sample name
-            target = row['subject_id'].split('|')[0].split('-')[0]
-            # If the hit passes the cutoff threshold, add it to the set of core genes present
-            if percentidentity >= self.cutoff:
-                sample[self.analysistype].coreset.add(target)
+        # Only the subject names and percent identities are required - load them as columns
+        blastcolumns = parsecolumns(report, fields=['subject_id'])
+        # Round the percent identity - (length of the alignment - number of mismatches) / total subject length
+        passing = numpy.round(blastcolumns['percentidentity'], 2) >= self.cutoff
+        # Go through each BLAST result that passes the cutoff threshold
+        for subject in numpy.array(blastcolumns['subject_id'], dtype=object)[passing]:
+            # Split off any | and - from the sample name, and add it to the set of core genes present
+            sample[self.analysistype].coreset.add(subject.split('|')[0].split('-')[0])
 
     def reporter(self):
         """
@@ -200,9 +193,6 @@ class AnnotatedCore(object):
         self.cutoff = 90
         self.coregenomes = list()
         # Fields used for custom outfmt 6 BLAST output:
-        self.fieldnames = ['query_id', 'subject_id', 'positives', 'mismatches', 'gaps',
-                           'evalue', 'bit_score', 'subject_length', 'alignment_length',
-                           'query_start', 'query_end', 'query_sequence',
-                           'subject_start', 'subject_end', 'subject_sequence']
+        self.fieldnames = FIELDNAMES
         # Run the analyses
         self.annotatedcore()
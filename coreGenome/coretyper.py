@@ -3,8 +3,11 @@
 import accessoryFunctions.metadataprinter as metadataprinter
 from spadespipeline.mMLST import *
 from accessoryFunctions.accessoryFunctions import *
+from coreGenome.alleleindex import AlleleIndex
+from csv import DictReader
 from glob import glob
 import threading
+import operator
 __author__ = 'adamkoziol'
 
 
@@ -274,6 +277,8 @@ class CoreTyper(object):
         """
         Determine allele of each gene
         """
+        # Index the alleles of the core genes. Only allele files added or changed since the last analysis are parsed
+        self.alleleindex = AlleleIndex(self.coregenelocation, self.genes)
         # Create and start threads
         for i in range(self.cpus):
             # Send the threads to the appropriate destination function
@@ -286,18 +291,21 @@ class CoreTyper(object):
             sample[self.analysistype].allelematches = dict()
             self.allelequeue.put(sample)
         self.allelequeue.join()
+        self.alleleindex.close()
 
     def allelematch(self):
         while True:
             sample = self.allelequeue.get()
             # Iterate through all the core genes
             for name, gene in sample[self.analysistype].corepresence.items():
-                # Iterate through all the alleles for the gene
-                for record in SeqIO.parse(open(self.alleledict[gene], 'r'), 'fasta'):
-                    # If the current genes matches the database alleles
-                    if str(record.seq) == sample[self.analysistype].coresequence[name]:
-                        # Set the gene to the corresponding allele number
-                        sample[self.analysistype].allelematches[gene] = record.id
+                try:
+                    # Find the allele with a sequence identical to the sequence of the gene
+                    allele = self.alleleindex.allele(gene, sample[self.analysistype].coresequence[name])
+                except KeyError:
+                    continue
+                if allele is not None:
+                    # Set the gene to the corresponding allele number
+                    sample[self.analysistype].allelematches[gene] = allele
             self.allelequeue.task_done()
 
     def sequencetyper(self):
@@ -2,18 +2,25 @@
 from accessoryFunctions.accessoryFunctions import printtime, GenObject, MetadataObject, make_path
 import accessoryFunctions.metadataprinter as metadataprinter
 from spadespipeline import fileprep, createobject
+from accessoryFunctions.scheduler import TaskScheduler, batches
+from metagenomefilter.clarkparser import loadtotals
 from metagenomefilter import filtermetagenome
 from argparse import ArgumentParser
 from shutil import move, which
-from threading import Thread
-from csv import DictReader
-from queue import Queue
+from csv import DictReader, writer
+import multiprocessing
 import subprocess
 import xlsxwriter
 import time
 import os
 __author__ = 'adamkoziol'
 
+# Approximate peak memory in megabytes of a classify_metagenome.sh --light call. CLARK-l loads the entire (reduced)
+# database for each call, so this sets the number of batches that can be classified at once
+CLARKMEMORY = 4000
+# Maximum number of samples in a classification batch. Abundance estimation of a sample starts once its batch is done
+BATCHSIZE = 20
+
 
 class CLARK(object):
 
@@ -27,9 +34,10 @@ class CLARK(object):
         if self.clean_seqs:
             self.clean_sequences()
         self.lists()
+        # Classify the metagenome(s), and estimate the abundance of taxonomic groups in each sample
         self.classifymetagenome()
-        # Estimate the abundance
-        self.estimateabundance()
+        # Find the total length of the contigs assigned to each taxID
+        self.aggregate()
         # Create reports
         self.reports()
 
@@ -75,64 +83,33 @@ class CLARK(object):
             os.remove(sample.general.combined.replace('.f', '_noplasmid.f'))
 
     def classifymetagenome(self):
-        """Run the classify metagenome of the CLARK package on the samples"""
-        printtime('Classifying metagenomes', self.start)
-        # Define the system call
-        self.classifycall = 'cd {} && ./classify_metagenome.sh -O {} -R {} -n {} --light'\
-            .format(self.clarkpath,
-                    self.filelist,
-                    self.reportlist,
-                    self.cpus)
-        # Variable to store classification state
-        classify = True
-        for sample in self.runmetadata.samples:
-            try:
-                # Define the name of the .csv classification file
-                sample.general.classification = sample.general.combined.split('.')[0] + '.csv'
-                # If the file exists, then set classify to False
-                if os.path.isfile(sample.general.classification):
-                    classify = False
-            except KeyError:
-                pass
-        # Run the system call if the samples have not been classified
-        if classify:
-            # Run the call
-            subprocess.call(self.classifycall, shell=True, stdout=self.devnull, stderr=self.devnull)
-
-    def lists(self):
         """
-        Prepare the list of files to be processed
+        Run the classify metagenome of the CLARK package on the samples missing a classification file. The samples are
+        split into batches, and several batches are classified at once as memory allows. The abundance of taxonomic
+        groups in each sample is estimated as soon as its batch is classified
         """
-        # Prepare the lists to be used to classify the metagenomes
-        with open(self.filelist, 'w') as filelist:
-            with open(self.reportlist, 'w') as reportlist:
-                for sample in self.runmetadata.samples:
-                    if self.extension == 'fastq':
-                        try:
-                            status = sample.run.Description
-                            if status == 'metagenome':
-                                filelist.write(sample.general.combined + '\n')
-                                reportlist.write(sample.general.combined.split('.')[0] + '\n')
-                        except KeyError:
-                            pass
-                    else:
-                        if sample.general.combined != 'NA':
-                            filelist.write(sample.general.combined + '\n')
-                            reportlist.write(sample.general.combined.split('.')[0] + '\n')
-
-    def estimateabundance(self):
-        """
-        Estimate the abundance of taxonomic groups
-        """
-        printtime('Estimating abundance of taxonomic groups', self.start)
-        # Create and start threads
-        for i in range(self.cpus):
-            # Send the threads to the appropriate destination function
-            threads = Thread(target=self.estimate, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
+        printtime('Classifying metagenomes', self.start)
+        scheduler = TaskScheduler(self.threads, start=self.start)
+        # Only classify the samples without a classification file
+        unclassified = [sample for sample in self.classifysamples if not os.path.isfile(sample.general.classification)]
+        classifybatches = batches(unclassified, scheduler.memory, CLARKMEMORY, BATCHSIZE)
+        batchnames = dict()
+        classifycalls = dict()
+        for index, batch in enumerate(classifybatches):
+            # Each batch has its own lists of files and reports
+            filelist = '{}_{}.txt'.format(os.path.splitext(self.filelist)[0], index)
+            reportlist = '{}_{}.txt'.format(os.path.splitext(self.reportlist)[0], index)
+            # Define the system call
+            classifycall = 'cd {} && ./classify_metagenome.sh -O {} -R {} -n {} --light'\
+                .format(self.clarkpath,
+                        filelist,
+                        reportlist,
+                        self.cpus)
+            batchname = scheduler.add(('classify', index), self.classify, (batch, filelist, reportlist, classifycall),
+                                      cpus=self.cpus, memory=CLARKMEMORY)
+            for sample in batch:
+                batchnames[sample.name] = batchname
+                classifycalls[sample.name] = classifycall
         for sample in self.runmetadata.samples:
             try:
                 if sample.general.combined != 'NA':
@@ -141,29 +118,96 @@ class CLARK(object):
                     # if not hasattr(sample, 'commands'):
                     if not sample.commands.datastore:
                         sample.commands = GenObject()
-
                     # Define system calls
                     sample.commands.target = self.targetcall
-                    sample.commands.classify = self.classifycall
+                    if sample.name in classifycalls:
+                        sample.commands.classify = classifycalls[sample.name]
                     sample.commands.abundancecall = \
                         'cd {} && ./estimate_abundance.sh -D {} -F {} > {}'.format(self.clarkpath,
                                                                                    self.databasepath,
                                                                                    sample.general.classification,
                                                                                    sample.general.abundance)
-                    self.abundancequeue.put(sample)
+                    # Wait for the classification of the sample (if necessary)
+                    dependencies = [batchnames[sample.name]] if sample.name in batchnames else list()
+                    scheduler.add(('abundance', sample.name), self.estimate, (sample,), dependencies=dependencies)
             except KeyError:
                 pass
-        self.abundancequeue.join()
+        scheduler.run()
+        # Record the time taken by each batch to help tune the batch sizes
+        make_path(self.reportpath)
+        with open(os.path.join(self.reportpath, 'classificationbatches.csv'), 'w') as timing:
+            timing.write('Batch,Samples,Classification(s),Abundance(s)\n')
+            for index, batch in enumerate(classifybatches):
+                abundancetime = sum(scheduler.tasks[('abundance', sample.name)]['wallclock'] or 0 for sample in batch
+                                    if ('abundance', sample.name) in scheduler.tasks)
+                timing.write('{},{},{},{}\n'.format(index,
+                                                   len(batch),
+                                                   scheduler.tasks[('classify', index)]['wallclock'],
+                                                   round(abundancetime, 2)))
 
-    def estimate(self):
-        while True:
-            sample = self.abundancequeue.get()
+    def classify(self, batch, filelist, reportlist, classifycall):
+        """
+        Classify a batch of samples with a single call to CLARK, so the database is only loaded once for the batch
+        :param batch: list of the samples in the batch
+        :param filelist: name and path of the list of the files to classify
+        :param reportlist: name and path of the list of the names of the classification reports
+        :param classifycall: system call to classify the batch
+        """
+        with open(filelist, 'w') as files:
+            with open(reportlist, 'w') as reports:
+                for sample in batch:
+                    files.write(sample.general.combined + '\n')
+                    reports.write(sample.general.combined.split('.')[0] + '\n')
+        # Run the call
+        subprocess.call(classifycall, shell=True, stdout=self.devnull, stderr=self.devnull)
+        for listfile in (filelist, reportlist):
+            os.remove(listfile)
+
+    def lists(self):
+        """
+        Prepare the list of samples to be processed
+        """
+        self.classifysamples = list()
+        for sample in self.runmetadata.samples:
+            try:
+                # Define the name of the .csv classification file
+                sample.general.classification = sample.general.combined.split('.')[0] + '.csv'
+            except KeyError:
+                continue
+            if self.extension == 'fastq':
+                try:
+                    status = sample.run.Description
+                    if status == 'metagenome':
+                        self.classifysamples.append(sample)
+                except KeyError:
+                    pass
+            else:
+                if sample.general.combined != 'NA':
+                    self.classifysamples.append(sample)
 
-            # Run the system call (if necessary)
-            if not os.path.isfile(sample.general.abundance):
-                #
-                subprocess.call(sample.commands.abundancecall, shell=True, stdout=self.devnull, stderr=self.devnull)
-            self.abundancequeue.task_done()
+    def estimate(self, sample):
+        # Run the system call (if necessary)
+        if not os.path.isfile(sample.general.abundance):
+            subprocess.call(sample.commands.abundancecall, shell=True, stdout=self.devnull, stderr=self.devnull)
+
+    def aggregate(self):
+        """
+        Find the number of contigs, and the total length of the contigs assigned to each taxonomic group in a single
+        pass through each classification file. The totals are cached in a .csv file beside the abundance report
+        """
+        if self.runmetadata.extension != 'fasta':
+            return
+        printtime('Calculating total base pairs of taxonomic groups', self.start)
+        for sample in self.runmetadata.samples:
+            try:
+                if sample.general.combined != 'NA':
+                    sample.general.totals = sample.general.combined.split('.')[0] + '_totals.csv'
+                    # self.cpus only limits CLARK itself, so the classification file is parsed with self.threads
+                    self.taxontotals[sample.name] = loadtotals(sample.general.classification,
+                                                               sample.general.totals,
+                                                               self.threads)
+            except (KeyError, FileNotFoundError):
+                pass
 
     def reports(self):
         """
@@ -193,6 +237,11 @@ class CLARK(object):
         # Add an additional header for .fasta analyses
         if self.runmetadata.extension == 'fasta':
             headers.insert(4, 'TotalBP')
+        # The results are also written to a .csv summary beside the report. Names and lineages may contain commas, so
+        # they are quoted
+        summary = open(os.path.splitext(self.report)[0] + '.csv', 'w', newline='')
+        summarywriter = writer(summary)
+        summarywriter.writerow(headers)
         # Populate the headers
         for category in headers:
             # Write the data in the specified cell (row, col) using the bold format
@@ -232,10 +281,6 @@ class CLARK(object):
                     worksheet.set_column(0, 0, longeststrain)
                 # Sort the abundance results based on the highest count
                 sortedabundance = sorted(sample.general.passfilter, key=lambda x: int(x['Count']), reverse=True)
-                # Set of contigs from the classification file. For some reason, certain contigs are represented multiple
-                # times in the classification file. As far as I can tell, these multiple representations are always
-                # classified the same, and, therefore, should be treated as duplicates, and ignored
-                contigset = set()
                 for result in sortedabundance:
                     # Add the total number of base pairs classified for each TaxID. As only the total number of contigs
                     # classified as a particular TaxID are in the report, it can be misleading if a large number
@@ -244,19 +289,11 @@ class CLARK(object):
                     # contigs added together are only 69602 bp. While this is unlikely a pure culture, only
                     # 69602 / (4705838 + 69602) = 1.5% of the total bp map to TaxID 630 compared to 45% of the contigs
                     if self.runmetadata.extension == 'fasta':
-                        # Initialise a variable to store the total bp mapped to the TaxID
-                        result['TotalBP'] = int()
-                        # Read the classification file into a dictionary
-                        classificationdict = DictReader(open(sample.general.classification))
-                        # Read through each contig classification in the dictionary
-                        for contig in classificationdict:
-                            # Pull out each contig with a TaxID that matches the TaxID of the result of interest, and
-                            # is not present in a set of contigs that have already been added to the dictionary
-                            if result['TaxID'] == contig[' Assignment'] and contig['Object_ID'] not in contigset:
-                                # Increment the total bp mapping to the TaxID by the integer of each contig
-                                result['TotalBP'] += int(contig[' Length'])
-                                # Avoid duplicates by adding the contig name to the set of contigs
-                                contigset.add(contig['Object_ID'])
+                        # Use the total bp of the contigs mapped to the TaxID. Contigs represented multiple times
+                        # in the classification file are only counted once
+                        result['TotalBP'] = self.taxontotals.get(sample.name, dict()).get(result['TaxID'], [0, 0])[1]
+                    # Add the results to the machine-readable summary
+                    summarywriter.writerow([sample.name] + [result[header] for header in headers[1:]])
                     # Print the results to file
                     # Ignore the first header, as it is the strain name, which has already been added to the report
                     dictionaryheaders = headers[1:]
@@ -279,8 +316,9 @@ class CLARK(object):
             except KeyError:
                 # Increase the row
                 row += 1
-        # Close the workbook
+        # Close the workbook and the summary
         workbook.close()
+        summary.close()
 
     def __init__(self, args, pipelinecommit, startingtime, scriptpath):
         # Initialise variables
@@ -299,6 +337,8 @@ class CLARK(object):
             .format(self.databasepath)
         # There seems to be an issue with CLARK when running with a very high number of cores. Limit self.cpus to 1
         self.cpus = 1
+        # Several batches of samples can still be classified at once, each with its own CLARK call
+        self.threads = int(args.threads) if args.threads else multiprocessing.cpu_count()
         # Set variables from the arguments
         self.database = args.database
         self.rank = args.rank
@@ -306,11 +346,11 @@ class CLARK(object):
         self.cutoff = float(args.cutoff) * 100
         # Initialise variables for the analysis
         self.targetcall = str()
-        self.classifycall = str()
         self.devnull = open(os.devnull, 'wb')
         self.filelist = os.path.join(self.path, 'sampleList.txt')
         self.reportlist = os.path.join(self.path, 'reportList.txt')
-        self.abundancequeue = Queue()
+        self.classifysamples = list()
+        self.taxontotals = dict()
         self.datapath = str()
         self.reportpath = os.path.join(self.path, 'reports')
         self.clean_seqs = args.clean_seqs
@@ -368,6 +408,10 @@ class CLARK(object):
                                 move(sample.general.classification,
                                      os.path.join(sample[clarkextension].outputpath,
                                                   os.path.basename(sample.general.classification)))
+                                if self.extension == 'fasta':
+                                    move(sample.general.totals,
+                                         os.path.join(sample[clarkextension].outputpath,
+                                                      os.path.basename(sample.general.totals)))
                             except (KeyError, FileNotFoundError):
                                 pass
                             # Set the CLARK-specific attributes
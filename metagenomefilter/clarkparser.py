@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+from multiprocessing import Pool
+import mmap
+import os
+
+__author__ = 'adamkoziol'
+
+
+def byteranges(classificationfile, parts):
+    """
+    Split a CLARK classification file into byte ranges that start and end on line boundaries
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param parts: number of ranges to create. Fewer ranges are returned for small files
+    :return: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(classificationfile)
+    if not size:
+        return list()
+    boundaries = [0]
+    with open(classificationfile, 'rb') as classification:
+        with mmap.mmap(classification.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for part in range(1, parts):
+                # The range ends at the first newline following the approximate boundary
+                position = mapped.find(b'\n', max(size * part // parts, boundaries[-1]))
+                if position == -1 or position + 1 >= size:
+                    break
+                boundaries.append(position + 1)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def classificationrows(classificationfile, start=0, end=None):
+    """
+    Parse the rows of a byte range of a CLARK classification file without decoding them
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param start: byte offset of the first line of the range
+    :param end: byte offset following the last line of the range. Defaults to the end of the file
+    :return: generator of (Object_ID, Length, Assignment) bytes for each row. The header is skipped
+    """
+    if not os.path.getsize(classificationfile):
+        return
+    with open(classificationfile, 'rb') as classification:
+        with mmap.mmap(classification.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            end = len(mapped) if end is None else end
+            mapped.seek(start)
+            while mapped.tell() < end:
+                data = mapped.readline().split(b',')
+                # Each row contains: Object_ID, Length, Assignment
+                if len(data) < 3 or data[0] == b'Object_ID':
+                    continue
+                yield data[0].strip(), data[1].strip(), data[2].strip()
+
+
+def rangemap(function, classificationfile, processes, *args):
+    """
+    Apply a function to byte ranges of a CLARK classification file in a pool of processes
+    :param function: module-level function accepting the name of the file, the start and end of the range, and args
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param processes: number of processes to use. The file is split into this many ranges
+    :param args: additional arguments to pass to the function
+    :return: list of the results of each range, in the order of the ranges in the file
+    """
+    ranges = byteranges(classificationfile, max(1, int(processes)))
+    jobs = [(classificationfile, start, end) + args for start, end in ranges]
+    if len(jobs) > 1:
+        with Pool(processes=len(jobs)) as pool:
+            return pool.starmap(function, jobs)
+    return [function(*job) for job in jobs]
+
+
+def rangecontigs(classificationfile, start, end):
+    """
+    Find the assignment and length of each contig in a byte range of a CLARK classification file
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param start: byte offset of the first line of the range
+    :param end: byte offset following the last line of the range
+    :return: dictionary of contig name: (assignment, length). Only the first row of a contig is used
+    """
+    contigs = dict()
+    for contig, length, assignment in classificationrows(classificationfile, start, end):
+        try:
+            contigs.setdefault(contig, (assignment, int(length)))
+        except ValueError:
+            continue
+    return contigs
+
+
+def taxontotals(classificationfile, processes=1):
+    """
+    Find the number of contigs and the total length of the contigs assigned to each taxID in a CLARK classification
+    file. Certain contigs are represented multiple times in the classification file. As these multiple representations
+    are always classified the same, only the first row of each contig is counted
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param processes: number of processes to use
+    :return: dictionary of taxID: [number of contigs, total bp]
+    """
+    contigs = dict()
+    # The ranges are returned in the order of the file, so the first row of each contig is kept
+    for assignments in rangemap(rangecontigs, classificationfile, processes):
+        for contig, assignment in assignments.items():
+            contigs.setdefault(contig, assignment)
+    totals = dict()
+    for assignment, length in contigs.values():
+        total = totals.setdefault(assignment.decode(), [0, 0])
+        total[0] += 1
+        total[1] += length
+    return totals
+
+
+def loadtotals(classificationfile, totalsfile, processes=1):
+    """
+    Load the totals of each taxID from a cached .csv file, or create the file if it is missing, or older than the
+    classification file
+    :param classificationfile: name and path of the CLARK .csv classification file
+    :param totalsfile: name and path of the .csv file of the totals
+    :param processes: number of processes to use
+    :return: dictionary of taxID: [number of contigs, total bp]
+    """
+    if os.path.isfile(totalsfile) and os.path.getmtime(totalsfile) >= os.path.getmtime(classificationfile):
+        totals = dict()
+        with open(totalsfile) as cached:
+            # Skip the header
+            next(cached)
+            for row in cached:
+                taxid, contigs, totalbp = row.rstrip().split(',')
+                totals[taxid] = [int(contigs), int(totalbp)]
+        return totals
+    totals = taxontotals(classificationfile, processes)
+    # Write the totals to a temporary file, and move it into place once complete
+    with open(totalsfile + '.tmp', 'w') as cached:
+        cached.write('TaxID,Contigs,TotalBP\n')
+        for taxid, (contigs, totalbp) in sorted(totals.items(), key=lambda x: x[1][1], reverse=True):
+            cached.write('{},{},{}\n'.format(taxid, contigs, totalbp))
+    os.replace(totalsfile + '.tmp', totalsfile)
+    return totals
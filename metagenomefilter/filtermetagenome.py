@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 import subprocess
-from threading import Thread
 from csv import DictReader
+from multiprocessing import Pool
 from accessoryFunctions.accessoryFunctions import *
 import accessoryFunctions.metadataprinter as metadataprinter
+from metagenomefilter.readbinning import binreads
 __author__ = 'adamkoziol'
 
 
@@ -42,123 +43,49 @@ class FilterGenome(object):
             for taxid in sample.general.taxids:
                 # Create the an attribute for each taxID
                 setattr(sample, taxid, GenObject())
-                sample[taxid].readlist = list()
         # Print the metadata to file
         metadataprinter.MetadataPrinter(self)
-        # Load the assignment file to memory
-        self.loadassignment()
-
-    def loadassignment(self):
-        """Load the taxonomic assignment for each read"""
-        printtime('Finding taxonomic assignments', self.start)
-        # Create and start threads
-        for i in range(self.cpus):
-            # Send the threads to the appropriate destination function
-            threads = Thread(target=self.assignmentload, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
-        for sample in self.runmetadata.samples:
-            self.loadqueue.put(sample)
-        self.loadqueue.join()
-        # Filter the .fastq files
-        self.readlist()
-
-    def assignmentload(self):
-        while True:
-            sample = self.loadqueue.get()
-            # Initialise dictionaries to store results
-            sample.general.fastqassignment = dict()
-            sample.general.reads = dict()
-            # Read the assignment file into a dictionary
-            with open(sample.general.assignmentfile, 'rb') as assignmentcsv:
-                for row in assignmentcsv:
-                    # Split on ','
-                    data = row.split(',')
-                    # Each row contains: Object_ID, Length, Assignment
-                    # If the Assignment is one of the taxIDs of interest
-                    if data[2].rstrip() in sample.general.taxids:
-                        # Add the read name to the list of reads associated with that taxID
-                        sample[data[2].rstrip()].readlist.append(data[0])
-            self.loadqueue.task_done()
-
-    def readlist(self):
-        """Sort the reads, and create lists to be used in creating sorted .fastq files"""
-        printtime('Sorting reads', self.start)
-        # Create and start threads
-        for i in range(self.cpus):
-            # Send the threads to the appropriate destination function
-            threads = Thread(target=self.listread, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
-        for sample in self.runmetadata.samples:
-            self.listqueue.put(sample)
-        self.listqueue.join()
-        # Create
+        # Sort the reads into files based on their taxonomic assignments
         self.fastqfilter()
 
-    def listread(self):
-        while True:
-            sample = self.listqueue.get()
+    def fastqfilter(self):
+        """Filter the reads into separate files based on taxonomic assignment"""
+        printtime('Creating filtered .fastqfiles', self.start)
+        jobs = dict()
+        for sample in self.runmetadata.samples:
             # Set and create the path of the sorted fastq files
             sample.general.sortedfastqpath = os.path.join(sample.general.outputdirectory, 'sortedFastq')
             make_path(sample.general.sortedfastqpath)
-            # Initialise dictionaries to hold data
-            sample.general.fastqlist = dict()
+            # Set the name of the .fastq file that will store the filtered reads of each taxID
             sample.general.filteredfastq = dict()
-            # Iterate through the taxIDs
             for taxid in sample.general.taxids:
-                # Set the name of the list to store all the reads associated with the taxID
-                sample.general.fastqlist[taxid] = '{}/{}_{}.txt'.format(sample.general.sortedfastqpath, sample.name,
-                                                                        taxid)
-                # Set the name of the .fastq file that will store the filtered reads
                 sample.general.filteredfastq[taxid] = '{}/{}_{}.fastq.gz'.format(sample.general.sortedfastqpath,
                                                                                  sample.name, taxid)
-                # Open the list, and write the list of all reads, one per line
-                with open(sample.general.fastqlist[taxid], 'w') as binned:
-                    binned.write('\n'.join(set(sample[taxid].readlist)))
-            self.listqueue.task_done()
-
-    def fastqfilter(self):
-        """Filter the reads into separate files based on taxonomic assignment"""
-        printtime('Creating filtered .fastqfiles', self.start)
-        # Create and start threads
-        for i in range(self.cpus):
-            # Send the threads to the appropriate destination function
-            threads = Thread(target=self.filterfastq, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
+            # Only bin the reads of the taxIDs without a filtered file
+            outputs = {taxid: filteredfastq for taxid, filteredfastq in sample.general.filteredfastq.items()
+                       if not os.path.isfile(filteredfastq)}
+            if outputs:
+                jobs[sample.name] = (sample.general.fastqfiles[0], sample.general.assignmentfile, outputs)
+        # Each sample is binned in a single pass through its reads, so multiple samples are processed in parallel. The
+        # workers of a pool cannot start processes of their own, so the assignment file of a single sample is instead
+        # parsed in parallel. The CPUs are split between the workers for compressing the bins
+        readcounts = dict()
+        if len(jobs) > 1 and int(self.cpus) > 1:
+            workers = min(int(self.cpus), len(jobs))
+            with Pool(processes=workers) as pool:
+                pending = {name: pool.apply_async(binreads, job, {'threads': max(1, int(self.cpus) // workers)})
+                           for name, job in jobs.items()}
+                readcounts = {name: result.get() for name, result in pending.items()}
+        elif jobs:
+            readcounts = {name: binreads(*job, processes=int(self.cpus), threads=int(self.cpus))
+                          for name, job in jobs.items()}
         for sample in self.runmetadata.samples:
-            self.filterqueue.put(sample)
-        self.filterqueue.join()
+            for taxid, readcount in readcounts.get(sample.name, dict()).items():
+                sample[taxid].readcount = readcount
         # Print the metadata to file
         metadataprinter.MetadataPrinter(self)
 
-    def filterfastq(self):
-        from subprocess import call
-        while True:
-            sample = self.filterqueue.get()
-            # Iterate through the taxIDs
-            for taxid in sample.general.taxids:
-                # Set the system call to seqtk to subsequence the fastq file
-                sample.general.seqtkcall = 'seqtk subseq {} {} | gzip > {}' \
-                    .format(sample.general.fastqfiles[0],
-                            sample.general.fastqlist[taxid],
-                            sample.general.filteredfastq[taxid])
-                # Run the system call only if the filtered file does not exist
-                if not os.path.isfile(sample.general.filteredfastq[taxid]):
-                    call(sample.general.seqtkcall, shell=True, stdout=self.devnull, stderr=self.devnull)
-                # Delete the large list stored in the object
-                delattr(sample[taxid], "readlist")
-            self.filterqueue.task_done()
-
     def __init__(self, inputobject):
-        from queue import Queue
         # Define variables based on supplied arguments
         self.start = inputobject.start
         self.path = inputobject.path
@@ -171,11 +98,6 @@ class FilterGenome(object):
         self.cutoff = inputobject.cutoff
         # Initialise a variable to hold the sample objects
         self.runmetadata = inputobject.runmetadata if inputobject.runmetadata else MetadataObject()
-        # Initialise queues
-        self.loadqueue = Queue()
-        self.listqueue = Queue()
-        self.filterqueue = Queue()
-        self.devnull = open(os.devnull, 'wb')
 
 # If the script is called from the command line, then call the argument parser
 if __name__ == '__main__':
@@ -241,7 +163,6 @@ if __name__ == '__main__':
 class PipelineInit(object):
 
     def __init__(self, inputobject):
-        from queue import Queue
         # Define variables based on supplied arguments
         self.start = inputobject.start
         self.path = inputobject.path
@@ -254,11 +175,6 @@ class PipelineInit(object):
         self.cutoff = inputobject.cutoff
         # Initialise a variable to hold the sample objects
         self.runmetadata = inputobject.runmetadata
-        # Initialise queues
-        self.loadqueue = Queue()
-        self.listqueue = Queue()
-        self.filterqueue = Queue()
-        self.devnull = open(os.devnull, 'wb')
         # Run the pipeline
         genome = FilterGenome(self)
         genome.objectprep()
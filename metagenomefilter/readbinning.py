@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+from metagenomefilter.clarkparser import classificationrows, rangemap
+from multiprocessing.pool import ThreadPool
+from array import array
+import hashlib
+import numpy
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+
+def readkey(name):
+    """
+    Hash the ID of a read to a 64-bit integer. Storing the hashes rather than the IDs keeps the assignments of tens of
+    millions of reads in memory. Unlike the built-in hash, the hash is the same in every process, so the assignment
+    file can be loaded in parallel
+    :param name: bytes of the read ID
+    :return: integer hash of the read ID
+    """
+    return int.from_bytes(hashlib.md5(name).digest()[:8], 'little', signed=True)
+
+
+def assignmentrange(assignmentfile, start, end, taxids):
+    """
+    Hash the reads assigned to the taxIDs of interest in a byte range of a CLARK assignment file
+    :param assignmentfile: name and path of the CLARK .csv file
+    :param start: byte offset of the first line of the range
+    :param end: byte offset following the last line of the range
+    :param taxids: list of the taxIDs of interest
+    :return: numpy array of the keys of the assigned reads, numpy array of the index of the taxID of each read
+    """
+    taxonindex = {taxid.encode(): index for index, taxid in enumerate(taxids)}
+    keys = array('q')
+    indices = array('H')
+    for readid, length, assignment in classificationrows(assignmentfile, start, end):
+        # Ignore reads with assignments outside the taxIDs of interest
+        try:
+            index = taxonindex[assignment]
+        except KeyError:
+            continue
+        keys.append(readkey(readid))
+        indices.append(index)
+    keys = numpy.frombuffer(keys, dtype=numpy.int64) if keys else numpy.zeros(0, dtype=numpy.int64)
+    indices = numpy.frombuffer(indices, dtype=numpy.uint16) if indices else numpy.zeros(0, dtype=numpy.uint16)
+    return keys, indices
+
+
+def loadassignments(assignmentfile, taxids, processes=1):
+    """
+    Load the reads assigned to the taxIDs of interest from a CLARK assignment file
+    :param assignmentfile: name and path of the CLARK .csv file. Each row contains: Object_ID, Length, Assignment
+    :param taxids: list of the taxIDs of interest
+    :param processes: number of processes used to parse the assignment file
+    :return: sorted numpy array of the keys of the assigned reads, numpy array of the index of the taxID of each read
+    """
+    ranges = rangemap(assignmentrange, assignmentfile, processes, list(taxids))
+    if not ranges:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.uint16)
+    # The ranges are returned in the order of the file
+    keys = numpy.concatenate([rangekeys for rangekeys, rangeindices in ranges])
+    indices = numpy.concatenate([rangeindices for rangekeys, rangeindices in ranges])
+    # Reads listed more than once are kept in the first bin to which they are assigned
+    keys, first = numpy.unique(keys, return_index=True)
+    return keys, indices[first]
+
+
+def fastqrecords(fastqfile, batchsize=1 << 16, chunksize=1 << 22):
+    """
+    Read a (gzipped) FASTQ file in large chunks
+    :param fastqfile: name and path of the FASTQ file
+    :param batchsize: maximum number of records in each batch
+    :param chunksize: number of (decompressed) bytes to read at a time
+    :return: generator of lists of (read ID, bytes of the four lines of the record)
+    """
+    opener = gzip.open if fastqfile.endswith('.gz') else open
+    remainder = list()
+    batch = list()
+    with opener(fastqfile, 'rb') as fastq:
+        for chunk in iter(lambda: fastq.read(chunksize), b''):
+            lines = chunk.split(b'\n')
+            # Join the partial line at the end of the previous chunk to the first line of this chunk
+            if remainder:
+                lines[0] = remainder.pop() + lines[0]
+                lines = remainder + lines
+            complete = (len(lines) - 1) // 4 * 4
+            remainder = lines[complete:]
+            for start in range(0, complete, 4):
+                record = lines[start:start + 4]
+                # The read ID is the header up to the first whitespace, as in the CLARK assignment file
+                batch.append((record[0][1:].split(None, 1)[0], b'\n'.join(record) + b'\n'))
+                if len(batch) == batchsize:
+                    yield batch
+                    batch = list()
+    # The last record of a file without a trailing newline
+    if len(remainder) == 4 and remainder[0]:
+        batch.append((remainder[0][1:].split(None, 1)[0], b'\n'.join(remainder) + b'\n'))
+    if batch:
+        yield batch
+
+
+def binreads(fastqfile, assignmentfile, outputs, buffersize=1 << 22, processes=1, threads=1):
+    """
+    Sort the reads of a FASTQ file into a gzipped FASTQ file for each taxID of interest in a single pass. Compressing
+    the bins is delegated to a pool of threads (zlib releases the GIL), so all the outputs are written concurrently
+    with the parsing of the reads. Each bin is written to a temporary file, which is only renamed once complete
+    :param fastqfile: name and path of the (gzipped) FASTQ file
+    :param assignmentfile: name and path of the CLARK .csv assignment file
+    :param outputs: dictionary of taxID: name and path of the gzipped FASTQ file of the reads assigned to the taxID
+    :param buffersize: number of bytes of reads to collect for a bin before compressing them
+    :param processes: number of processes used to parse the assignment file
+    :param threads: number of threads used to compress the bins
+    :return: dictionary of taxID: number of reads written to the bin
+    """
+    taxids = sorted(outputs)
+    if not taxids:
+        return dict()
+    keys, indices = loadassignments(assignmentfile, taxids, processes)
+    temporary = [outputs[taxid] + '.tmp' for taxid in taxids]
+    handles = [gzip.open(path, 'wb', compresslevel=6) for path in temporary]
+    buffers = [list() for _ in taxids]
+    sizes = [0] * len(taxids)
+    counts = [0] * len(taxids)
+    # Only one compression job per bin may be pending, so that the records of each bin are written in order
+    pending = [None] * len(taxids)
+    pool = ThreadPool(max(1, min(len(taxids), int(threads))))
+
+    def flush(index):
+        if pending[index] is not None:
+            pending[index].get()
+        pending[index] = pool.apply_async(handles[index].write, (b''.join(buffers[index]),))
+        buffers[index] = list()
+        sizes[index] = 0
+    try:
+        for batch in fastqrecords(fastqfile):
+            if not len(keys):
+                break
+            batchkeys = numpy.fromiter((readkey(name) for name, record in batch), dtype=numpy.int64, count=len(batch))
+            positions = numpy.minimum(numpy.searchsorted(keys, batchkeys), len(keys) - 1)
+            matched = numpy.flatnonzero(keys[positions] == batchkeys)
+            for position, index in zip(matched.tolist(), indices[positions[matched]].tolist()):
+                record = batch[position][1]
+                buffers[index].append(record)
+                sizes[index] += len(record)
+                counts[index] += 1
+                if sizes[index] >= buffersize:
+                    flush(index)
+        for index in range(len(taxids)):
+            flush(index)
+            pending[index].get()
+            handles[index].close()
+        for index, taxid in enumerate(taxids):
+            os.replace(temporary[index], outputs[taxid])
+    except Exception:
+        for index, handle in enumerate(handles):
+            if pending[index] is not None:
+                pending[index].wait()
+            handle.close()
+            if os.path.isfile(temporary[index]):
+                os.remove(temporary[index])
+        raise
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(taxids, counts))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+from Bio import SeqIO
+import numpy
+import pysam
+
+__author__ = 'adamkoziol'
+
+# Columns of the per-position count matrices: one for each base, one for deletions, and one for insertions
+BASES = 'ACGT-'
+DELETION = 4
+INSERTION = 5
+COLUMNS = 6
+# Lookup table to convert ASCII-encoded bases into count matrix columns. Anything that is not a base or a gap
+# (e.g. N) is set to 255, and is not counted
+LOOKUP = numpy.full(256, 255, dtype=numpy.uint8)
+for _column, _base in enumerate(BASES):
+    LOOKUP[ord(_base)] = _column
+    LOOKUP[ord(_base.lower())] = _column
+# Array used to convert count matrix columns back into bases
+ENCODED = numpy.frombuffer(BASES.encode(), dtype=numpy.uint8)
+
+
+class PileupCounts(object):
+    """
+    Accumulates the reads aligned to a single target into a (length of target, 6) count matrix. The cigar features of
+    each read are buffered as (start, length) pairs, and added to the matrix in bulk with numpy.bincount, so no
+    per-base Python objects are created
+    """
+
+    def add(self, record):
+        """
+        Parse the cigar tuples of a pysam AlignedSegment, and buffer the positions of its features
+        :param record: pysam AlignedSegment aligned to this target
+        """
+        sequence = record.query_sequence
+        if sequence is None or not record.cigartuples:
+            return
+        # Determine if soft clipping in this read would be internal to the target
+        internal = record.reference_start >= self.length - self.ninetyfive and record.reference_end <= self.ninetyfive
+        readpos = 0
+        refpos = record.reference_start
+        for cigartype, cigarlength in record.cigartuples:
+            # Matches (including the = and X sequence match/mismatch operations): add the query bases
+            if cigartype in (0, 7, 8):
+                self.bases += sequence[readpos:readpos + cigarlength].encode()
+                self.matchstarts.append(refpos)
+                self.matchlengths.append(cigarlength)
+                readpos += cigarlength
+                refpos += cigarlength
+            # Insertions occur between reference bases; they are tallied at the current reference position
+            elif cigartype == 1:
+                self.insertpositions.append(refpos)
+                self.insertlengths.append(cigarlength)
+                readpos += cigarlength
+            # Deletions add gaps to the query sequence
+            elif cigartype == 2:
+                self.deletionstarts.append(refpos)
+                self.deletionlengths.append(cigarlength)
+                refpos += cigarlength
+            # Soft clipping - only internal soft clipping is treated as a feature
+            elif cigartype == 4:
+                if internal:
+                    self.clippositions.append(refpos)
+                readpos += cigarlength
+        self.buffered += 1
+        if self.buffered >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        """
+        Add the buffered features to the count matrix, and clear the buffers
+        """
+        if self.matchstarts:
+            positions = expand(self.matchstarts, self.matchlengths)
+            columns = LOOKUP[numpy.frombuffer(bytes(self.bases), dtype=numpy.uint8)]
+            self.deposit(positions, columns)
+        if self.deletionstarts:
+            positions = expand(self.deletionstarts, self.deletionlengths)
+            self.deposit(positions, numpy.full(len(positions), DELETION, dtype=numpy.uint8))
+        if self.insertpositions:
+            positions = numpy.array(self.insertpositions, dtype=numpy.int64)
+            valid = positions < self.length
+            self.counts[:, INSERTION] += numpy.bincount(positions[valid],
+                                                        weights=numpy.array(self.insertlengths)[valid],
+                                                        minlength=self.length).astype(numpy.uint32)
+        if self.clippositions:
+            positions = numpy.array(self.clippositions, dtype=numpy.int64)
+            self.softclips += numpy.bincount(positions[positions < self.length],
+                                             minlength=self.length).astype(numpy.uint32)
+        self.bases = bytearray()
+        self.matchstarts = list()
+        self.matchlengths = list()
+        self.deletionstarts = list()
+        self.deletionlengths = list()
+        self.insertpositions = list()
+        self.insertlengths = list()
+        self.clippositions = list()
+        self.buffered = 0
+
+    def deposit(self, positions, columns):
+        """
+        Increment the count matrix at every supplied position/column pair
+        :param positions: numpy array of reference positions
+        :param columns: numpy array of count matrix columns
+        """
+        # Discard ambiguous bases, and any positions that extend past the end of the target
+        valid = (columns < COLUMNS) & (positions < self.length)
+        flat = positions[valid] * COLUMNS + columns[valid]
+        self.counts += numpy.bincount(flat, minlength=self.length * COLUMNS) \
+            .reshape(self.length, COLUMNS).astype(numpy.uint32)
+
+    def features(self):
+        """
+        :return: dictionary of reference position: number of reads with an insertion or internal soft clip at that
+        position
+        """
+        featurecounts = self.counts[:, INSERTION] + self.softclips
+        return {int(position): int(featurecounts[position]) for position in numpy.flatnonzero(featurecounts)}
+
+    def __init__(self, length, buffersize=100000):
+        self.length = length
+        self.ninetyfive = length * 0.95
+        self.buffersize = buffersize
+        self.counts = numpy.zeros((length, COLUMNS), dtype=numpy.uint32)
+        self.softclips = numpy.zeros(length, dtype=numpy.uint32)
+        self.bases = bytearray()
+        self.matchstarts = list()
+        self.matchlengths = list()
+        self.deletionstarts = list()
+        self.deletionlengths = list()
+        self.insertpositions = list()
+        self.insertlengths = list()
+        self.clippositions = list()
+        self.buffered = 0
+
+
+def expand(starts, lengths):
+    """
+    Convert (start, length) pairs into a flat array of every position covered e.g. [2, 10], [3, 2] becomes
+    [2, 3, 4, 10, 11]
+    :param starts: list of starting positions
+    :param lengths: list of the number of consecutive positions following each start
+    :return: numpy array of positions
+    """
+    starts = numpy.array(starts, dtype=numpy.int64)
+    lengths = numpy.array(lengths, dtype=numpy.int64)
+    offsets = numpy.cumsum(lengths) - lengths
+    return numpy.repeat(starts - offsets, lengths) + numpy.arange(int(lengths.sum()), dtype=numpy.int64)
+
+
+def pileup(bamfile, faidict, buffersize=100000):
+    """
+    Create count matrices for every target with aligned reads in a sorted, indexed BAM file
+    :param bamfile: name and path of the sorted BAM file
+    :param faidict: dictionary of target name: target length from the samtools faidx index of the targets
+    :param buffersize: number of reads to buffer before updating the count matrices
+    :return: dictionary of target name: (length, 6) numpy count matrix, and dictionary of target name: dictionary of
+    position: number of insertion/internal soft clip features
+    """
+    counts = dict()
+    features = dict()
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        for contig in bam.references:
+            if contig not in faidict:
+                continue
+            counter = None
+            for record in bam.fetch(contig):
+                # Only create the matrix once a read is found - most targets will not have any aligned reads
+                if counter is None:
+                    counter = PileupCounts(faidict[contig], buffersize)
+                counter.add(record)
+            if counter is not None:
+                counter.flush()
+                counts[contig] = counter.counts
+                contigfeatures = counter.features()
+                if contigfeatures:
+                    features[contig] = contigfeatures
+    return counts, features
+
+
+def summarise(counts, refseq, iupac=None):
+    """
+    Determine the consensus sequence, and the identity and depth statistics of a target from its count matrix
+    :param counts: (length, 6) numpy count matrix created by pileup
+    :param refseq: string of the reference sequence of the target
+    :param iupac: optional dictionary of degenerate nucleotide: list of matching bases. If provided, query bases
+    matching degenerate reference bases are considered matches
+    :return: dictionary of the parsed results
+    """
+    # The depth of a position includes inserted bases; only positions with bases or gaps are considered covered
+    depth = counts.sum(axis=1, dtype=numpy.int64)
+    basecounts = counts[:, :INSERTION]
+    covered = basecounts.any(axis=1)
+    # The query base is the most common - ties are broken in A, C, G, T, - order
+    querycolumns = basecounts.argmax(axis=1)
+    refcodes = numpy.frombuffer(refseq.encode(), dtype=numpy.uint8)[:len(counts)]
+    refcolumns = LOOKUP[refcodes]
+    match = covered & (querycolumns == refcolumns)
+    # Reference positions that are not A, C, G, or T
+    degenerate = covered & ~match & (refcolumns > 3)
+    if iupac:
+        # Using the NCBI 16S database, degenerate nucleotides were observed. Allow for matches to these bases
+        compatible = numpy.zeros((256, len(BASES)), dtype=bool)
+        for code, bases in iupac.items():
+            for base in bases:
+                compatible[ord(code), BASES.index(base)] = True
+        match |= degenerate & compatible[refcodes, querycolumns]
+        snp = covered & ~match & (degenerate | (querycolumns != DELETION))
+    else:
+        snp = covered & ~match & (querycolumns != DELETION)
+    # Gaps are either positions without coverage, or positions where a deletion is the most common feature
+    gap = ~covered | (covered & ~match & ~snp)
+    coveredepth = depth[covered]
+    return {
+        'length': len(counts),
+        'matches': int(match.sum()),
+        'depth': int(coveredepth.sum()),
+        'sequence': ENCODED[querycolumns[covered]].tobytes().decode(),
+        'snplocations': numpy.flatnonzero(snp).tolist(),
+        'gaplocations': numpy.flatnonzero(gap).tolist(),
+        'maxcoverage': int(coveredepth.max()) if len(coveredepth) else 0,
+        'mincoverage': int(coveredepth.min()) if len(coveredepth) else 0,
+        'standarddev': float(numpy.std(coveredepth, ddof=1)) if len(coveredepth) > 1 else float('nan')
+    }
+
+
+def summarisebam(bamfile, baitfile, faidict, iupac=None):
+    """
+    Create the count matrices of a sorted BAM file, and summarise each target. Intended to be run in a worker process:
+    the count matrices are discarded once summarised, so only the compact results are returned to the parent process
+    :param bamfile: name and path of the sorted BAM file
+    :param baitfile: name and path of the FASTA file of targets used in the reference mapping
+    :param faidict: dictionary of target name: target length from the samtools faidx index of the targets
+    :param iupac: optional dictionary of degenerate nucleotide: list of matching bases passed to summarise
+    :return: dictionary of target name: summarise results, dictionary of target name: dictionary of position: number of
+    insertion/internal soft clip features
+    """
+    counts, features = pileup(bamfile, faidict)
+    summaries = dict()
+    for record in SeqIO.parse(baitfile, 'fasta'):
+        if record.id in counts:
+            summaries[record.id] = summarise(counts.pop(record.id), str(record.seq), iupac)
+    return summaries, features
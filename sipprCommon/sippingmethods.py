@@ -1,25 +1,35 @@
 #!/usr/bin/env python
-from accessoryFunctions.accessoryFunctions import combinetargets, printtime, GenObject, make_path, logstr, \
+from accessoryFunctions.accessoryFunctions import findcombinedtargets, printtime, GenObject, make_path, logstr, \
     write_to_logfile, run_subprocess
 from accessoryFunctions.metadataprinter import MetadataPrinter
 from sipprCommon.bowtie import Bowtie2CommandLine, Bowtie2BuildCommandLine
+from sipprCommon.pileup import summarisebam
 import sipprCommon.editsamheaders
 from Bio.Sequencing.Applications import SamtoolsFaidxCommandline, SamtoolsIndexCommandline, \
     SamtoolsSortCommandline, SamtoolsViewCommandline
 from Bio.Application import ApplicationError
-from Bio import SeqIO
-from collections import Counter
+from multiprocessing import Pool
 from threading import Thread
 from io import StringIO
 from queue import Queue
 from glob import glob
-import numpy
-import pysam
 import os
 
 __author__ = 'adamkoziol'
 
 
+def current(indexfile, baitfile):
+    """
+    :param indexfile: name and path of an index (e.g. bowtie2 or faidx) of the bait file
+    :param baitfile: name and path of the bait file
+    :return: boolean of whether the index exists, and is at least as recent as the bait file
+    """
+    try:
+        return os.path.getmtime(indexfile) >= os.path.getmtime(baitfile)
+    except (IOError, OSError):
+        return False
+
+
 class Sippr(object):
 
     def main(self):
@@ -66,26 +76,18 @@ class Sippr(object):
                             os.path.join(self.targetpath, self.analysistype, sample.general.closestrefseqgenus, '')
                     # There is a relatively strict databasing scheme necessary for the custom targets. Eventually,
                     # there will be a helper script to combine individual files into a properly formatted combined file
-                    try:
-                        sample[self.analysistype].baitfile = glob(os.path.join(sample[self.analysistype].targetpath,
-                                                                               '*.fasta'))[0]
+                    # Combine any .tfa files in the directory into a combined targets .fasta file, or update the
+                    # combined file if the .tfa files have changed
+                    baitfile = findcombinedtargets(glob(os.path.join(sample[self.analysistype].targetpath, '*.tfa')),
+                                                   sample[self.analysistype].targetpath)
+                    if baitfile:
+                        sample[self.analysistype].baitfile = baitfile
                     # If the fasta file is missing, raise a custom error
-                    except IndexError:
-                        # Combine any .tfa files in the directory into a combined targets .fasta file
-                        tfafiles = glob(os.path.join(sample[self.analysistype].targetpath, '*.tfa'))
-                        if tfafiles:
-                            combinetargets(tfafiles, sample[self.analysistype].targetpath)
-                        try:
-                            self.baitfile = glob(os.path.join(sample[self.analysistype].targetpath, '*.fasta'))[0]
-                        except IndexError as e:
-                            # noinspection PyPropertyAccess
-                            e.args = [
-                                'Cannot find the combined fasta file in {}. Please note that the file must have a '
-                                '.fasta extension'.format(sample[self.analysistype].targetpath)]
-                            if os.path.isdir(sample[self.analysistype].targetpath):
-                                raise
-                            else:
-                                sample[self.analysistype].runanalysis = False
+                    elif os.path.isdir(sample[self.analysistype].targetpath):
+                        raise IndexError('Cannot find the combined fasta file in {}. Please note that the file must '
+                                         'have a .fasta extension'.format(sample[self.analysistype].targetpath))
+                    else:
+                        sample[self.analysistype].runanalysis = False
 
                 else:
                     sample[self.analysistype].runanalysis = False
@@ -101,21 +103,13 @@ class Sippr(object):
         else:
             # There is a relatively strict databasing scheme necessary for the custom targets. Eventually, there will
             # be a helper script to combine individual files into a properly formatted combined file
-            try:
-                self.baitfile = glob(os.path.join(self.targetpath, '*.fasta'))[0]
+            # Combine any .tfa files in the directory into a combined targets .fasta file, or update the combined
+            # file if the .tfa files have changed
+            self.baitfile = findcombinedtargets(glob(os.path.join(self.targetpath, '*.tfa')), self.targetpath)
             # If the fasta file is missing, raise a custom error
-            except IndexError:
-                # Combine any .tfa files in the directory into a combined targets .fasta file
-                tfafiles = glob(os.path.join(self.targetpath, '*.tfa'))
-                if tfafiles:
-                    combinetargets(tfafiles, self.targetpath)
-                try:
-                    self.baitfile = glob(os.path.join(self.targetpath, '*.fasta'))[0]
-                except IndexError as e:
-                    # noinspection PyPropertyAccess
-                    e.args = ['Cannot find the combined fasta file in {}. Please note that the file must have a '
-                              '.fasta extension'.format(self.targetpath)]
-                    raise
+            if not self.baitfile:
+                raise IndexError('Cannot find the combined fasta file in {}. Please note that the file must have a '
+                                 '.fasta extension'.format(self.targetpath))
             # Set all the necessary attributes
             for sample in self.runmetadata:
                 setattr(sample, self.analysistype, GenObject())
@@ -300,7 +294,9 @@ class Sippr(object):
                 sample[self.analysistype].samindex = str(samindex)
                 # Add the commands to the queue. Note that the commands would usually be set as attributes of the sample
                 # but there was an issue with their serialization when printing out the metadata
-                if not os.path.isfile(sample[self.analysistype].baitfilenoext + '.1' + self.bowtiebuildextension):
+                # Build the index if it is missing, or older than the bait file e.g. after the targets were updated
+                if not current(sample[self.analysistype].baitfilenoext + '.1' + self.bowtiebuildextension,
+                               sample[self.analysistype].baitfile):
                     try:
                         stdoutbowtieindex, stderrbowtieindex = \
                             map(StringIO, bowtie2build(cwd=sample[self.analysistype].targetpath))
@@ -325,7 +321,7 @@ class Sippr(object):
                 # Get the necessary values from the queue
                 sample, bowtie2build, bowtie2align, samindex = self.mapqueue.get()
                 # Use samtools faidx to index the bait file - this will be used in the sample parsing
-                if not os.path.isfile(sample[self.analysistype].faifile):
+                if not current(sample[self.analysistype].faifile, sample[self.analysistype].baitfile):
                     stdoutindex, stderrindex = map(StringIO, samindex(cwd=sample[self.analysistype].targetpath))
                     # Write any error to a log file
                     if stderrindex:
@@ -387,14 +383,15 @@ class Sippr(object):
             self.indexqueue.task_done()
 
     def parsing(self):
+        """
+        Parse the sorted bam files in a pool of worker processes. Each worker creates the count matrices of a sample,
+        and only returns the summarised results, so the per-position data never leave the worker
+        """
         printtime('Parsing sorted bam files', self.start, output=self.portallog)
-        for i in range(len(self.runmetadata)):
-            # Send the threads to
-            threads = Thread(target=self.reduce, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
+        # Using the NCBI 16S database, I observed that degenerate nucleotides were used. This allows for matches to
+        # occur to these bases
+        iupac = self.iupac if self.analysistype == 'sixteens_full' else None
+        jobs = dict()
         for sample in self.runmetadata:
             if sample.general.bestassemblyfile != 'NA' and sample[self.analysistype].runanalysis:
                 # Get the fai file into a dictionary to be used in parsing results
@@ -407,157 +404,25 @@ class Sippr(object):
                             except KeyError:
                                 sample[self.analysistype].faidict = dict()
                                 sample[self.analysistype].faidict[data[0]] = int(data[1])
-                    self.parsequeue.put(sample)
+                    jobs[sample.name] = (sample[self.analysistype].sortedbam,
+                                         sample[self.analysistype].baitfile,
+                                         sample[self.analysistype].faidict,
+                                         iupac)
                 except FileNotFoundError:
                     pass
-        self.parsequeue.join()
+        if jobs:
+            with Pool(processes=min(int(self.cpus), len(jobs))) as pool:
+                results = {name: pool.apply_async(summarisebam, args) for name, args in jobs.items()}
+                for name, result in results.items():
+                    self.summarydict[name] = result.get()
         self.parsebam()
 
-    def reduce(self):
-        """
-        Use pysam to parse the sorted bam file to determine the sequence of the query, as well as any features present
-        """
-        while True:
-            sample = self.parsequeue.get()
-            # Initialise variables to store query and reference sequences, as well as any feature such as insertions
-            # or locations with internal soft clipped reads
-            sample[self.analysistype].sequence = dict()
-            sample[self.analysistype].referencesequences = dict()
-            sample[self.analysistype].features = dict()
-            # Load the baitfile using SeqIO to get the reference sequences
-            self.record_dict[sample.name] = SeqIO.to_dict(SeqIO.parse(sample[self.analysistype].baitfile, 'fasta'))
-            # Create a pysam alignment file object of the sorted bam file
-            bamfile = pysam.AlignmentFile(sample[self.analysistype].sortedbam, 'rb')
-            # Iterate through each read in the bamfile
-            for record in bamfile.fetch():
-                # Initialise the starting position of the read to 0
-                readpos = 0
-                # Set the name and starting position of the match with the reference
-                contig = record.reference_name
-                refpos = record.reference_start
-                # Iterate through the cigar tuples in the cigartuples attribute
-                for cigartuple in record.cigartuples:
-                    # Split the cigar tuple into the cigar feature (0: match, 1: insertion, 2: deletion, 3: skip,
-                    # 4: soft clipping, 5: hard clipping, 6: padding) and the length of the cigar feature
-                    cigartype, cigarlength = cigartuple
-                    # Treat the different cigar features accordingly. For matches, add the query sequence at each
-                    # reference position to the dictionary
-                    if cigartype == 0:  # match
-                        # Variable to store the final position reached in the read
-                        final = 0
-                        for i in range(readpos, readpos + cigarlength):
-                            try:
-                                sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                            except KeyError:
-                                try:
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                                except KeyError:
-                                    sample[self.analysistype].sequence[contig] = dict()
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                            # Increment the reference position for each bases in the query
-                            refpos += 1
-                            # Increment the final position - I used a variable here rather than incrementing readpos,
-                            # as I didn't want any issues with incrementing readpos while in a loop reference readpos
-                            final = i + 1
-                        # Set the final position of the read
-                        readpos = final
-                    # Add the query sequence from the insertion, but don't increment the refpos; will increase the
-                    # length of the query sequence compared to the reference
-                    elif cigartype == 1:  # insertions
-                        final = 0
-                        for i in range(readpos, readpos + cigarlength):
-                            try:
-                                sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                            except KeyError:
-                                try:
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                                except KeyError:
-                                    sample[self.analysistype].sequence[contig] = dict()
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append(record.query_sequence[i])
-                            # Don't increment refpos, as this insertion is occurring between reference bases
-                            final = i + 1
-                        # Add the insertion feature to the dictionary
-                        for i in range(readpos, readpos + cigarlength):
-                            try:
-                                sample[self.analysistype].features[contig][refpos].append('insertion')
-                            except KeyError:
-                                try:
-                                    sample[self.analysistype].features[contig][refpos] = list()
-                                    sample[self.analysistype].features[contig][refpos].append('insertion')
-                                except KeyError:
-                                    sample[self.analysistype].features[contig] = dict()
-                                    sample[self.analysistype].features[contig][refpos] = list()
-                                    sample[self.analysistype].features[contig][refpos].append('insertion')
-                        # Set the final read position
-                        readpos = final
-                    # Add gaps (-) to the query sequence, but don't increment the readpos; will ensure that the
-                    # reference and query sequences stay the same length
-                    elif cigartype == 2:  # deletion
-                        for i in range(readpos, readpos + cigarlength):
-                            try:
-                                sample[self.analysistype].sequence[contig][refpos].append('-')
-                            except KeyError:
-                                try:
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append('-')
-                                except KeyError:
-                                    sample[self.analysistype].sequence[contig] = dict()
-                                    sample[self.analysistype].sequence[contig][refpos] = list()
-                                    sample[self.analysistype].sequence[contig][refpos].append('-')
-                            # Don't increment read pos, as the deletion is occurring between query bases
-                            refpos += 1
-                    # Don't worry about skips yet. Have not found this cigar feature in any datasets so far
-                    elif cigartype == 3:  # skip
-                        pass
-                    # An issue that was occurring with the parsing was internal soft clipping. Essentially, 5' reads
-                    # would be soft right-clipped, and 3' reads would be soft left-clipped. At the resulting junction
-                    # between the two clipped reads, the sequence data would look good, but only because of this
-                    # undesired clipping. Add the internal soft clip feature to the dictionary
-                    elif cigartype == 4:  # soft clipping
-                        record_length = float(len(str(self.record_dict[sample.name][record.reference_name].seq)))
-                        record_length_ninety = record_length * 0.95
-                        # Determine if a soft clip is internal
-                        if float(record.reference_start) >= (record_length - record_length_ninety) \
-                                and float(record.reference_end) <= record_length_ninety:
-                            try:
-                                sample[self.analysistype].features[contig][refpos].append('internal soft clip')
-                            except KeyError:
-                                try:
-                                    sample[self.analysistype].features[contig][refpos] = list()
-                                    sample[self.analysistype].features[contig][refpos].append('internal soft clip')
-                                except KeyError:
-                                    sample[self.analysistype].features[contig] = dict()
-                                    sample[self.analysistype].features[contig][refpos] = list()
-                                    sample[self.analysistype].features[contig][refpos].append('internal soft clip')
-                        # Increment the readpos by the length of the soft clipping feature
-                        readpos += cigarlength
-                    # Don't worry about hard clipping. Have not found this cigar feature in any datasets so far
-                    elif cigartype == 5:  # hard clipping
-                        pass
-                    # Don't worry about padding yet. Have not found this cigar feature in any datasets so far
-                    elif cigartype == 6:  # padding
-                        pass
-            self.parsequeue.task_done()
-
     def parsebam(self):
         """
-        Parse the dictionaries of the sorted bam files extracted using pysam
+        Populate the results attributes of each sample from the summaries returned by the parsing workers
         """
         printtime('Parsing BAM', self.start, output=self.portallog)
         for sample in self.runmetadata:
-            # Initialise dictionaries to store parsed data
-            matchdict = dict()
-            depthdict = dict()
-            seqdict = dict()
-            snplocationsdict = dict()
-            gaplocationsdict = dict()
-            maxdict = dict()
-            mindict = dict()
-            deviationdict = dict()
             sample[self.analysistype].results = dict()
             sample[self.analysistype].avgdepth = dict()
             sample[self.analysistype].resultssnp = dict()
@@ -568,119 +433,49 @@ class Sippr(object):
             sample[self.analysistype].maxcoverage = dict()
             sample[self.analysistype].mincoverage = dict()
             sample[self.analysistype].standarddev = dict()
-            # Iterate through each contig in the dictionary
-            try:
-                for contig, poslist in sorted(sample[self.analysistype].sequence.items()):
-                    # Use the record_dict dictionary with the contig as the key in order to pull out the
-                    # reference sequence
-                    refseq = self.record_dict[sample.name][contig].seq
-                    # Initialise the reference position to 0
-                    refpos = 0
-                    # Initialise dictionaries with the contig name
-                    matchdict[contig] = int()
-                    depthdict[contig] = int()
-                    seqdict[contig] = str()
-                    snplocationsdict[contig] = list()
-                    gaplocationsdict[contig] = list()
-                    maxdict[contig] = int()
-                    mindict[contig] = int()
-                    deviationdict[contig] = list()
-                    # Iterate through all the reference positions in the reference sequence
-                    for pos, baselist in poslist.items():
-                        # If the query position is equal to the reference position, proceed with the loop
-                        if pos == refpos:
-                            # Use the counter function to count the number of times each base appears in the list of
-                            # query bases
-                            counted = Counter(baselist)
-                            # Sort the bases based on how common they are in the list
-                            maxbases = counted.most_common()
-                            # Set the query base as the most common - note that this is fairly simplistic - the base
-                            # with the highest representation (or the first base in the list in case of a tie) is used
-                            querybase = maxbases[0][0]
-                            # Extract the corresponding base in the reference sequence
-                            refbase = refseq[pos]
-                            # The depth of the current position is the length of the list of bases
-                            depth = len(baselist)
-                            # Update the sequence, depth, and deviation (list of depths) dictionaries
-                            seqdict[contig] += querybase
-                            depthdict[contig] += depth
-                            deviationdict[contig].append(depth)
-                            # Set the maximum and minimum depths observed
-                            if depth > maxdict[contig]:
-                                maxdict[contig] = depth
-                            # Initialise the minimum depth dictionary here
-                            if contig not in mindict:
-                                mindict[contig] = depth
-                            if depth < mindict[contig]:
-                                mindict[contig] = depth
-                            # If the reference and query bases match, increment the number of matches
-                            if querybase == refbase:
-                                matchdict[contig] += 1
-                            # Using the NCBI 16S database, I observed that degenerate nucleotides were used. This
-                            # allows for matches to occur to these bases
-                            elif self.analysistype == 'sixteens_full' and refbase not in ['A', 'C', 'G', 'T']:
-                                # If the query base matches the corresponding IUPAC code e.g. A or G will match R,
-                                # increment the number of matches
-                                if querybase in self.iupac[refbase]:
-                                    matchdict[contig] += 1
-                                # Otherwise treat the base as a mismatch, and add the base position to the list of
-                                # SNPs
-                                else:
-                                    snplocationsdict[contig].append(pos)
-                            # If the reference and query bases don't match there could be a couple of reasons for this
-                            else:
-                                # If the bases simply don't match, add the position to the list of SNPs
-                                if querybase != '-':
-                                    snplocationsdict[contig].append(pos)
-                                # However, if the query base is a gap (-), add the position to the dictionary of gap
-                                # locations
-                                else:
-                                    gaplocationsdict[contig].append(pos)
-                        # If the reference position does not equal the query position, assume a gap
-                        else:
-                            # Add the location of the gap to the dictionary
-                            gaplocationsdict[contig].append(pos)
-                        # Increment the reference position
-                        refpos += 1
-            except KeyError:
-                pass
-            # Iterate through all the results, and filter out sequences that do not meet the depth and/or the sequence
-            # identity thresholds
-            for allele in seqdict:
-                # If the length of the match is greater or equal to the length of the gene/allele (multiplied by the
-                # cutoff value) as determined using faidx indexing, then proceed
-                if matchdict[allele] >= sample[self.analysistype].faidict[allele] * self.cutoff:
-                    # Calculate the average depth by dividing the total number of reads observed by the
-                    # length of the gene
-                    averagedepth = float(depthdict[allele]) / float(matchdict[allele])
-                    percentidentity = float(matchdict[allele]) / float(sample[self.analysistype].faidict[allele]) * 100
-                    # Only report a positive result if this average depth is greater than the desired average depth
-                    # and if the percent identity is greater or equal to the cutoff
-                    if averagedepth > self.averagedepth and percentidentity >= float(self.cutoff * 100):
-                        # Populate resultsdict with the gene/allele name, the percent identity, and the average depth
-                        sample[self.analysistype].results.update({allele: '{:.2f}'.format(percentidentity)})
-                        sample[self.analysistype].avgdepth.update({allele: '{:.2f}'.format(averagedepth)})
-                        # Add the results to dictionaries
-                        sample[self.analysistype].resultssnp.update({allele: len(snplocationsdict[allele])})
-                        sample[self.analysistype].snplocations.update({allele: snplocationsdict[allele]})
-                        sample[self.analysistype].resultsgap.update({allele: len(gaplocationsdict[allele])})
-                        sample[self.analysistype].gaplocations.update({allele: gaplocationsdict[allele]})
-                        sample[self.analysistype].sequences.update({allele: seqdict[allele]})
-                        sample[self.analysistype].maxcoverage.update({allele: maxdict[allele]})
-                        sample[self.analysistype].mincoverage.update({allele: mindict[allele]})
-                        sample[self.analysistype] \
-                            .standarddev.update({allele: '{:.2f}'.format(numpy.std(deviationdict[allele], ddof=1))})
+            summaries, features = self.summarydict.get(sample.name, (dict(), dict()))
+            # Add the locations of features such as insertions or internal soft clipped reads for the clipper method
+            sample[self.analysistype].features = features
+            self.filterresults(sample, dict(sorted(summaries.items())))
+
+    def filterresults(self, sample, summaries):
+        """
+        Filter out sequences that do not meet the depth and/or the sequence identity thresholds, and populate the
+        results attributes of the sample
+        :param sample: metadata sample object
+        :param summaries: dictionary of allele: dictionary of results returned by pileup.summarise
+        """
+        for allele, summary in summaries.items():
+            # If the length of the match is greater or equal to the length of the gene/allele (multiplied by the
+            # cutoff value) as determined using faidx indexing, then proceed
+            if summary['matches'] and summary['matches'] >= sample[self.analysistype].faidict[allele] * self.cutoff:
+                # Calculate the average depth by dividing the total number of reads observed by the
+                # length of the gene
+                averagedepth = float(summary['depth']) / float(summary['matches'])
+                percentidentity = float(summary['matches']) / float(sample[self.analysistype].faidict[allele]) * 100
+                # Only report a positive result if this average depth is greater than the desired average depth
+                # and if the percent identity is greater or equal to the cutoff
+                if averagedepth > self.averagedepth and percentidentity >= float(self.cutoff * 100):
+                    # Populate resultsdict with the gene/allele name, the percent identity, and the average depth
+                    sample[self.analysistype].results.update({allele: '{:.2f}'.format(percentidentity)})
+                    sample[self.analysistype].avgdepth.update({allele: '{:.2f}'.format(averagedepth)})
+                    # Add the results to dictionaries
+                    sample[self.analysistype].resultssnp.update({allele: len(summary['snplocations'])})
+                    sample[self.analysistype].snplocations.update({allele: summary['snplocations']})
+                    sample[self.analysistype].resultsgap.update({allele: len(summary['gaplocations'])})
+                    sample[self.analysistype].gaplocations.update({allele: summary['gaplocations']})
+                    sample[self.analysistype].sequences.update({allele: summary['sequence']})
+                    sample[self.analysistype].maxcoverage.update({allele: summary['maxcoverage']})
+                    sample[self.analysistype].mincoverage.update({allele: summary['mincoverage']})
+                    sample[self.analysistype] \
+                        .standarddev.update({allele: '{:.2f}'.format(summary['standarddev'])})
 
     def clear(self):
         """
-        Clear out the sequence attribute - this is a very large dictionary, and is a pain to print to/load from the
-        .json file
+        Clear out the summaries returned by the parsing workers - the results have been added to the metadata
         """
         for sample in self.runmetadata:
-            try:
-                delattr(sample[self.analysistype], 'sequence')
-            except KeyError:
-                pass
+            self.summarydict.pop(sample.name, None)
 
     def clipper(self):
         """
@@ -703,7 +498,7 @@ class Sippr(object):
                                 for location, feature in sample[self.analysistype].features[gene].items():
                                     # If the feature is present in under 30% of the reads, set the passing variable
                                     # to true
-                                    if len(feature) < int(float(sample[self.analysistype].avgdepth[gene])) * 0.3:
+                                    if feature < int(float(sample[self.analysistype].avgdepth[gene])) * 0.3:
                                         passingfeature.append(True)
                                     # Otherwise set it to false
                                     else:
@@ -764,7 +559,6 @@ class Sippr(object):
         self.baitqueue = Queue(maxsize=self.cpus)
         self.mapqueue = Queue(maxsize=self.cpus)
         self.indexqueue = Queue(maxsize=self.cpus)
-        self.parsequeue = Queue(maxsize=self.cpus)
         self.iupac = {
             'R': ['A', 'G'],
             'Y': ['C', 'T'],
@@ -781,7 +575,7 @@ class Sippr(object):
         }
         # Always perform reverse baiting - may want to change this later, so will keep this variable for now
         self.revbait = True
-        self.record_dict = dict()
+        self.summarydict = dict()
         # Run the analyses
         self.main()
         # Print the metadata
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 from accessoryFunctions.accessoryFunctions import dotter, GenObject, make_path, run_subprocess, write_to_logfile
+from accessoryFunctions.blastdb import makeblastdb
 from threading import Thread
 from queue import Queue
 from glob import glob
@@ -204,16 +205,7 @@ class CHAS(object):
         Makes blast database files from targets as necessary
         """
         # remove the path and the file extension for easier future globbing
-        db = fastapath.split('.')[0]
-        nhr = '{}.nhr'.format(db)  # add nhr for searching
-        if not os.path.isfile(str(nhr)):  # if check for already existing dbs
-            # Create the databases
-            threadlock = threading.Lock()
-            command = 'makeblastdb -in {} -parse_seqids -max_file_sz 2GB -dbtype nucl -out {}'.format(fastapath, db)
-            out, err = run_subprocess(command)
-            threadlock.acquire()
-            write_to_logfile(out, err, self.logfile)
-            threadlock.release()
+        makeblastdb(fastapath, fastapath.split('.')[0], self.logfile)
         dotter()
 
     def report(self):
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
-from accessoryFunctions.accessoryFunctions import printtime, run_subprocess, write_to_logfile, make_path, \
-    combinetargets, MetadataObject, GenObject, make_dict
+from accessoryFunctions.accessoryFunctions import printtime, make_path, findcombinedtargets, MetadataObject, \
+    GenObject, make_dict
+from accessoryFunctions.blastparser import FIELDNAMES, OUTFMT, parse
+from accessoryFunctions.blastdb import makeblastdb
+from accessoryFunctions.intervals import IntervalIndex
 from Bio.Blast.Applications import NcbiblastnCommandline
 from Bio.Application import ApplicationError
 from Bio.pairwise2 import format_alignment
@@ -11,14 +14,10 @@ from Bio.Seq import Seq
 from Bio import SeqIO
 from collections import defaultdict
 from threading import Thread
-from csv import DictReader
 from queue import Queue
 from glob import glob
-import threading
 import xlsxwriter
 import time
-import csv
-import sys
 import os
 import re
 
@@ -55,67 +54,41 @@ class GeneSeekr(object):
         for sample in self.metadata:
             # Initialise variables
             sample[self.analysistype].blastresults = list()
-            resultdict = dict()
             rowdict = dict()
             try:
                 # Iterate through all the contigs, which had BLAST hits
                 for contig in sample[self.analysistype].queryranges:
-                    # Find all the locations in each contig that correspond to the BLAST hits
-                    for location in sample[self.analysistype].queryranges[contig]:
-                        # Extract the BLAST result dictionary for the contig
-                        for row in sample[self.analysistype].results[contig]:
-                            # Initialise variable to reduce the number of times row['value'] needs to be typed
-                            contig = row['query_id']
-                            high = row['high']
-                            low = row['low']
-                            percentidentity = row['percentidentity']
+                    # Extract the BLAST results and the locations of the hits for the contig
+                    rows = sample[self.analysistype].results[contig]
+                    locations = sample[self.analysistype].queryranges[contig]
+                    # Group the hits together based on the locations they overlap with a sweep of the sorted ranges.
+                    # The ranges are half-open e.g. [6, 10] covers 6, 7, 8, 9, but NOT 10. This turns out to be
+                    # useful, as there are genes located back-to-back in the genome e.g. strB and strA, with locations
+                    # of 2557,3393 and 3393,4196, respectively. By not including 3393 in the strB calculations, I
+                    # don't have to worry about this single bp overlap
+                    overlaps = IntervalIndex(locations).overlapping([(row['low'], row['high']) for row in rows])
+                    for position, location in enumerate(locations):
+                        if position in overlaps:
                             # Join the two ranges in the location list with a comma
                             locstr = ','.join([str(x) for x in location])
-                            # Create a set of the location of all the base pairs between the low and high (-1) e.g.
-                            # [6, 10] would give 6, 7, 8, 9, but NOT 10. This turns out to be useful, as there are
-                            # genes located back-to-back in the genome e.g. strB and strA, with locations of 2557,3393
-                            # and 3393,4196, respectively. By not including 3393 in the strB calculations, I don't
-                            # have to worry about this single bp overlap
-                            loc = set(range(low, high))
-                            # Use a set intersection to determine whether the current result overlaps with location
-                            # This will allow all the hits to be grouped together based on their location
-                            if loc.intersection(set(range(location[0], location[1]))):
-                                # Populate the grouped hits for each location
-                                try:
-                                    resultdict[contig][locstr].append(percentidentity)
-                                    rowdict[contig][locstr].append(row)
-                                # Initialise and populate the lists of the nested dictionary
-                                except KeyError:
-                                    try:
-                                        resultdict[contig][locstr] = list()
-                                        resultdict[contig][locstr].append(percentidentity)
-                                        rowdict[contig][locstr] = list()
-                                        rowdict[contig][locstr].append(row)
-                                    # As this is a nested dictionary, it needs to be initialised here
-                                    except KeyError:
-                                        resultdict[contig] = dict()
-                                        resultdict[contig][locstr] = list()
-                                        resultdict[contig][locstr].append(percentidentity)
-                                        rowdict[contig] = dict()
-                                        rowdict[contig][locstr] = list()
-                                        rowdict[contig][locstr].append(row)
+                            # Populate the grouped hits for each location
+                            rowdict.setdefault(contig, dict()).setdefault(
+                                locstr, [rows[index] for index in overlaps[position]])
             except KeyError:
                 pass
             # Find the best hit for each location based on percent identity
-            for contig in resultdict:
+            for contig in rowdict:
                 # Do not allow the same gene to be added to the dictionary more than once
                 genes = list()
-                for location in resultdict[contig]:
-                    # Initialise a variable to determine whether there is already a best hit found for the location
-                    multiple = False
+                for location in rowdict[contig]:
+                    best = max(row['percentidentity'] for row in rowdict[contig][location])
                     # Iterate through the BLAST results to find the best hit
                     for row in rowdict[contig][location]:
                         # Add the best hit to the .blastresults attribute of the object
-                        if row['percentidentity'] == max(resultdict[contig][location]) and not multiple \
-                                and row['subject_id'] not in genes:
+                        if row['percentidentity'] == best and row['subject_id'] not in genes:
                             sample[self.analysistype].blastresults.append(row)
                             genes.append(row['subject_id'])
-                            multiple = True
+                            break
 
     def makedbthreads(self):
         """
@@ -152,22 +125,8 @@ class GeneSeekr(object):
         """Makes blast database files from targets as necessary"""
         while True:  # while daemon
             fastapath = self.dqueue.get()  # grabs fastapath from dqueue
-            # remove the path and the file extension for easier future globbing
-            db = os.path.splitext(fastapath)[0]
-            nhr = '{}.nhr'.format(db)  # add nhr for searching
-            # fnull = open(os.devnull, 'w')  # define /dev/null
-            if not os.path.isfile(str(nhr)):  # if check for already existing dbs
-                # Create the databases
-                # TODO use MakeBLASTdb class
-                threadlock = threading.Lock()
-                command = 'makeblastdb -in {} -parse_seqids -max_file_sz 2GB -dbtype nucl -out {}'.format(fastapath, db)
-                # subprocess.call(shlex.split('makeblastdb -in {} -parse_seqids -max_file_sz 2GB -dbtype nucl -out {}'
-                #                            .format(fastapath, db)), stdout=fnull, stderr=fnull)
-                out, err = run_subprocess(command)
-                threadlock.acquire()
-                write_to_logfile(command, command, self.logfile, None, None, None, None)
-                write_to_logfile(out, err, self.logfile, None, None, None, None)
-                threadlock.release()
+            # Create the database (if it is missing or out of date) beside the target file
+            makeblastdb(fastapath, os.path.splitext(fastapath)[0], self.logfile)
             self.dqueue.task_done()  # signals to dqueue job is done
 
     def blastnthreads(self):
@@ -210,8 +169,7 @@ class GeneSeekr(object):
             # alignments are reported. Also note the custom outfmt: the doubled quotes are necessary to get it work
             blastn = NcbiblastnCommandline(query=assembly, db=db, evalue='1E-5', num_alignments=1000000,
                                            num_threads=12,
-                                           outfmt="'6 qseqid sseqid positive mismatch gaps "
-                                                  "evalue bitscore slen length qstart qend qseq sstart send sseq'",
+                                           outfmt=OUTFMT,
                                            out=sample[self.analysistype].report)
             # Save the blast command in the metadata
             sample[self.analysistype].blastcommand = str(blastn)
@@ -241,35 +199,31 @@ class GeneSeekr(object):
         :param report: Name of the blast output report being parsed
         :param sample: sample object
         """
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         resultdict = dict()
         # Initialise a dictionary to store all the target sequences
         sample[self.analysistype].targetsequence = dict()
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            percentidentity = float('{:0.2f}'.format((float(row['positives']) - float(row['gaps'])) /
-                                                     float(row['subject_length']) * 100))
-            target = row['subject_id']
+        for record in parse(report):
+            # Round the percent identity - (length of the alignment - number of mismatches) / total subject length
+            percentidentity = float('{:0.2f}'.format(record.percentidentity))
+            target = record.subject_id
             # If the percent identity is greater than the cutoff
             if percentidentity >= self.cutoff:
                 # Update the dictionary with the target and percent identity
                 resultdict.update({target: percentidentity})
                 # Determine if the orientation of the sequence is reversed compared to the reference
-                if int(row['subject_end']) < int(row['subject_start']):
+                if record.reverse:
                     # Create a sequence object using Biopython
-                    seq = Seq(row['query_sequence'], IUPAC.unambiguous_dna)
+                    seq = Seq(record.query_sequence, IUPAC.unambiguous_dna)
                     # Calculate the reverse complement of the sequence
                     querysequence = str(seq.reverse_complement())
                 # If the sequence is not reversed, use the sequence as it is in the output
                 else:
-                    querysequence = row['query_sequence']
+                    querysequence = record.query_sequence
                 # Add the sequence in the correct orientation to the sample
                 sample[self.analysistype].targetsequence[target] = querysequence
-            # Add the percent identity to the object
-            sample[self.analysistype].blastresults = resultdict
+        # Add the percent identity to the object
+        sample[self.analysistype].blastresults = resultdict
         # Populate missing results with 'NA' values
         if len(resultdict) == 0:
             sample[self.analysistype].blastresults = 'NA'
@@ -280,55 +234,52 @@ class GeneSeekr(object):
         :param report: Name of the blast output report being parsed
         :param sample: sample object
         """
-        # Encountering the following error: # _csv.Error: field larger than field limit (131072)
-        # According to https://stackoverflow.com/a/15063941, increasing the field limit should fix the issue
-        csv.field_size_limit(sys.maxsize)
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         # Initialise a dictionary to store all the target sequences
         sample[self.analysistype].targetsequence = dict()
         sample[self.analysistype].queryranges = dict()
         sample[self.analysistype].querypercent = dict()
         sample[self.analysistype].queryscore = dict()
         sample[self.analysistype].results = dict()
+        # Index of the query ranges of each contig
+        rangeindex = dict()
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            percentidentity = float('{:0.2f}'.format((float(row['positives'])) /
-                                                     float(row['subject_length']) * 100))
-            target = row['subject_id']
-            contig = row['query_id']
-            high = max([int(row['query_start']), int(row['query_end'])])
-            low = min([int(row['query_start']), int(row['query_end'])])
-            score = row['bit_score']
-            # Create new entries in the blast results dictionaries with the calculated variables
-            row['percentidentity'] = percentidentity
-            row['low'] = low
-            row['high'] = high
-            row['alignment_fraction'] = float('{:0.2f}'.format(float(float(row['alignment_length']) /
-                                                                     float(row['subject_length']) * 100)))
+        for record in parse(report):
+            # Calculate the percent identity - for these analyses, the number of positives / total subject length
+            percentidentity = float('{:0.2f}'.format(record.positives / record.subject_length * 100))
             # If the percent identity is greater than the cutoff
             if percentidentity >= self.cutoff:
+                target = record.subject_id
+                contig = record.query_id
+                high = record.high
+                low = record.low
+                score = record.bit_score
+                # Only the passing results are stored in the metadata - convert the record to a dictionary, and add
+                # the calculated variables
+                row = record.todict()
+                row['percentidentity'] = percentidentity
+                row['alignment_fraction'] = float('{:0.2f}'.format(record.alignment_length /
+                                                                   record.subject_length * 100))
                 try:
                     sample[self.analysistype].results[contig].append(row)
                     # Boolean to store whether the list needs to be updated
                     append = True
-                    # Iterate through all the ranges in the list - if the new range is different than any of the ranges
-                    # seen before, append it. Otherwise, update the previous ranges with the new, longer range as
-                    # necessary e.g. [2494, 3296] will be updated to [2493, 3296] with [2493, 3293], and
-                    # [2494, 3296] will become [[2493, 3296], [3296, 4132]] with [3296, 4132]
-                    for spot in sample[self.analysistype].queryranges[contig]:
+                    # Iterate through the ranges in the list with a start or end within 100 bp of the new range - if
+                    # the new range is different than any of the ranges seen before, append it. Otherwise, update the
+                    # previous ranges with the new, longer range as necessary e.g. [2494, 3296] will be updated to
+                    # [2493, 3296] with [2493, 3293], and [2494, 3296] will become [[2493, 3296], [3296, 4132]] with
+                    # [3296, 4132]
+                    for position in rangeindex[contig].near(low, high, 100):
+                        spot = rangeindex[contig].intervals[position]
                         # Update the low value if the new low value is slightly lower than before
                         if 1 <= (spot[0] - low) <= 100:
                             # Update the low value
-                            spot[0] = low
+                            rangeindex[contig].update(position, low, spot[1])
                             # It is not necessary to append
                             append = False
                         # Update the previous high value if the new high value is slightly higher than before
                         elif 1 <= (high - spot[1]) <= 100:
                             # Update the high value in the list
-                            spot[1] = high
+                            rangeindex[contig].update(position, spot[0], high)
                             # It is not necessary to append
                             append = False
                         # Do not append if the new low is slightly larger than before
@@ -342,13 +293,15 @@ class GeneSeekr(object):
                             append = False
                     # If the result appears to be in a new location, add the data to the object
                     if append:
-                        sample[self.analysistype].queryranges[contig].append([low, high])
+                        rangeindex[contig].add(low, high)
                         sample[self.analysistype].querypercent[contig] = percentidentity
                         sample[self.analysistype].queryscore[contig] = score
                 # Initialise and populate the dictionary for each contig
                 except KeyError:
-                    sample[self.analysistype].queryranges[contig] = list()
-                    sample[self.analysistype].queryranges[contig].append([low, high])
+                    # The ranges in the metadata are the (mutable) list of intervals in the index
+                    rangeindex[contig] = IntervalIndex()
+                    rangeindex[contig].add(low, high)
+                    sample[self.analysistype].queryranges[contig] = rangeindex[contig].intervals
                     sample[self.analysistype].querypercent[contig] = percentidentity
                     sample[self.analysistype].queryscore[contig] = score
                     sample[self.analysistype].results[contig] = list()
@@ -356,14 +309,14 @@ class GeneSeekr(object):
                     sample[self.analysistype].targetsequence[target] = dict()
                 # Determine if the query sequence is in a different frame than the subject, and correct
                 # by setting the query sequence to be the reverse complement
-                if int(row['subject_end']) < int(row['subject_start']):
+                if record.reverse:
                     # Create a sequence object using Biopython
-                    seq = Seq(row['query_sequence'], IUPAC.unambiguous_dna)
+                    seq = Seq(record.query_sequence, IUPAC.unambiguous_dna)
                     # Calculate the reverse complement of the sequence
                     querysequence = str(seq.reverse_complement())
                 # If the sequence is not reversed, use the sequence as it is in the output
                 else:
-                    querysequence = row['query_sequence']
+                    querysequence = record.query_sequence
                 # Add the sequence in the correct orientation to the sample
                 sample[self.analysistype].targetsequence[target] = querysequence
 
@@ -817,10 +770,7 @@ class GeneSeekr(object):
         else:
             self.unique = inputobject.unique
         # Fields used for custom outfmt 6 BLAST output:
-        self.fieldnames = ['query_id', 'subject_id', 'positives', 'mismatches', 'gaps',
-                           'evalue', 'bit_score', 'subject_length', 'alignment_length',
-                           'query_start', 'query_end', 'query_sequence',
-                           'subject_start', 'subject_end', 'subject_sequence']
+        self.fieldnames = FIELDNAMES
         self.plusdict = defaultdict(make_dict)
         self.dqueue = Queue(maxsize=self.cpus)
         self.blastqueue = Queue(maxsize=self.cpus)
@@ -848,11 +798,8 @@ if __name__ == '__main__':
             # begins with .fa
             self.strains = sorted(glob(os.path.join(self.sequencepath, '*.fa*'.format(self.sequencepath))))
             self.targets = sorted(glob(os.path.join(self.targetpath, '*.tfa')))
-            try:
-                self.combinedtargets = glob(os.path.join(self.targetpath, '*.fasta'))[0]
-            except IndexError:
-                combinetargets(self.targets, self.targetpath)
-                self.combinedtargets = glob(os.path.join(self.targetpath, '*.fasta'))[0]
+            # Create the combined targets file, or update it if the targets have changed
+            self.combinedtargets = findcombinedtargets(self.targets, self.targetpath)
             # Populate the metadata object. This object will be populated to mirror the objects created in the
             # genome assembly pipeline. This way this script will be able to be used as a stand-alone, or as part
             # of a pipeline
@@ -988,11 +935,8 @@ class PipelineInit(object):
                 targets = glob(os.path.join(targetpath, '*.tfa'))
                 targetcheck = glob(os.path.join(targetpath, '*.tfa'))
                 if targetcheck:
-                    try:
-                        combinedtargets = glob(os.path.join(targetpath, '*.fasta'))[0]
-                    except IndexError:
-                        combinetargets(targets, targetpath)
-                        combinedtargets = glob(os.path.join(targetpath, '*.fasta'))[0]
+                    # Create the combined targets file, or update it if the targets have changed
+                    combinedtargets = findcombinedtargets(targets, targetpath)
                     sample[self.analysistype].targets = targets
                     sample[self.analysistype].combinedtargets = combinedtargets
                     sample[self.analysistype].targetpath = targetpath
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+__author__ = 'adamkoziol'
+
+# Characters that are not part of the sequence lines of a FASTA file
+WHITESPACE = b' \t\r\n'
+
+
+def contiglengths(fastapath, chunksize=1 << 22):
+    """
+    Read a FASTA file in large chunks, and count the length of each contig, as well as the number of G/C and N bases.
+    Only the current chunk is held in memory, regardless of the size of the contigs
+    :param fastapath: name and path of the FASTA file
+    :param chunksize: number of bytes to read at a time
+    :return: list of contig lengths in the order of the file, number of G/C (and S) bases, number of N bases
+    """
+    lengths = list()
+    gc = 0
+    ambiguous = 0
+    # Whether the current position is in a header line, whether it is at the start of a line, and the length of the
+    # current contig (None before the first header)
+    inheader = False
+    linestart = True
+    length = None
+    with open(fastapath, 'rb') as fasta:
+        for chunk in iter(lambda: fasta.read(chunksize), b''):
+            position = 0
+            while position < len(chunk):
+                if inheader:
+                    newline = chunk.find(b'\n', position)
+                    if newline == -1:
+                        position = len(chunk)
+                        continue
+                    inheader = False
+                    position = newline + 1
+                    linestart = True
+                    continue
+                # A header starts either at the beginning of the chunk (if the previous chunk ended with a newline), or
+                # after a newline within the chunk
+                if linestart and chunk[position:position + 1] == b'>':
+                    header = position
+                else:
+                    header = chunk.find(b'\n>', position)
+                    header = header + 1 if header != -1 else len(chunk)
+                # Sequence before the first header is not part of a record
+                if length is not None:
+                    sequence = chunk[position:header].translate(None, WHITESPACE)
+                    length += len(sequence)
+                    gc += sum(sequence.count(base) for base in (b'G', b'C', b'S', b'g', b'c', b's'))
+                    ambiguous += sequence.count(b'N') + sequence.count(b'n')
+                if header < len(chunk):
+                    if length is not None:
+                        lengths.append(length)
+                    length = 0
+                    inheader = True
+                    position = header + 1
+                else:
+                    position = len(chunk)
+            linestart = chunk.endswith(b'\n')
+    if length is not None:
+        lengths.append(length)
+    return lengths, gc, ambiguous
+
+
+def nx(lengths, total, fraction):
+    """
+    Find the Nx and Lx of an assembly e.g. the N50 is the largest contig such that at least half of the total genome
+    size is contained in contigs equal to or larger than this contig, and the L50 is the number of these contigs
+    :param lengths: list of contig lengths sorted from largest to smallest
+    :param total: total length of the assembly
+    :param fraction: fraction of the total length e.g. 0.5 for the N50
+    :return: Nx, Lx. '-' for both if the assembly is empty
+    """
+    currentlength = 0
+    for count, length in enumerate(lengths, 1):
+        currentlength += length
+        if currentlength >= total * fraction:
+            return length, count
+    return '-', '-'
+
+
+def assemblystats(fastapath, chunksize=1 << 22):
+    """
+    Calculate the statistics of an assembly in a single pass through the FASTA file. Intended to be run in a worker
+    process: only the summary statistics are returned. Missing files are treated as empty assemblies, which have a GC%
+    of 'NA'
+    :param fastapath: name and path of the FASTA file
+    :param chunksize: number of bytes to read at a time
+    :return: dictionary of statistic: value
+    """
+    try:
+        lengths, gc, ambiguous = contiglengths(fastapath, chunksize)
+    except FileNotFoundError:
+        lengths, gc, ambiguous = list(), 0, 0
+    lengths.sort(reverse=True)
+    total = sum(lengths)
+    n50, l50 = nx(lengths, total, 0.5)
+    n75, l75 = nx(lengths, total, 0.75)
+    return {
+        'genome_length': total,
+        'num_contigs': len(lengths),
+        'longest_contig': lengths[0] if lengths else 0,
+        # GC% of the total genome sequence - formatted to have two decimal places. Bio.SeqUtils.GC returned 0.0 for
+        # empty assemblies, but GenObject cannot store 0.0, so the TypeError handler stored 'NA' instead
+        'gc': float('{:0.2f}'.format(gc * 100 / total)) if total else 'NA',
+        'n_count': ambiguous,
+        'n50': n50,
+        'l50': l50,
+        'n75': n75,
+        'l75': l75
+    }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+from array import array
+import numpy
+import pysam
+import os
+
+__author__ = 'adamkoziol'
+
+
+class CoverageCounts(object):
+    """
+    Accumulates the depth of coverage of a single contig. The aligned blocks of each read are buffered as start and end
+    positions, and added to a difference array in bulk with numpy.bincount, so the depth of every position is
+    obtained with a single cumulative sum rather than by visiting each aligned base
+    """
+
+    def add(self, record):
+        """
+        Buffer the aligned blocks (matches and mismatches - not deletions or skipped regions) of a read
+        :param record: pysam AlignedSegment aligned to this contig
+        """
+        for start, end in record.get_blocks():
+            self.starts.append(start)
+            self.ends.append(end)
+        if len(self.starts) >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        """
+        Add the buffered blocks to the difference array, and clear the buffers
+        """
+        if self.starts:
+            starts = numpy.minimum(numpy.array(self.starts, dtype=numpy.int64), self.length)
+            ends = numpy.minimum(numpy.array(self.ends, dtype=numpy.int64), self.length)
+            self.difference += numpy.bincount(starts, minlength=self.length + 1)
+            self.difference -= numpy.bincount(ends, minlength=self.length + 1)
+            self.starts = list()
+            self.ends = list()
+
+    def depth(self):
+        """
+        :return: numpy array of the depth of coverage of every position in the contig
+        """
+        self.flush()
+        return numpy.cumsum(self.difference[:-1])
+
+    def __init__(self, length, buffersize=100000):
+        self.length = length
+        self.buffersize = buffersize
+        self.difference = numpy.zeros(length + 1, dtype=numpy.int64)
+        self.starts = list()
+        self.ends = list()
+
+
+def bamcoverage(bamfile, buffersize=100000):
+    """
+    Calculate the coverage depth of each contig, and the insert size and mapping statistics of a sorted BAM file in a
+    single pass. The BAM file does not need to be indexed. Intended to be run in a worker process: the per-position
+    depths are discarded once summarised, so only the compact results are returned to the parent process. The
+    statistics reproduce the values previously parsed from the genome_results.txt report of qualimap bamqc
+    :param bamfile: name and path of the sorted BAM file
+    :param buffersize: number of aligned blocks to buffer before updating the depth of a contig
+    :return: dictionary of the sample.mapping attribute: value (formatted as in the qualimap report), and dictionary
+    of the sample.depth attribute (length, bases, coverage, stddev): dictionary of contig name: value
+    """
+    reads = 0
+    mapped = 0
+    quality = 0
+    # Insert sizes of the properly paired reads - four bytes per pair
+    inserts = array('i')
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        lengths = dict(zip(bam.references, bam.lengths))
+        counters = dict()
+        for record in bam.fetch(until_eof=True):
+            # Only consider the primary alignment of each read
+            if record.is_secondary or record.is_supplementary:
+                continue
+            reads += 1
+            if record.is_unmapped:
+                continue
+            mapped += 1
+            quality += record.mapping_quality
+            # Each pair is counted once, from its first read
+            if record.is_proper_pair and record.is_read1 and record.template_length:
+                inserts.append(abs(record.template_length))
+            contig = record.reference_name
+            try:
+                counters[contig].add(record)
+            except KeyError:
+                counters[contig] = CoverageCounts(lengths[contig], buffersize)
+                counters[contig].add(record)
+    depth = {'length': dict(), 'bases': dict(), 'coverage': dict(), 'stddev': dict()}
+    total = 0
+    squares = 0
+    for contig, length in lengths.items():
+        contigdepth = counters.pop(contig).depth() if contig in counters else numpy.zeros(length, dtype=numpy.int64)
+        bases = int(contigdepth.sum())
+        total += bases
+        squares += float(numpy.dot(contigdepth, contigdepth))
+        depth['length'][contig] = length
+        depth['bases'][contig] = bases
+        depth['coverage'][contig] = round(bases / length, 4) if length else 0
+        depth['stddev'][contig] = round(float(contigdepth.std()), 4) if length else 0
+    genomelength = sum(lengths.values())
+    meancoverage = total / genomelength if genomelength else 0
+    # Standard deviation of the depth of all the positions in the assembly
+    stdcoverage = max(squares / genomelength - meancoverage ** 2, 0) ** 0.5 if genomelength else 0
+    mapping = {
+        'Bases': '{}bp'.format(genomelength),
+        'Contigs': str(len(lengths)),
+        'Reads': str(reads),
+        'MappedReads': '{}({:.2f}%)'.format(mapped, mapped * 100 / reads if reads else 0),
+        'MappedBases': '{}bp'.format(total),
+        'MeanMappingQuality': '{:.4f}'.format(quality / mapped if mapped else 0),
+        'MeanCoveragedata': '{:.4f}'.format(meancoverage),
+        'StdCoveragedata': '{:.4f}'.format(stdcoverage)
+    }
+    mapping.update(insertsizes(inserts))
+    return mapping, depth
+
+
+def insertsizes(inserts):
+    """
+    :param inserts: array of the insert sizes of the properly paired reads
+    :return: dictionary of the mean, standard deviation, and median insert size. 'NA' for unpaired reads
+    """
+    if not inserts:
+        return {'MeanInsertSize': 'NA', 'StdInsertSize': 'NA', 'MedianInsertSize': 'NA'}
+    sizes = numpy.frombuffer(inserts, dtype=numpy.dtype(inserts.typecode))
+    return {
+        'MeanInsertSize': '{:.4f}'.format(float(sizes.mean())),
+        'StdInsertSize': '{:.4f}'.format(float(sizes.std())),
+        'MedianInsertSize': str(int(numpy.median(sizes)))
+    }
+
+
+def filtercontigs(contigsfile, filteredfile, coverage, threshold, name, minlength=500):
+    """
+    Write the contigs of an assembly that pass the depth and length filters to the filtered assembly file. The assembly
+    is streamed one contig at a time, and passing contigs are written as they are read, so only the current contig is
+    held in memory. Passing contigs are renamed by replacing 'Contig' in the header with the name of the sample.
+    Intended to be run in a worker process
+    :param contigsfile: name and path of the assembly
+    :param filteredfile: name and path of the filtered assembly to create. Only created if at least one contig passes
+    :param coverage: dictionary of contig name: mean depth of coverage. Contigs without a depth do not pass
+    :param threshold: minimum depth of coverage of a contig (exclusive)
+    :param name: name of the sample
+    :param minlength: minimum length of a contig (exclusive)
+    :return: number of contigs, number of passing contigs
+    """
+    temporary = '{}.tmp'.format(filteredfile)
+    counts = [0, 0]
+
+    def flush(header, sequence, output):
+        if header is None:
+            return
+        counts[0] += 1
+        contigid = header[1:].split(None, 1)[0].decode() if len(header) > 1 else ''
+        # Remove the _pilon added to the contig name in order to allow the contig name to match the original
+        # name used as the key in the coverage dictionary
+        contig = contigid.split('_pilon')[0]
+        if float(coverage.get(contig, 0)) > threshold and len(sequence) > minlength:
+            counts[1] += 1
+            output.write('>{}\n'.format(contigid.replace('Contig', name)).encode())
+            # Wrap the sequence to 60 characters per line
+            for start in range(0, len(sequence), 60):
+                output.write(sequence[start:start + 60] + b'\n')
+
+    with open(contigsfile, 'rb') as contigs, open(temporary, 'wb') as output:
+        header = None
+        sequence = bytearray()
+        for line in contigs:
+            if line.startswith(b'>'):
+                flush(header, sequence, output)
+                header = line.rstrip()
+                sequence = bytearray()
+            elif header is not None:
+                sequence += line.translate(None, b' \t\r\n')
+        flush(header, sequence, output)
+    # Only create the file if there are contigs that pass the depth filter
+    if counts[1]:
+        os.replace(temporary, filteredfile)
+    else:
+        os.remove(temporary)
+    return tuple(counts)
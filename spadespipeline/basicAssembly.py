@@ -60,8 +60,9 @@ class Basic(object):
         self.readlength()
 
     def readlength(self):
-        """Calculates the read length of the fastq files. Short reads will not be able to be assembled properly with the
-        default parameters used for spades."""
+        """Calculates the read length of the fastq files from the first 250 reads of each file. Short reads will not be
+        able to be assembled properly with the default parameters used for spades. Lengths that cannot be calculated
+        here are filled in by Quality.validate_fastq from its pass through the reads"""
         # Iterate through the samples
         for sample in self.samples:
             sample.run.Date = 'NA'
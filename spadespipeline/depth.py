@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
-from accessoryFunctions.accessoryFunctions import make_path, run_subprocess, write_to_logfile, logstr, GenObject, \
-    printtime, get_version, MetadataObject
+from accessoryFunctions.accessoryFunctions import make_path, run_streamcall, run_subprocess, write_to_logfile, logstr, \
+    GenObject, printtime, get_version, linkfile, MetadataObject
 from spadespipeline.bowtie import Bowtie2BuildCommandLine, Bowtie2CommandLine
-from Bio.Sequencing.Applications import SamtoolsViewCommandline, SamtoolsSortCommandline, SamtoolsIndexCommandline
+from spadespipeline.bamcoverage import bamcoverage, filtercontigs
+from accessoryFunctions.checkpoint import checkpoint
+from Bio.Sequencing.Applications import SamtoolsIndexCommandline
 from Bio.Application import ApplicationError
-from Bio import SeqIO
 from threading import Lock, Thread
+from subprocess import CalledProcessError
+from multiprocessing import Pool
 from io import StringIO
 from glob import glob
 import threading
-import shutil
 import os
-import re
 
 __author__ = 'mike knowles, adamkoziol'
 
@@ -24,6 +25,9 @@ class QualiMap(object):
         """
         printtime('Aligning reads with bowtie2 for Qualimap', self.start)
         self.bowtie()
+        # Qualimap is only run if requested - the coverage is otherwise calculated directly from the sorted BAM files
+        if not self.qualimap:
+            self.coverage()
         self.indexing()
         self.pilon()
         self.filter()
@@ -59,11 +63,9 @@ class QualiMap(object):
                 bowtie2build = Bowtie2BuildCommandLine(reference=sagen.bestassemblyfile,
                                                        bt2=sagen.bowtie2results)
                 sample.mapping.BamFile = sagen.bowtie2results + "_sorted.bam"
-                # SAMtools sort v1.3 has different run parameters
-                samsort = SamtoolsSortCommandline(input=sample.mapping.BamFile,
-                                                  o=True,
-                                                  out_prefix="-")
-                samtools = [SamtoolsViewCommandline(b=True, S=True, input_file="-"), samsort]
+                # Stream the SAM output of bowtie2 directly into samtools sort - the alignments are never written to
+                # disk unsorted, or held in memory by Python
+                samtools = [self.sortcall(sample)]
                 indict = {'D': 5, 'R': 1, 'num_mismatches': 0, 'seed_length': 22, 'i_func': "S,0,2.50"}
                 #  Update the dictionary with the appropriate parameters for paired- vs. single-ended assemblies
                 try:
@@ -94,44 +96,55 @@ class QualiMap(object):
         self.bowqueue.join()
 
     def align(self):
-        # from subprocess import call
         while True:
             sample, bowtie2build, bowtie2align = self.bowqueue.get()
             if sample.general.bestassemblyfile != 'NA':
                 if not os.path.isfile(sample.mapping.BamFile):
-                    stdout = StringIO()
                     for func in bowtie2build, bowtie2align:
-                        stdout.close()
-                        out, err = run_subprocess(str(func))
+                        # The alignment is piped into samtools sort, so the commands are run with pipefail - a failure
+                        # of bowtie2 would otherwise leave a truncated, but apparently complete, sorted BAM file
+                        try:
+                            out, err = run_streamcall(str(func))
+                            failed = False
+                        except CalledProcessError as exception:
+                            out, err = exception.output, exception.stderr
+                            failed = True
                         self.threadlock.acquire()
                         write_to_logfile(str(func), str(func), self.logfile, sample.general.logout,
                                          sample.general.logerr, None, None)
                         write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr,
                                          None, None)
                         self.threadlock.release()
-            # For different alignment
-            sam = sample.general.bowtie2results + ".sam"
-            if os.path.isfile(sam):
-                # PIPE stdout to stdin of samtools view then sort (only outputting sorted bam)
-                samsort = SamtoolsSortCommandline(input=sample.mapping.BamFile, o=True, out_prefix="-")
-                # Use cStringIO streams to handle bowtie output
-                stdout = StringIO()
-                for func in [SamtoolsViewCommandline(b=True,
-                                                     S=True,
-                                                     F=4,
-                                                     h=True,
-                                                     input_file=sample.mapping.BamFile), samsort]:
-                    # Use closing contextmanager for handle __exit__() as close()
-                    stdout, stderr = map(StringIO, func(stdin=stdout.getvalue()))
-                    # Write the standard error to log
-                    with open(os.path.join(sample.general.QualimapResults, "samtools.log"), "ab+") as log:
-                        log.writelines(logstr(func, stderr.getvalue()))
-                    stderr.close()
-                stdout.close()
-            self.mapper(sample)
+                        if failed:
+                            # Remove any partial BAM file, so the sample is not treated as mapped in subsequent runs
+                            try:
+                                os.remove(sample.mapping.BamFile)
+                            except FileNotFoundError:
+                                pass
+                            break
+            if self.qualimap:
+                self.mapper(sample)
             # Signal to the queue that the job is done
             self.bowqueue.task_done()
 
+    def sortcall(self, sample):
+        """
+        Create the samtools sort call that reads the SAM output of bowtie2 from stdin, and writes the sorted BAM file.
+        The sort is multithreaded, and its memory per thread and temporary directory are set by the sortthreads,
+        sortmemory and sorttempdir attributes
+        :param sample: metadata object
+        :return: string of the samtools sort call
+        """
+        # The temporary files are named with the prefix of the sample, so the same directory can be used for all samples
+        tempdir = self.sorttempdir if self.sorttempdir else sample.general.QualimapResults
+        make_path(tempdir)
+        # samtools sort -@ sets the number of additional threads
+        return 'samtools sort -@ {threads} -m {memory} -T {prefix} -o {bam} -'\
+            .format(threads=max(self.sortthreads - 1, 0),
+                    memory=self.sortmemory,
+                    prefix=os.path.join(tempdir, '{}_sort'.format(sample.name)),
+                    bam=sample.mapping.BamFile)
+
     def mapper(self, sample):
         """
         Run qualimap and parse the outputs
@@ -190,6 +203,46 @@ class QualiMap(object):
                     # Remove the 'X' from the depth values e.g. 40.238X
                     setattr(sample.mapping, attribute, qdict[attribute].rstrip('X'))
 
+    def coverage(self):
+        """
+        Calculate the per-contig coverage depth, and the insert size and mapping statistics of the sorted BAM files in a
+        pool of worker processes. Populates the same sample.mapping and sample.depth attributes as parsing the
+        Qualimap report
+        """
+        printtime('Calculating coverage depth', self.start)
+        jobs = dict()
+        for sample in self.metadata:
+            if sample.general.bestassemblyfile != 'NA':
+                # Initialise a genobject to store the coverage dictionaries
+                sample.depth = GenObject()
+                sample.depth.length = dict()
+                sample.depth.bases = dict()
+                sample.depth.coverage = dict()
+                sample.depth.stddev = dict()
+                if os.path.isfile(sample.mapping.BamFile):
+                    jobs[sample.name] = sample.mapping.BamFile
+        results = dict()
+        if jobs:
+            with Pool(processes=min(int(self.cpus), len(jobs))) as pool:
+                pending = {name: pool.apply_async(bamcoverage, (bamfile,)) for name, bamfile in jobs.items()}
+                for name, result in pending.items():
+                    # A corrupt or truncated BAM file only prevents the coverage of its own sample from being
+                    # calculated. The mapping attributes of the sample are not set, so its contigs are not filtered
+                    try:
+                        results[name] = result.get()
+                    except (OSError, ValueError) as exception:
+                        sample = [sample for sample in self.metadata if sample.name == name][0]
+                        write_to_logfile(str(), 'Could not calculate the coverage of {}: {}'
+                                         .format(jobs[name], exception), self.logfile, sample.general.logout,
+                                         sample.general.logerr, None, None)
+        for sample in self.metadata:
+            if sample.name in results:
+                mapping, depth = results[sample.name]
+                for attribute, value in mapping.items():
+                    setattr(sample.mapping, attribute, value)
+                for attribute, values in depth.items():
+                    setattr(sample.depth, attribute, values)
+
     def indexing(self):
         printtime('Indexing sorted bam files', self.start)
         for i in range(self.cpus):
@@ -260,85 +313,78 @@ class QualiMap(object):
         while True:
             sample = self.pilonqueue.get()
             sample.general.contigsfile = os.path.join(sample.mapping.pilondir, 'pilon.fasta')
-            # Only perform analyses if the output file doesn't already exist
-            if not os.path.isfile(sample.general.contigsfile):
+            # The polished assembly depends on the assembly and the reads mapped to it
+            inputs = [sample.general.assemblyfile, sample.mapping.BamFile]
+            # Only perform analyses if the output file wasn't already created with the same command and inputs
+            if not checkpoint(sample).complete('pilon', sample.mapping.piloncmd, inputs,
+                                               [sample.general.contigsfile]):
                 command = sample.mapping.piloncmd
-                out, err = run_subprocess(command)
+                # The exit status is checked, so that a failed polish is not recorded as complete
+                try:
+                    out, err = run_streamcall(command)
+                    succeeded = True
+                except CalledProcessError as exception:
+                    out, err = exception.output, exception.stderr
+                    succeeded = False
                 self.threadlock.acquire()
                 write_to_logfile(command, command, self.logfile, sample.general.logout, sample.general.logerr, None,
                                  None)
                 write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
                 self.threadlock.release()
+                if succeeded:
+                    checkpoint(sample).record('pilon', command, inputs, [sample.general.contigsfile])
+                else:
+                    checkpoint(sample).invalidate('pilon')
             self.pilonqueue.task_done()
 
     def filter(self):
         """
-        Filter contigs based on depth
+        Filter contigs based on depth in a pool of worker processes
         """
-
         printtime('Filtering contigs', self.start)
-        for i in range(self.cpus):
-            # Send the threads to the filter method
-            threads = Thread(target=self.filterthreads, args=())
-            # Set the daemon to true - something to do with thread management
-            threads.setDaemon(True)
-            # Start the threading
-            threads.start()
+        jobs = dict()
         for sample in self.metadata:
             # Set the name of the unfiltered assembly output file
             if sample.general.bestassemblyfile != 'NA':
                 sample.general.contigsfile = sample.general.assemblyfile
-                self.filterqueue.put(sample)
-        self.filterqueue.join()
+                # Only run on samples that have been assembled
+                if os.path.isfile(sample.general.contigsfile) and not os.path.isfile(sample.general.filteredfile):
+                    try:
+                        # Calculate the minimum depth once for each sample: contigs must have a depth greater than
+                        # 1.5 standard deviations below the mean depth of the assembly
+                        coveragemean = float(sample.mapping.MeanCoveragedata.split('X')[0])
+                        coveragestd = float(sample.mapping.StdCoveragedata.split('X')[0])
+                    except (KeyError, ValueError):
+                        continue
+                    jobs[sample.name] = (sample.general.contigsfile, sample.general.filteredfile,
+                                         sample.depth.coverage, coveragemean - coveragestd * 1.5, sample.name)
+        if jobs:
+            with Pool(processes=min(int(self.cpus), len(jobs))) as pool:
+                pending = [pool.apply_async(filtercontigs, args) for args in jobs.values()]
+                for result in pending:
+                    result.get()
+        for sample in self.metadata:
+            if sample.general.bestassemblyfile != 'NA':
+                self.bestassembly(sample)
 
-    def filterthreads(self):
-        while True:
-            sample = self.filterqueue.get()
-            # Only run on samples that have been assembled
-            if os.path.isfile(sample.general.contigsfile) and not os.path.isfile(sample.general.filteredfile):
-                # Create a list to store all the records of contigs that pass the minimum depth filtering
-                passdepth = list()
-                for record in SeqIO.parse(open(sample.general.contigsfile, "rU"), "fasta"):
-                    # Extract the values for the mean and standard deviation of the coverage, and split off
-                    # the X from the end e.g. 73.07X
-                    coveragemean = float(sample.mapping.MeanCoveragedata.split('X')[0])
-                    coveragestd = float(sample.mapping.StdCoveragedata.split('X')[0])
-                    # Remove the _pilon added to the contig name in order to allow the contig name to match the original
-                    # name used as the key in the sample.depth.coverage dictionary
-                    contig = record.id.split('_pilon')[0]
-                    # Only include contigs with a depth greater or equal to 10
-                    if float(sample.depth.coverage[contig]) > (coveragemean - coveragestd * 1.5) \
-                            and len(record.seq) > 500:
-                        # Replace 'NODE' in the fasta header with the sample name
-                        # >NODE_1_length_705814_cov_37.107_ID_4231
-                        newid = re.sub("Contig", sample.name, record.id)
-                        record.id = str(record.id).replace('Contig', sample.name)
-                        record.id = newid
-                        # Clear the name and description attributes of the record
-                        record.name = ''
-                        record.description = ''
-                        # Add this record to our list
-                        passdepth.append(record)
-                # Only create the file if there are contigs that pass the depth filter
-                if passdepth:
-                    # Open the filtered assembly file
-                    with open(sample.general.filteredfile, 'w') as formatted:
-                        # Write the records in the list to the file
-                        SeqIO.write(passdepth, formatted, 'fasta')
-            # If the filtered file was successfully created, copy it to the BestAssemblies folder
-            if os.path.isfile(sample.general.filteredfile):
-                # Set the assemblies path
-                sample.general.bestassembliespath = os.path.join(self.path, 'BestAssemblies')
-                # Set the name of the file in the best assemblies folder
-                bestassemblyfile = os.path.join(sample.general.bestassembliespath, '{}.fasta'.format(sample.name))
-                # Add the name and path of the best assembly file to the metadata
-                sample.general.bestassemblyfile = bestassemblyfile
-                # Copy the filtered file to the BestAssemblies folder
-                if not os.path.isfile(bestassemblyfile):
-                    shutil.copyfile(sample.general.filteredfile, bestassemblyfile)
-            else:
-                sample.general.bestassemblyfile = 'NA'
-            self.filterqueue.task_done()
+    def bestassembly(self, sample):
+        """
+        Add the filtered assembly of a sample to the BestAssemblies folder
+        :param sample: metadata object
+        """
+        # If the filtered file was successfully created, link it to the BestAssemblies folder
+        if os.path.isfile(sample.general.filteredfile):
+            # Set the assemblies path
+            sample.general.bestassembliespath = os.path.join(self.path, 'BestAssemblies')
+            # Set the name of the file in the best assemblies folder
+            bestassemblyfile = os.path.join(sample.general.bestassembliespath, '{}.fasta'.format(sample.name))
+            # Add the name and path of the best assembly file to the metadata
+            sample.general.bestassemblyfile = bestassemblyfile
+            # Hard link (or clone) the filtered file to the BestAssemblies folder rather than copying it
+            if not os.path.isfile(bestassemblyfile):
+                linkfile(sample.general.filteredfile, bestassemblyfile)
+        else:
+            sample.general.bestassemblyfile = 'NA'
 
     def clear(self):
         """
@@ -379,6 +425,25 @@ class QualiMap(object):
             self.threads = self.cpus
         self.logfile = inputobject.logfile
         self.path = inputobject.path
+        # Optionally run Qualimap rather than calculating the coverage from the BAM files
+        try:
+            self.qualimap = inputobject.qualimap
+        except AttributeError:
+            self.qualimap = False
+        # Number of threads, memory per thread (e.g. 768M), and temporary directory of samtools sort. The temporary
+        # files are written to the qualimap_results folder of each sample unless a directory is provided
+        try:
+            self.sortthreads = int(inputobject.sortthreads)
+        except AttributeError:
+            self.sortthreads = int(self.threads)
+        try:
+            self.sortmemory = inputobject.sortmemory
+        except AttributeError:
+            self.sortmemory = '768M'
+        try:
+            self.sorttempdir = inputobject.sorttempdir
+        except AttributeError:
+            self.sorttempdir = None
         self.samversion = get_version(['samtools']).decode('utf-8').split('\n')[2].split()[1]
         # Initialise queues
         self.mapqueue = Queue(maxsize=self.cpus)
@@ -386,7 +451,6 @@ class QualiMap(object):
         self.bowqueue = Queue(maxsize=self.cpus)
         self.pilonqueue = Queue(maxsize=self.cpus)
         self.indexqueue = Queue(maxsize=self.cpus)
-        self.filterqueue = Queue(maxsize=self.cpus)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import hashlib
+import gzip
+import zlib
+
+__author__ = 'adamkoziol'
+
+
+def readname(header):
+    """
+    Extract the name of a read from its header, so that the names of paired reads match e.g. both
+    @M02466:126:000000000-AKF4P:1:1101:11875:1838 1:N:0:1 and @M02466:126:000000000-AKF4P:1:1101:11875:1838 2:N:0:1,
+    or @read/1 and @read/2
+    :param header: bytes of the header line
+    :return: bytes of the name of the read
+    """
+    name = header[1:].split(None, 1)[0] if len(header) > 1 else b''
+    if name.endswith((b'/1', b'/2')):
+        name = name[:-2]
+    return name
+
+
+def fastqstats(fastqfile, chunksize=1 << 22):
+    """
+    Check the structure of a (gzipped) FASTQ file in a single pass: every record must have four lines, a header
+    starting with '@', a separator starting with '+', and quality scores of the same length as the sequence. The
+    file is read in large chunks, so only the current chunk is held in memory. Intended to be run in a worker process
+    :param fastqfile: name and path of the FASTQ file
+    :param chunksize: number of (decompressed) bytes to read at a time
+    :return: dictionary of the number of reads, the number of bases, the length of the longest read, the hash of the
+    ordered read names (used to check pairing), and the error (None if the file is valid)
+    """
+    stats = {'reads': 0, 'bases': 0, 'maxlength': 0, 'names': None, 'error': None}
+    names = hashlib.sha256()
+    remainder = list()
+    opener = gzip.open if fastqfile.endswith('.gz') else open
+    try:
+        with opener(fastqfile, 'rb') as fastq:
+            for chunk in iter(lambda: fastq.read(chunksize), b''):
+                lines = chunk.split(b'\n')
+                # Join the partial line at the end of the previous chunk to the first line of this chunk
+                if remainder:
+                    lines[0] = remainder.pop() + lines[0]
+                    lines = remainder + lines
+                # The last line may be incomplete, as may the last record
+                complete = (len(lines) - 1) // 4 * 4
+                remainder = lines[complete:]
+                error = checkrecords(lines[:complete], stats, names)
+                if error:
+                    stats['error'] = error
+                    return stats
+    except (OSError, EOFError, zlib.error) as exception:
+        stats['error'] = 'Could not read {}: {}'.format(fastqfile, exception)
+        return stats
+    # Only blank lines may follow the last complete record
+    if any(line.strip() for line in remainder):
+        stats['error'] = 'Truncated record at the end of {}'.format(fastqfile)
+        return stats
+    stats['names'] = names.hexdigest()
+    return stats
+
+
+def checkrecords(lines, stats, names):
+    """
+    Check a list of complete FASTQ records, and update the statistics
+    :param lines: list of the lines of the records (a multiple of four)
+    :param stats: dictionary of the statistics of the file
+    :param names: hash of the read names of the file
+    :return: string describing the first error in the records, or None
+    """
+    headers = lines[0::4]
+    sequences = lines[1::4]
+    separators = lines[2::4]
+    qualities = lines[3::4]
+    if not all(header[:1] == b'@' for header in headers):
+        return 'Malformed header after read {}'.format(stats['reads'] + findfirst(headers, b'@'))
+    if not all(separator[:1] == b'+' for separator in separators):
+        return 'Malformed separator after read {}'.format(stats['reads'] + findfirst(separators, b'+'))
+    lengths = [len(sequence.rstrip(b'\r')) for sequence in sequences]
+    if lengths != [len(quality.rstrip(b'\r')) for quality in qualities]:
+        return 'Sequence and quality lengths differ after read {}'.format(stats['reads'])
+    names.update(b'\n'.join(readname(header) for header in headers) + b'\n' if headers else b'')
+    stats['reads'] += len(headers)
+    stats['bases'] += sum(lengths)
+    stats['maxlength'] = max([stats['maxlength']] + lengths)
+    return None
+
+
+def findfirst(lines, prefix):
+    """
+    :return: index of the first line that does not start with the prefix
+    """
+    return next(index for index, line in enumerate(lines) if line[:1] != prefix)
+
+
+def combinestats(stats):
+    """
+    Combine the statistics of the FASTQ file(s) of a sample. Paired files must contain the same reads, in the same
+    order
+    :param stats: list of the fastqstats dictionaries of the forward (and reverse) files
+    :return: dictionary of the error (None if the files are valid), the number of reads, the number of bases, and the
+    mean read length
+    """
+    errors = [fileresults['error'] for fileresults in stats if fileresults['error']]
+    error = errors[0] if errors else None
+    if not error and len(stats) == 2:
+        if stats[0]['reads'] != stats[1]['reads']:
+            error = 'The forward and reverse files contain different numbers of reads: {} and {}'\
+                .format(stats[0]['reads'], stats[1]['reads'])
+        elif stats[0]['names'] != stats[1]['names']:
+            error = 'The names of the forward and reverse reads do not match'
+    reads = sum(fileresults['reads'] for fileresults in stats)
+    bases = sum(fileresults['bases'] for fileresults in stats)
+    return {
+        'error': error,
+        'readcount': reads,
+        'totalbases': bases,
+        'meanreadlength': float('{:0.2f}'.format(bases / reads)) if reads else 0
+    }
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import numpy
+import gzip
+
+__author__ = 'adamkoziol'
+
+# Lookup table to convert ASCII-encoded bases into 2-bit codes. Anything that is not A, C, G, or T is set to 4, and
+# k-mers containing it are not counted
+CODES = numpy.full(256, 4, dtype=numpy.uint8)
+for _code, _base in enumerate('ACGT'):
+    CODES[ord(_base)] = _code
+    CODES[ord(_base.lower())] = _code
+# Multiplier of the multiplicative (Fibonacci) hash used to assign k-mers to the cells of the count table
+HASH = numpy.uint64(0x9E3779B97F4A7C15)
+# Maximum count of a cell of the count table
+SATURATION = numpy.iinfo(numpy.uint16).max
+
+
+def sequences(fastqfiles, fraction=1.0, chunksize=1 << 22):
+    """
+    Read the sequences of (gzipped) FASTQ files in large chunks, and yield a sample of them. Reads are sampled at a
+    regular interval, so the sample is the same every time the files are read
+    :param fastqfiles: list of the names and paths of the FASTQ files
+    :param fraction: fraction of the reads to yield
+    :param chunksize: number of (decompressed) bytes to read at a time
+    :return: generator of lists of the bytes of the sampled sequences
+    """
+    read = 0
+    for fastqfile in fastqfiles:
+        opener = gzip.open if fastqfile.endswith('.gz') else open
+        remainder = list()
+        with opener(fastqfile, 'rb') as fastq:
+            for chunk in iter(lambda: fastq.read(chunksize), b''):
+                lines = chunk.split(b'\n')
+                # Join the partial line at the end of the previous chunk to the first line of this chunk
+                if remainder:
+                    lines[0] = remainder.pop() + lines[0]
+                    lines = remainder + lines
+                complete = (len(lines) - 1) // 4 * 4
+                remainder = lines[complete:]
+                batch = list()
+                for sequence in lines[1:complete:4]:
+                    # Keep the read if the sampled fraction of the reads crosses an integer
+                    if int((read + 1) * fraction) > int(read * fraction):
+                        batch.append(sequence.rstrip(b'\r'))
+                    read += 1
+                yield batch
+        # The last record of a file without a trailing newline
+        if len(remainder) >= 2 and remainder[0]:
+            if int((read + 1) * fraction) > int(read * fraction):
+                yield [remainder[1].rstrip(b'\r')]
+            read += 1
+
+
+def canonicalkmers(batch, k=31):
+    """
+    Encode the k-mers of a batch of reads as 2-bit packed integers. Each k-mer and its reverse complement are
+    represented by the smaller of the two, so both strands of the genome are counted together
+    :param batch: list of the bytes of the sequences
+    :param k: length of the k-mers (at most 32)
+    :return: numpy array of the canonical k-mers (uint64) that do not contain ambiguous bases
+    """
+    if not batch:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    # Separate the reads with an ambiguous base, so that no k-mer spans two reads
+    codes = CODES[numpy.frombuffer(b'N'.join(batch), dtype=numpy.uint8)]
+    windows = len(codes) - k + 1
+    if windows < 1:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    invalid = numpy.concatenate(([0], numpy.cumsum(codes > 3)))
+    valid = invalid[k:] == invalid[:windows]
+    bases = numpy.minimum(codes, 3).astype(numpy.uint64)
+    forward = numpy.zeros(windows, dtype=numpy.uint64)
+    reverse = numpy.zeros(windows, dtype=numpy.uint64)
+    for offset in range(k):
+        window = bases[offset:offset + windows]
+        forward = (forward << numpy.uint64(2)) | window
+        reverse |= (numpy.uint64(3) - window) << numpy.uint64(2 * offset)
+    return numpy.minimum(forward, reverse)[valid]
+
+
+class KmerSpectrum(object):
+    """
+    Approximates the k-mer spectrum (the number of distinct k-mers occurring a given number of times) of a set of
+    reads in a fixed amount of memory. K-mers are hashed into a table of counts, so each cell holds the count of (in
+    most cases) a single k-mer. Collisions merge the counts of k-mers, but not the total number of k-mers, so the
+    genome size calculated from the total number of genomic k-mers is unaffected
+    """
+
+    def add(self, kmers):
+        """
+        Add a batch of k-mers to the count table
+        :param kmers: numpy array of k-mers
+        """
+        if not len(kmers):
+            return
+        cells = (kmers * HASH) >> numpy.uint64(64 - self.tablebits)
+        cells.sort()
+        # Count the occurrences of each cell in the batch
+        starts = numpy.flatnonzero(numpy.concatenate(([True], cells[1:] != cells[:-1])))
+        counts = numpy.diff(numpy.append(starts, len(cells)))
+        cells = cells[starts]
+        # Counts saturate at the maximum of the table, rather than overflowing
+        self.table[cells] = numpy.minimum(self.table[cells].astype(numpy.int64) + counts, SATURATION)
+        self.total += len(kmers)
+
+    def histogram(self, maximum=10000):
+        """
+        :param maximum: highest count in the histogram. Higher counts are added to the last bin
+        :return: numpy array of the number of cells with each count (index)
+        """
+        return numpy.bincount(numpy.minimum(self.table[self.table > 0], maximum), minlength=maximum + 1)
+
+    def __init__(self, tablebits=26):
+        """
+        :param tablebits: the count table has 2 ** tablebits cells of two bytes (128 MB by default). The table should
+        have more cells than the genome has k-mers, and not be greatly exceeded by the number of error k-mers
+        """
+        self.tablebits = tablebits
+        self.table = numpy.zeros(1 << tablebits, dtype=numpy.uint16)
+        self.total = 0
+
+
+def peaks(histogram, minimumheight=0.01):
+    """
+    Find the valley separating the error k-mers from the genomic k-mers, and the coverage peaks of the spectrum
+    :param histogram: numpy array of the number of k-mers with each count
+    :param minimumheight: minimum height of a secondary peak, as a fraction of the height of the main peak. Maxima
+    within 25% of the count of a higher peak are not considered separate peaks
+    :return: valley, list of the counts of the peaks in decreasing order of height (empty if there is no valley)
+    """
+    # Smooth the spectrum with a moving average, so that sampling noise does not create spurious valleys and peaks
+    smoothed = numpy.convolve(histogram.astype(numpy.float64), numpy.ones(3) / 3, mode='same')
+    # There are no k-mers with a count of zero - do not let the empty bin lower the smoothed count of one
+    smoothed[:2] = histogram[:2]
+    # The spectrum decreases from the error k-mers at a count of one to the first minimum
+    valley = 1
+    while valley + 1 < len(smoothed) - 1 and smoothed[valley + 1] <= smoothed[valley]:
+        valley += 1
+    if valley + 1 >= len(smoothed) - 1:
+        return valley, list()
+    # Local maxima after the valley
+    interior = smoothed[valley:-1]
+    maxima = numpy.flatnonzero((interior[1:-1] > interior[:-2]) & (interior[1:-1] >= interior[2:])) + valley + 1
+    if not len(maxima):
+        return valley, list()
+    heights = smoothed[maxima]
+    order = numpy.argsort(-heights, kind='stable')
+    coveragepeaks = list()
+    for index in order:
+        if heights[index] < heights[order[0]] * minimumheight:
+            break
+        # Ignore the noise on the shoulders of a higher peak
+        if all(abs(maxima[index] - peak) > peak * 0.25 for peak in coveragepeaks):
+            coveragepeaks.append(int(maxima[index]))
+    return valley, coveragepeaks
+
+
+def peakdepth(histogram, peak, valley):
+    """
+    Refine the depth of a coverage peak to a fraction of a count: the mean count of the k-mers within 50% of the peak.
+    The counts are integers, so at the low depths of sampled reads, the position of the peak alone is imprecise
+    :param histogram: numpy array of the number of k-mers with each count
+    :param peak: count of the coverage peak
+    :param valley: count of the valley separating the error k-mers from the genomic k-mers
+    :return: mean depth of the coverage peak
+    """
+    lower = max(valley, int(peak * 0.5))
+    upper = min(len(histogram), int(peak * 1.5) + 1)
+    counts = numpy.arange(lower, upper, dtype=numpy.float64)
+    kmers = histogram[lower:upper]
+    return float((counts * kmers).sum() / kmers.sum()) if kmers.sum() else float(peak)
+
+
+def estimate(fastqfiles, fraction=0.25, k=31, tablebits=26):
+    """
+    Estimate the haploid genome size of an organism from the k-mer spectrum of a sample of its reads: the number of
+    genomic k-mers (those occurring more often than the error k-mers) divided by the mean depth of the main coverage
+    peak. Intended to be run in a worker process
+    :param fastqfiles: list of the names and paths of the (gzipped) FASTQ files of the sample
+    :param fraction: fraction of the reads to sample. The coverage of the sample must remain high enough (> 10X) for
+    the coverage peak to be distinct from the error k-mers
+    :param k: length of the k-mers
+    :param tablebits: size of the count table (2 ** tablebits cells)
+    :return: dictionary of the haploid genome size (0 if it cannot be estimated), the coverage peaks in the sampled
+    reads, the mean depths of the coverage peaks scaled to all the reads, the valley, and the number of k-mers counted
+    """
+    spectrum = KmerSpectrum(tablebits)
+    for batch in sequences(fastqfiles, fraction):
+        spectrum.add(canonicalkmers(batch, k))
+    histogram = spectrum.histogram()
+    valley, coveragepeaks = peaks(histogram)
+    genomesize = 0
+    coverage = list()
+    if coveragepeaks:
+        # Total number of genomic k-mers: the k-mers in the cells with counts at or above the valley
+        genomic = float(spectrum.table[spectrum.table >= valley].sum(dtype=numpy.uint64))
+        depths = [peakdepth(histogram, peak, valley) for peak in coveragepeaks]
+        genomesize = int(round(genomic / depths[0]))
+        # Scale the depths of the sampled reads to all the reads
+        coverage = [round(depth / fraction, 1) for depth in depths]
+    return {
+        'genomesize': genomesize,
+        'peaks': coveragepeaks,
+        'coverage': coverage,
+        'valley': valley,
+        'kmers': spectrum.total
+    }
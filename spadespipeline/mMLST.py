@@ -1,15 +1,21 @@
 #!/usr/bin/env python
 from accessoryFunctions.accessoryFunctions import dotter, globalcounter, make_dict, make_path, printtime
+from accessoryFunctions.blastparser import FIELDNAMES, MINIMUMFIELDS, parse
+from accessoryFunctions.blastdb import makeblastdb
+from accessoryFunctions.checkpoint import checkpoint
+from spadespipeline.profileindex import clearprofilecache, loadprofile, readreferenceprofile
 from spadespipeline import getmlst
 from Bio.Blast.Applications import NcbiblastnCommandline
+from Bio.Application import ApplicationError
 from Bio import SeqIO
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 from threading import Thread
-from csv import DictReader
 from queue import Queue
 from glob import glob
 import subprocess
-import operator
+import tempfile
+import numpy
 import shutil
 import shlex
 import json
@@ -26,6 +32,10 @@ Revised with speed improvements
 """
 
 
+# Separates the index of the assembly from the original contig name in the query IDs of concatenated BLAST queries
+BATCHSEPARATOR = '__mlstbatch__'
+
+
 class MLST(object):
     def mlst(self):
         # Get the MLST profiles into a dictionary for each sample
@@ -62,69 +72,34 @@ class MLST(object):
             try:
                 delattr(sample[self.analysistype], "allelenames")
                 delattr(sample[self.analysistype], "alleles")
-                delattr(sample[self.analysistype], "profiledata")
             except KeyError:
                 pass
         printtime('{} analyses complete'.format(self.analysistype), self.start)
 
     def profiler(self):
-        """Creates a dictionary from the profile scheme(s)"""
+        """Creates an index of the profile scheme(s)"""
         # Initialise variables
-        profiledata = defaultdict(make_dict)
         profileset = set()
-        # supplementalset = ''
         genedict = {}
         # Find all the unique profiles to use with a set
         for sample in self.metadata:
             if sample[self.analysistype].profile != 'NA':
                 profileset.add(sample[self.analysistype].profile[0])
-                # if self.analysistype == 'rmlst':
-                #     supplementalset = sample[self.analysistype].supplementalprofile
         # Extract the profiles for each set
         for sequenceprofile in profileset:
             # Clear the list of genes
             genelist = []
             for sample in self.metadata:
                 if sequenceprofile == sample[self.analysistype].profile[0]:
-                    # genelist = [os.path.split(x)[1].split('.')[0] for x in sample[self.analysistype].alleles]
                     genelist = sample[self.analysistype].allelenames
-            try:
-                # Open the sequence profile file as a dictionary
-                profile = DictReader(open(sequenceprofile), dialect='excel-tab')
-            # Revert to standard comma separated values
-            except KeyError:
-                # Open the sequence profile file as a dictionary
-                profile = DictReader(open(sequenceprofile))
-            # Iterate through the rows
-            for row in profile:
-                # Iterate through the genes
-                for gene in genelist:
-                    # Add the sequence profile, and type, the gene name and the allele number to the dictionary
-                    try:
-                        profiledata[sequenceprofile][row['ST']][gene] = row[gene]
-                    except KeyError:
-                        try:
-                            profiledata[sequenceprofile][row['rST']][gene] = row[gene]
-                        except KeyError:
-                            raise
-
-            # # Load the supplemental profile definitions
-            # if self.analysistype == 'rmlst':
-            #     supplementalprofile = DictReader(open(supplementalset), dialect='excel-tab')
-            #     # Do the same with the supplemental profile
-            #     for row in supplementalprofile:
-            #         # Iterate through the genes
-            #         for gene in genelist:
-            #             # Add the sequence profile, and type, the gene name and the allele number to the dictionary
-            #             profiledata[sequenceprofile][row['rST']][gene] = row[gene]
             # Add the gene list to a dictionary
             genedict[sequenceprofile] = sorted(genelist)
-            # Add the profile data, and gene list to each sample
+            # Load the index of the alleles of the profile - the index is cached beside the profile file, so the
+            # profile is only parsed again when it changes. The index is shared by all the samples using the profile
+            self.profileindex[sequenceprofile] = loadprofile(sequenceprofile, genelist)
             for sample in self.metadata:
                 if sample.general.bestassemblyfile != 'NA':
                     if sequenceprofile == sample[self.analysistype].profile[0]:
-                        # Populate the metadata with the profile data
-                        sample[self.analysistype].profiledata = profiledata[sample[self.analysistype].profile[0]]
                         # Add the allele directory to a list of directories used in this analysis
                         self.allelefolders.add(sample[self.analysistype].alleledir)
                         dotter()
@@ -157,19 +132,16 @@ class MLST(object):
         while True:  # while daemon
             fastapath = self.dqueue.get()  # grabs fastapath from dqueue
             # remove the path and the file extension for easier future globbing
-            db = fastapath.split('.')[0]
-            nhr = '{}.nhr'.format(db)  # add nhr for searching
-            if not os.path.isfile(str(nhr)):  # if check for already existing dbs
-                # Create the databases
-                # TODO use MakeBLASTdb class
-                subprocess.call(shlex.split('makeblastdb -in {} -parse_seqids -max_file_sz 2GB -dbtype nucl -out {}'
-                                            .format(fastapath, db)), stdout=self.fnull, stderr=self.fnull)
+            makeblastdb(fastapath, fastapath.split('.')[0])
             dotter()
             self.dqueue.task_done()  # signals to dqueue job is done
 
     def blastnprep(self):
         """Setup blastn analyses"""
-        # Populate threads for each gene, genome combination
+        # Create a list of the sample, assembly, database, and report of each BLAST search
+        jobs = list()
+        # Dictionary of report: checkpoint stage, command, and input files of the search
+        checks = dict()
         for sample in self.metadata:
             if sample.general.bestassemblyfile != 'NA':
                 #
@@ -183,24 +155,56 @@ class MLST(object):
                 sample[self.analysistype].end = dict()
                 sample[self.analysistype].queryseq = dict()
                 if type(sample[self.analysistype].allelenames) == list:
-                    for allele in sample[self.analysistype].combinedalleles:
-                        # Add each fasta/allele file combination to the threads
-                        self.runblast(sample.general.bestassemblyfile, allele, sample)
+                    # Each database is searched once, and written to its own report. The name of the database is only
+                    # included in the report name if there are multiple databases
+                    databases = sorted({allele.split('.')[0]: allele
+                                        for allele in sample[self.analysistype].combinedalleles}.items())
+                    for db, allele in databases:
+                        report = self.blastreport(sample.general.bestassemblyfile, sample,
+                                                  db if len(databases) > 1 else None)
+                        jobs.append((sample, sample.general.bestassemblyfile, db, report))
+                        # Save the blast command in the metadata - searches that are run update the command with the
+                        # number of threads, and the concatenated query (if any) used
+                        sample[self.analysistype].blastcommand = str(blastcommand(sample.general.bestassemblyfile, db,
+                                                                                  report, 1))
+                        sample[self.analysistype].blastreport = report
+                        checks[report] = ('{}_blast_{}'.format(self.analysistype, os.path.basename(db)),
+                                          sample[self.analysistype].blastcommand,
+                                          [sample.general.bestassemblyfile, allele])
+        # Do not re-perform the BLAST searches with reports created from the same assembly and alleles
+        searches = [job for job in jobs if not checkpoint(job[0]).complete(*checks[job[3]], [job[3]])]
+        completed, errors = self.blastscheduler(searches)
+        # Only the successful searches are recorded - failed searches are run again in subsequent analyses
+        for sample, assembly, db, report in searches:
+            if report in completed:
+                checkpoint(sample).record(*checks[report], [report])
+            else:
+                checkpoint(sample).invalidate(checks[report][0])
+        if errors:
+            raise errors[0]
+        # Run the blast parsing module on the reports in the order of the samples
+        for sample, assembly, db, report in jobs:
+            self.blastparser(report, sample)
 
-    def runblast(self, assembly, allele, sample):
+    def blastreport(self, assembly, sample, db=None):
         """
-        Run the BLAST analyses
+        Find the name of the BLAST report of an assembly. Reports of previous analyses are reused, unless they are
+        empty
         :param assembly: assembly path/file
-        :param allele: combined allele file
         :param sample: sample object
-        :return:
+        :param db: optional BLAST database. Included in the name of the report when an assembly is searched against
+        multiple databases
+        :return: name and path of the report
         """
         genome = os.path.split(assembly)[1].split('.')[0]
-        # Run the BioPython BLASTn module with the genome as query, fasta(target gene) as db.
-        # Do not re-perform the BLAST search each time
+        pattern = '{}{}*rawresults*'.format(sample[self.analysistype].reportdir, genome)
+        if db is not None:
+            genome = '{}_{}'.format(genome, os.path.basename(db))
+            # Do not match the reports of other databases with the same prefix e.g. db1 and db10
+            pattern = '{}{}_rawresults*'.format(sample[self.analysistype].reportdir, genome)
         make_path(sample[self.analysistype].reportdir)
         try:
-            report = glob('{}{}*rawresults*'.format(sample[self.analysistype].reportdir, genome))[0]
+            report = glob(pattern)[0]
             size = os.path.getsize(report)
             if size == 0:
                 os.remove(report)
@@ -209,38 +213,85 @@ class MLST(object):
         except IndexError:
             report = '{}{}_rawresults_{:}.csv'.format(sample[self.analysistype].reportdir, genome,
                                                       time.strftime("%Y.%m.%d.%H.%M.%S"))
-        db = allele.split('.')[0]
-        # BLAST command line call. Note the mildly restrictive evalue, and the high number of alignments.
-        # Due to the fact that all the targets are combined into one database, this is to ensure that all potential
-        # alignments are reported. Also note the custom outfmt: the doubled quotes are necessary to get it work
-        blastn = NcbiblastnCommandline(query=assembly, db=db, evalue='1E-20', num_alignments=1000000,
-                                       num_threads=12,
-                                       outfmt="'6 qseqid sseqid positive mismatch gaps "
-                                              "evalue bitscore slen length qstart qend qseq sstart send'",
-                                       out=report)
-        # Save the blast command in the metadata
-        sample[self.analysistype].blastcommand = str(blastn)
-        sample[self.analysistype].blastreport = report
-        if not os.path.isfile(report):
-            # Run BLAST
-            blastn()
-        # Run the blast parsing module
-        self.blastparser(report, sample)
+        return report
+
+    def blastscheduler(self, jobs):
+        """
+        Run the BLAST searches concurrently. Samples searched against the same database are grouped into batches of
+        self.blastbatchsize samples, and each batch is searched with a single (concatenated) query. The number of
+        workers and the number of BLAST threads per worker are chosen so that together they do not exceed self.cpus
+        :param jobs: list of (sample, assembly, database, report) tuples of the searches to run
+        :return: set of the reports of the successful searches, list of the errors of the failed batches
+        """
+        reports = set()
+        errors = list()
+        if not jobs:
+            return reports, errors
+        # Group the searches by database, and split them into batches
+        databases = dict()
+        for sample, assembly, db, report in jobs:
+            databases.setdefault(db, list()).append((sample, assembly, report))
+        batches = list()
+        for db, searches in databases.items():
+            for i in range(0, len(searches), self.blastbatchsize):
+                batches.append((searches[i:i + self.blastbatchsize], db))
+        workers, threads = blastresources(len(batches), self.cpus)
+        printtime('Running {} {} BLAST searches in {} batches with {} workers of {} threads'
+                  .format(len(jobs), self.analysistype, len(batches), workers, threads), self.start)
+        # Concatenated queries and reports are written to a temporary folder
+        batchpath = tempfile.mkdtemp(prefix='blastbatches_', dir=self.path) if self.blastbatchsize > 1 else None
+        begin = time.time()
+        completed = 0
+
+        def search(batch):
+            queries = [(assembly, report) for _, assembly, report in batch[0]]
+            try:
+                return batch[0], blastbatch(queries, batch[1], threads, batchpath), None
+            except ApplicationError as error:
+                # Remove any partial reports of the batch, so they are not parsed or reused
+                for _, report in queries:
+                    try:
+                        os.remove(report)
+                    except FileNotFoundError:
+                        pass
+                return batch[0], None, error
+
+        pool = ThreadPool(workers)
+        try:
+            for searches, command, error in pool.imap_unordered(search, batches):
+                if error is not None:
+                    errors.append(error)
+                    continue
+                for sample, _, report in searches:
+                    sample[self.analysistype].blastcommand = command
+                    reports.add(report)
+                completed += len(searches)
+                printtime('{}/{} {} BLAST searches complete'.format(completed, len(jobs), self.analysistype),
+                          self.start)
+        finally:
+            pool.close()
+            pool.join()
+            if batchpath:
+                shutil.rmtree(batchpath)
+        # Report the overall throughput of the searches
+        elapsed = time.time() - begin
+        querysize = sum(os.path.getsize(assembly) for _, assembly, _, _ in jobs) / 1000000
+        printtime('{} {} BLAST searches of {:.1f} Mbp completed in {:.1f} seconds ({:.1f} samples/min, '
+                  '{:.1f} Mbp/min)'.format(len(jobs), self.analysistype, querysize, elapsed,
+                                           len(jobs) / elapsed * 60, querysize / elapsed * 60), self.start)
+        return reports, errors
 
     def blastparser(self, report, sample):
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            if row['subject_length'] is not None:
-                percentidentity = (float(row['positives']) - float(row['gaps'])) / float(row['subject_length']) * 100
-                bitscore = float(row['bit_score'])
+        for row in parse(report):
+            # Extract the percent identity - (length of the alignment - number of mismatches) / total subject length
+            # and the bitscore from the row
+            percentidentity = row.percentidentity
+            bitscore = row.bit_score
             # Find the allele number and the text before the number for different formats
-            allelenumber, gene = allelesplitter(row['subject_id'])
+            allelenumber, gene = allelesplitter(row.subject_id)
             # If the percent identity is 100, and there are no mismatches, the allele is a perfect match
-            if percentidentity == 100 and float(row['mismatches']) == 0:
+            if percentidentity == 100 and row.mismatches == 0:
                 # If there are multiple best hits, then the .values() will be populated
                 if self.plusdict[sample.name][gene].values():
                     # If the previous best hit has under 100% identity, or if the current bitscore is better
@@ -306,21 +357,21 @@ class MLST(object):
                 self.plusdict[sample.name][gene]['N'][0] = 0
 
     def populate(self, sample, gene, allelenumber, percentidentity, bitscore, row):
-        seq = row['query_sequence']
-        orientation = False if int(row['subject_start']) < int(row['subject_end']) else True
+        seq = row.query_sequence
+        orientation = False if row.subject_start < row.subject_end else True
         if orientation:
             from Bio.Seq import Seq
             from Bio.Alphabet import IUPAC
-            seq = Seq(row['query_sequence'], IUPAC.unambiguous_dna)
+            seq = Seq(row.query_sequence, IUPAC.unambiguous_dna)
             seq = str(seq.reverse_complement())
         self.plusdict[sample.name][gene][allelenumber][percentidentity] = bitscore
         sample[self.analysistype].closealleles[gene] = allelenumber
-        sample[self.analysistype].start[gene] = row['query_start']
-        sample[self.analysistype].end[gene] = row['query_end']
-        sample[self.analysistype].mismatches[gene] = row['mismatches']
-        sample[self.analysistype].alignmentlength[gene] = row['alignment_length']
-        sample[self.analysistype].subjectlength[gene] = row['subject_length']
-        sample[self.analysistype].queryid[gene] = row['query_id']
+        sample[self.analysistype].start[gene] = row.query_start
+        sample[self.analysistype].end[gene] = row.query_end
+        sample[self.analysistype].mismatches[gene] = row.mismatches
+        sample[self.analysistype].alignmentlength[gene] = row.alignment_length
+        sample[self.analysistype].subjectlength[gene] = row.subject_length
+        sample[self.analysistype].queryid[gene] = row.query_id
         sample[self.analysistype].queryseq[gene] = seq
 
     def depopulate(self, sample, gene):
@@ -587,10 +638,14 @@ class MLST(object):
                     # Initialise self.bestmatch[genome] with an int that will eventually be replaced by the # of matches
                     self.bestmatch[genome] = defaultdict(int)
                     if sample[self.analysistype].profile != 'NA':
-                        # Create the profiledata variable to avoid writing self.profiledata[self.analysistype]
-                        profiledata = sample[self.analysistype].profiledata
+                        profileindex = self.profileindex[sample[self.analysistype].profile[0]]
+                        # The number of matches to each profile, and the position of the first gene to match each
+                        # profile in the list of genes
+                        matchcounts = numpy.zeros(len(profileindex.sequencetypes), dtype=numpy.int64)
+                        firstmatch = numpy.full(len(profileindex.sequencetypes),
+                                                len(sample[self.analysistype].allelenames), dtype=numpy.int64)
                         # For each gene in plusdict[genome]
-                        for gene in sample[self.analysistype].allelenames:
+                        for position, gene in enumerate(sample[self.analysistype].allelenames):
                             # Clear the appropriate count and lists
                             multiallele = []
                             multipercent = []
@@ -612,64 +667,45 @@ class MLST(object):
                                 if not multiallele:
                                     multiallele.append("N")
                                     multipercent.append(0)
-                            # if self.analysistype == 'rmlst':
-                            #     # For whatever reason, the rMLST profile scheme treat multiple allele hits as 'N's.
-                            #     multiallele = multiallele if len(multiallele) == 1 else ['N']
-                            #     if multipercent:
-                            #         multipercent = multipercent if len(multiallele) == 1 else [0, 0]
-                            #     else:
-                            #         multipercent = [0]
                             # Populate self.bestdict with genome, gene, alleles joined with a space (this was made like
                             # this because allele is a list generated by the .iteritems() above
                             self.bestdict[genome][gene][" ".join(str(allele)
                                                                  for allele in sorted(multiallele))] = multipercent[0]
-                            # Find the profile with the most alleles in common with the query genome
-                            for sequencetype in profiledata:
-                                # The number of genes in the analysis
-                                header = len(profiledata[sequencetype])
-                                # refallele is the allele number of the sequence type
-                                refallele = profiledata[sequencetype][gene]
-                                # If there are multiple allele matches for a gene in the reference profile e.g. 10 692
-                                if len(refallele.split(" ")) > 1:
-                                    # Map the split (on a space) alleles as integers - if they are treated as integers,
-                                    # the alleles will sort properly
-                                    intrefallele = map(int, refallele.split(" "))
-                                    # Create a string of the joined, sorted alleles
-                                    sortedrefallele = " ".join(str(allele) for allele in sorted(intrefallele))
-                                else:
-                                    # Use the reference allele as the sortedRefAllele
-                                    sortedrefallele = refallele
-                                for allele, percentid in self.bestdict[genome][gene].items():
-                                    # If the allele in the query genome matches the allele in the reference profile, add
-                                    # the result to the bestmatch dictionary. Genes with multiple alleles were sorted
-                                    # the same, strings with multiple alleles will match: 10 692 will never be 692 10
-                                    if allele == sortedrefallele and float(percentid) == 100.00:
-                                        # Increment the number of matches to each profile
-                                        self.bestmatch[genome][sequencetype] += 1
-                                    # Special handling of BACT000060 and BACT000065 genes. When the reference profile
-                                    # has an allele of 'N', and the query allele doesn't, set the allele to 'N', and
-                                    # count it as a match
-                                    elif gene == 'BACT000060' or gene == 'BACT000065':
-                                        if sortedrefallele == 'N' and allele != 'N':
-                                            # Increment the number of matches to each profile
-                                            self.bestmatch[genome][sequencetype] += 1
-                                    elif allele == sortedrefallele and sortedrefallele == 'N':
-                                        # Increment the number of matches to each profile
-                                        self.bestmatch[genome][sequencetype] += 1
+                            # Find the profiles with the same alleles as the query genome. The reference alleles in the
+                            # index were sorted the same as the query alleles, so strings with multiple alleles will
+                            # match: 10 692 will never be 692 10
+                            for allele, percentid in self.bestdict[genome][gene].items():
+                                # Only perfect matches to an allele count as a match to the profile
+                                rows = [profileindex.rows(gene, allele)] if float(percentid) == 100.00 else []
+                                # Special handling of BACT000060 and BACT000065 genes. When the reference profile
+                                # has an allele of 'N', and the query allele doesn't, count it as a match
+                                if gene == 'BACT000060' or gene == 'BACT000065':
+                                    if allele != 'N':
+                                        rows.append(profileindex.rows(gene, 'N'))
+                                # Otherwise, 'N' alleles in the query match 'N' alleles in the reference profile
+                                elif allele == 'N' and not rows:
+                                    rows.append(profileindex.rows(gene, allele))
+                                for matchingrows in rows:
+                                    # Increment the number of matches to each profile
+                                    matchcounts[matchingrows] += 1
+                                    firstmatch[matchingrows] = numpy.minimum(firstmatch[matchingrows], position)
+                        # The number of genes in the analysis
+                        header = len(profileindex.genes) \
+                            if profileindex.sequencetypes and sample[self.analysistype].allelenames else 0
                         # Get the best number of matches
-                        # From: https://stackoverflow.com/questions/613183/sort-a-python-dictionary-by-value
-                        try:
-                            sortedmatches = sorted(self.bestmatch[genome].items(), key=operator.itemgetter(1),
-                                                   reverse=True)[0][1]
-                        # If there are no matches, set :sortedmatches to zero
-                        except IndexError:
-                            sortedmatches = 0
+                        sortedmatches = int(matchcounts.max()) if len(matchcounts) else 0
+                        # Store the profiles with the best number of matches in the order in which they were first
+                        # matched (i.e. by the first matching gene, and then by the order in the profile file)
+                        if sortedmatches:
+                            best = numpy.flatnonzero(matchcounts == sortedmatches)
+                            for row in best[numpy.lexsort((best, firstmatch[best]))]:
+                                self.bestmatch[genome][profileindex.sequencetypes[row]] = sortedmatches
                         # Otherwise, the query profile matches the reference profile
                         if int(sortedmatches) == header:
                             # Iterate through best match
                             for sequencetype, matches in self.bestmatch[genome].items():
                                 if matches == sortedmatches:
-                                    for gene in profiledata[sequencetype]:
+                                    for gene in profileindex.profile(sequencetype):
                                         # Populate resultProfile with the genome, best match to profile, # of matches
                                         # to the profile, gene, query allele(s), reference allele(s), and % identity
                                         self.resultprofile[genome][sequencetype][sortedmatches][gene][
@@ -685,9 +721,7 @@ class MLST(object):
                                 # If the number of matches for a profile matches the best number of matches
                                 if matches == sortedmatches:
                                     # Iterate through the gene in the analysis
-                                    for gene in profiledata[sequencetype]:
-                                        # Get the reference allele as above
-                                        refallele = profiledata[sequencetype][gene]
+                                    for gene, refallele in profileindex.profile(sequencetype).items():
                                         # As above get the reference allele split and ordered as necessary
                                         if len(refallele.split(" ")) > 1:
                                             intrefallele = map(int, refallele.split(" "))
@@ -881,8 +915,8 @@ class MLST(object):
                             row += ',,{},{},'.format(seqtype, matches)
                         # Iterate through all the genes present in the analyses for the sample
                         for gene in sorted(sample[self.analysistype].allelenames):
-                            # refallele = self.profiledata[self.analysistype][seqtype][gene]
-                            refallele = sample[self.analysistype].profiledata[seqtype][gene]
+                            refallele = self.profileindex[sample[self.analysistype].profile[0]].profile(seqtype)\
+                                .get(gene)
                             # Set the allele and percent id from the dictionary's keys and values, respectively
                             allele = list(self.resultprofile[sample.name][seqtype][matches][gene].keys())[0]
                             percentid = list(self.resultprofile[sample.name][seqtype][matches][gene].values())[0]
@@ -937,54 +971,25 @@ class MLST(object):
         """
         Finds the closest reference genome to the profile of interest
         """
-        # Initialise dictionaries
-        referencematch = defaultdict(make_dict)
-        referencehits = defaultdict(make_dict)
         # Set the name of the reference profile file
         referencegenomeprofile = '{}rMLST_referenceprofile.json'.format(self.referenceprofilepath)
-        # Open the reference profile and load the profile into memory
-        with open(referencegenomeprofile) as referencefile:
-            referencetypes = json.load(referencefile)
+        # Load the allele matrix of the reference genomes - the matrix is cached beside the reference profile
+        referenceindex = loadprofile(referencegenomeprofile, reader=readreferenceprofile)
         # Iterate through the samples
         for sample in self.metadata:
             if sample[self.analysistype].reportdir != 'NA':
-                # Iterate through the reference genomes in the profile
-                for genome in referencetypes:
-                    # Initialise the number of identical alleles between the assembly of interest and the
-                    # reference genome to 0
-                    referencehits[sample.name][genome] = 0
-                    # Iterate through all the genes in the analysis
-                    for gene in self.bestdict[sample.name]:
-                        # If the alleles match between the assembly of interest and the reference genome, increment
-                        # the number of matches by 1
-                        if list(self.bestdict[sample.name][gene].keys())[0] == referencetypes[genome][gene]:
-                            referencematch[sample.name][genome][gene] = 1
-                            referencehits[sample.name][genome] += 1
-                        else:
-                            referencematch[sample.name][genome][gene] = 0
-        #
-        for sample in self.metadata:
-            if sample[self.analysistype].reportdir != 'NA':
-                # Get the best number of matches
-                # From: https://stackoverflow.com/questions/613183/sort-a-python-dictionary-by-value
-                try:
-                    matches = sorted(referencehits[sample.name].items(),
-                                     key=operator.itemgetter(1), reverse=True)
-                    most_matches = matches[0][1]
-                    i = 0
-                    match_list = list()
-                    while matches[i][1] == most_matches:
-                        match_list.append(matches[i])
-                        i += 1
-                    sorted_list = sorted(match_list)
-                    sortedmatches = sorted_list[0]
-                except IndexError:
-                    sortedmatches = (0, 0)
+                # Compare the alleles of the assembly of interest to the alleles of every reference genome at once.
+                # Ties are broken by the name of the reference genome
+                closest = referenceindex.closest({gene: list(alleles.keys())[0]
+                                                  for gene, alleles in self.bestdict[sample.name].items()},
+                                                 self.referencegenomecount)
+                sample[self.analysistype].closestreferencegenomes = [list(match) for match in closest]
+                sortedmatches = closest[0] if closest else ('NA', 0)
                 # If there are fewer matches than the total number of genes in the typing scheme
                 if 0 < int(sortedmatches[1]) < len(sample[self.analysistype].allelenames):
                     mismatches = []
                     # Iterate through the gene in the analysis
-                    for gene, allele in referencetypes[sortedmatches[0]].items():
+                    for gene, allele in referenceindex.profile(sortedmatches[0]).items():
                         # Populate :self.referencegenome with the genome name, best reference match, number of matches,
                         # gene, query allele(s), and percent identity
                         percentidentity = '{:.2f}'.format(list(self.bestdict[sample.name][gene].values())[0])
@@ -998,20 +1003,19 @@ class MLST(object):
                             sample[self.analysistype].matchestoreferencegenome = sortedmatches[1]
                             mismatches.append(({gene: ('{} ({})'.format(list(self.bestdict[sample.name][gene]
                                                                         .keys())[0], allele))}))
-                        # sample[self.analysistype].mismatchestoreferencegenome = sorted(mismatches)
                         sample[self.analysistype].mismatchestoreferencegenome = mismatches
-                elif sortedmatches == 0:
+                elif sortedmatches[1] == 0:
                     for gene in sample[self.analysistype].allelenames:
                         # Populate the profile of results with 'negative' values for sequence type and sorted matches
-                        self.referencegenome[sample.name][sortedmatches[0]][0][gene]['NA'] = 0
-                        sample[self.analysistype].referencegenome = 'NA'
-                        sample.general.referencegenus = 'NA'
-                        sample[self.analysistype].referencegenomepath = 'NA'
-                        sample[self.analysistype].matchestoreferencegenome = 0
-                        sample[self.analysistype].mismatchestoreferencegenome = [0]
+                        self.referencegenome[sample.name]['NA'][0][gene]['NA'] = 0
+                    sample[self.analysistype].referencegenome = 'NA'
+                    sample.general.referencegenus = 'NA'
+                    sample[self.analysistype].referencegenomepath = 'NA'
+                    sample[self.analysistype].matchestoreferencegenome = 0
+                    sample[self.analysistype].mismatchestoreferencegenome = [0]
                 # Otherwise, the query profile matches the reference profile
                 else:
-                    for gene in referencetypes[sortedmatches[0]]:
+                    for gene in referenceindex.profile(sortedmatches[0]):
                         # Populate self.referencegenome as above
                         self.referencegenome[sample.name][sortedmatches[0]][sortedmatches[1]][gene][list(self.bestdict[
                             sample.name][gene].keys())[0]] = '{:.2f}'.format(list(self.bestdict[
@@ -1055,11 +1059,15 @@ class MLST(object):
         self.referencefilepath = inputobject.referencefilepath
         self.referenceprofilepath = inputobject.referenceprofilepath
         # Fields used for custom outfmt 6 BLAST output:
-        # "6 qseqid sseqid positive mismatch gaps evalue bitscore slen length qstart qend qseq"
-        self.fieldnames = ['query_id', 'subject_id', 'positives', 'mismatches', 'gaps',
-                           'evalue', 'bit_score', 'subject_length', 'alignment_length',
-                           'query_start', 'query_end', 'query_sequence', 'subject_start', 'subject_end']
+        # "6 qseqid sseqid positive mismatch gaps evalue bitscore slen length qstart qend qseq sstart send"
+        self.fieldnames = FIELDNAMES[:MINIMUMFIELDS]
         self.cpus = int(multiprocessing.cpu_count())
+        # The number of samples to concatenate into each BLAST query - 1 runs a search for each sample
+        # Callers that predate this option do not set it, and a MetadataObject returns a GenObject for missing attributes
+        try:
+            self.blastbatchsize = max(1, int(getattr(inputobject, 'blastbatchsize', 1)))
+        except (TypeError, ValueError):
+            self.blastbatchsize = 1
         self.fnull = open(os.devnull, 'wb')  # define /dev/null
         # Declare queues, and dictionaries
         self.dqueue = Queue(maxsize=self.cpus)
@@ -1071,13 +1079,94 @@ class MLST(object):
         self.bestmatch = defaultdict(int)
         self.mlstseqtype = defaultdict(make_dict)
         self.resultprofile = defaultdict(make_dict)
-        # self.profiledata = defaultdict(make_dict)
+        self.profileindex = dict()
         self.referenceprofile = defaultdict(make_dict)
         self.referencegenome = defaultdict(make_dict)
+        # The number of closest reference genomes to record for each sample
+        self.referencegenomecount = 5
         # Run the MLST analyses
         self.mlst()
 
 
+def blastcommand(query, db, report, threads):
+    """
+    BLAST command line call. Note the mildly restrictive evalue, and the high number of alignments.
+    Due to the fact that all the targets are combined into one database, this is to ensure that all potential
+    alignments are reported. Also note the custom outfmt: the doubled quotes are necessary to get it work
+    :param query: name and path of the query (assembly) file
+    :param db: the BLAST database
+    :param report: name and path of the BLAST report
+    :param threads: number of threads to use
+    :return: NcbiblastnCommandline object
+    """
+    return NcbiblastnCommandline(query=query, db=db, evalue='1E-20', num_alignments=1000000,
+                                 num_threads=threads,
+                                 outfmt="'6 qseqid sseqid positive mismatch gaps "
+                                        "evalue bitscore slen length qstart qend qseq sstart send'",
+                                 out=report)
+
+
+def blastresources(batches, cpus):
+    """
+    Split the available CPUs between concurrent BLAST searches. Small allele databases make poor use of many BLAST
+    threads, so as many workers as possible are used, and any remaining CPUs are given to the BLAST threads
+    :param batches: number of BLAST searches to run
+    :param cpus: number of available CPUs
+    :return: number of workers, number of BLAST threads per worker
+    """
+    workers = max(1, min(batches, cpus))
+    return workers, max(1, cpus // workers)
+
+
+def blastbatch(queries, db, threads, batchpath=None):
+    """
+    Search one or more assemblies against an allele database. Multiple assemblies are concatenated into a single
+    query with the index of each assembly prepended to the names of its contigs. The hits are then demultiplexed by
+    query ID into the report of each assembly with the original contig names, so the reports are identical to those
+    of individual searches
+    :param queries: list of (assembly, report) tuples
+    :param db: the BLAST database
+    :param threads: number of threads to use
+    :param batchpath: folder in which to write the concatenated query and report. Required for multiple assemblies
+    :return: string of the BLAST command
+    """
+    if len(queries) == 1:
+        assembly, report = queries[0]
+        blastn = blastcommand(assembly, db, report, threads)
+        blastn()
+        return str(blastn)
+    name = os.path.join(batchpath, '{}_{}'.format(os.path.basename(db),
+                                                  os.path.splitext(os.path.basename(queries[0][1]))[0]))
+    with open('{}.fasta'.format(name), 'w') as batchquery:
+        for index, (assembly, _) in enumerate(queries):
+            with open(assembly) as fasta:
+                line = '\n'
+                for line in fasta:
+                    batchquery.write('>{}{}{}'.format(index, BATCHSEPARATOR, line[1:]) if line.startswith('>')
+                                     else line)
+                # Ensure that the next assembly starts on a new line
+                if not line.endswith('\n'):
+                    batchquery.write('\n')
+    blastn = blastcommand('{}.fasta'.format(name), db, '{}.tsv'.format(name), threads)
+    blastn()
+    # Write the hits of each assembly to a temporary report, and rename the reports once they are complete, so an
+    # interrupted batch never leaves partial reports to be reused in subsequent analyses
+    reports = [open('{}.tmp'.format(report), 'w') for _, report in queries]
+    try:
+        with open('{}.tsv'.format(name)) as batchreport:
+            for line in batchreport:
+                index, line = line.split(BATCHSEPARATOR, 1)
+                reports[int(index)].write(line)
+    finally:
+        for report in reports:
+            report.close()
+    for _, report in queries:
+        os.replace('{}.tmp'.format(report), report)
+    os.remove('{}.fasta'.format(name))
+    os.remove('{}.tsv'.format(name))
+    return str(blastn)
+
+
 def allelesplitter(allelenames):
     # Multiple try-excepts. Maybe overly complicated, but I couldn't get it work any other way
     # This (hopefully) accounts for all the possible naming schemes for the alleles
@@ -1205,6 +1294,8 @@ def getrmlsthelper(referencefilepath, update, start):
             shutil.copyfile('{}/access_token'.format(homepath), '{}/access_token'.format(newfolder))
             # Run rest_auth.pl
             call(rmlstupdatecall, shell=True)
+            # Remove any cached indices of a previous version of the profile in the folder
+            clearprofilecache(newfolder)
             # Get the new alleles into a list, and create the combinedAlleles file
             alleles = glob('{}/*.tfa'.format(newfolder))
             combinealleles(start, newfolder, alleles)
@@ -1270,6 +1361,8 @@ def getmlsthelper(referencefilepath, start, organism, update):
                 # Create the path to store the downloaded
                 make_path(getmlstargs.path)
                 getmlst.main(getmlstargs)
+                # Remove any cached indices of a previous version of the profile in the folder
+                clearprofilecache(newfolder)
                 # Even if there is an issue contacting the database, files are created, however, they are populated
                 # with XML strings indicating that the download failed
                 # Read the first character in the file
@@ -1469,6 +1562,11 @@ if __name__ == '__main__':
                                 help='By default, the BLAST database for your analysis are not deleted prior the '
                                      'analyses. Potentially, the most up-to-date allele definitions will not be used. '
                                      'Use the -C flag to enable the deletion of the databases')
+            parser.add_argument('-B', '--blastbatchsize',
+                                default=1,
+                                type=int,
+                                help='Number of assemblies to concatenate into each BLAST query. Hits are assigned '
+                                     'back to each assembly by query ID. Default is 1 (one search per assembly)')
 
             # Get the arguments into an object
             args = parser.parse_args()
@@ -1496,6 +1594,7 @@ if __name__ == '__main__':
             self.bestreferencegenome = args.bestreferencegenome
             self.analysistype = args.type
             self.cleardatabases = args.clearblastdatabases
+            self.blastbatchsize = args.blastbatchsize
 
             # Initialise variables
             self.genepath = ''
@@ -1530,6 +1629,7 @@ if __name__ == '__main__':
             self.bestreferencegenome = self.runmetadata.bestreferencegenome
             self.referenceprofilepath = self.runmetadata.referenceprofilepath
             self.referencefilepath = self.runmetadata.allelepath
+            self.blastbatchsize = getattr(self.runmetadata, 'blastbatchsize', 1)
             self.pipeline = False
             # Run the analyses
             MLST(self)
@@ -1680,6 +1780,7 @@ class PipelineInit(object):
         self.bestreferencegenome = True
         self.pipeline = True
         self.updatermlst = False
+        self.blastbatchsize = 1
         self.referenceprofilepath = '{}referenceGenomes/'.format(self.referencefilepath)
         # Get the alleles and profile into the metadata
         self.strainer()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from accessoryFunctions.accessoryFunctions import GenObject, make_path, printtime, run_subprocess, write_to_logfile
-from threading import Thread
+from accessoryFunctions.scheduler import TaskScheduler
 import threading
 import os
 import re
@@ -11,13 +11,6 @@ __author__ = 'adamkoziol'
 class Mash(object):
     def sketching(self):
         printtime('Indexing assemblies for mash analysis', self.starttime)
-        # Create the threads for the analysis
-        for sample in self.metadata:
-            if sample.general.bestassemblyfile != 'NA':
-                threads = Thread(target=self.sketch, args=())
-                threads.setDaemon(True)
-                threads.start()
-        # Populate threads for each gene, genome combination
         for sample in self.metadata:
             # Create the analysis type-specific GenObject
             setattr(sample, self.analysistype, GenObject())
@@ -40,61 +33,57 @@ class Mash(object):
 
                 # Create the system call
                 sample.commands.sketch = 'mash sketch -m 2 -p {} -l {} -o {}' \
-                    .format(self.cpus, sample[self.analysistype].filelist, sample[self.analysistype].sketchfilenoext)
-                # Add each sample to the threads
-                self.sketchqueue.put(sample)
-        # Join the threads
-        self.sketchqueue.join()
+                    .format(self.threads, sample[self.analysistype].filelist, sample[self.analysistype].sketchfilenoext)
+        # The CPUs are split between the samples processed at once, so the sketching of a sample can overlap the
+        # distance calculations of another
+        self.scheduler.stage('sketch', self.sketch, self.assembled(), cpus=self.threads)
         self.mashing()
 
-    def sketch(self):
-        while True:
-            sample = self.sketchqueue.get()
-            if not os.path.isfile(sample[self.analysistype].sketchfile):
-                threadlock = threading.Lock()
-                out, err = run_subprocess(sample.commands.sketch)
-                threadlock.acquire()
+    def sketch(self, sample):
+        """
+        Sketch the reads of a sample
+        :param sample: metadata object
+        """
+        if not os.path.isfile(sample[self.analysistype].sketchfile):
+            out, err = run_subprocess(sample.commands.sketch)
+            with self.threadlock:
                 write_to_logfile(sample.commands.sketch, sample.commands.sketch, self.logfile)
                 write_to_logfile(out, err, self.logfile)
-                # call(sample.commands.sketch, shell=True, stdout=self.fnull, stderr=self.fnull)
-                threadlock.release()
-            self.sketchqueue.task_done()
 
     def mashing(self):
         printtime('Performing mash analyses', self.starttime)
-        # Create the threads for the analysis
-        for sample in self.metadata:
-            if sample.general.bestassemblyfile != 'NA':
-                threads = Thread(target=self.mash, args=())
-                threads.setDaemon(True)
-                threads.start()
-        # Populate threads for each gene, genome combination
         for sample in self.metadata:
             if sample.general.bestassemblyfile != 'NA':
                 sample[self.analysistype].mashresults = '{}/{}.tab'.format(sample[self.analysistype].reportdir,
                                                                            sample.name)
 
                 sample.commands.mash = \
-                    'mash dist -p {} {} {} | sort -gk3 > {}'.format(self.cpus, sample[self.analysistype].refseqsketch,
+                    'mash dist -p {} {} {} | sort -gk3 > {}'.format(self.threads,
+                                                                    sample[self.analysistype].refseqsketch,
                                                                     sample[self.analysistype].sketchfile,
                                                                     sample[self.analysistype].mashresults)
-                self.mashqueue.put(sample)
-        # Join the threads
-        self.mashqueue.join()
+        # The distances of a sample are calculated as soon as its sketch is complete, while the other samples are
+        # still being sketched
+        self.scheduler.stage('mash', self.mash, self.assembled(), cpus=self.threads, after=['sketch'])
+        self.scheduler.run()
         self.parse()
 
-    def mash(self):
-        while True:
-            sample = self.mashqueue.get()
-            if not os.path.isfile(sample[self.analysistype].mashresults):
-                threadlock = threading.Lock()
-                out, err = run_subprocess(sample.commands.mash)
-                threadlock.acquire()
+    def mash(self, sample):
+        """
+        Calculate the distances between the sketch of a sample and the RefSeq sketches
+        :param sample: metadata object
+        """
+        if not os.path.isfile(sample[self.analysistype].mashresults):
+            out, err = run_subprocess(sample.commands.mash)
+            with self.threadlock:
                 write_to_logfile(sample.commands.mash, sample.commands.mash, self.logfile)
                 write_to_logfile(out, err, self.logfile)
-                threadlock.release()
-                # call(sample.commands.mash, shell=True, stdout=self.fnull, stderr=self.fnull)
-            self.mashqueue.task_done()
+
+    def assembled(self):
+        """
+        :return: list of the samples with an assembly
+        """
+        return [sample for sample in self.metadata if sample.general.bestassemblyfile != 'NA']
 
     def parse(self):
         printtime('Determining closest refseq genome', self.starttime)
@@ -152,15 +141,20 @@ class Mash(object):
             report.write(data)
 
     def __init__(self, inputobject, analysistype):
-        from queue import Queue
         self.metadata = inputobject.runmetadata.samples
         self.referencefilepath = inputobject.reffilepath
         self.starttime = inputobject.starttime
         self.reportpath = inputobject.reportpath
         self.cpus = inputobject.cpus
         self.logfile = inputobject.logfile
-        self.sketchqueue = Queue()
-        self.mashqueue = Queue()
+        self.threadlock = threading.Lock()
+        self.scheduler = TaskScheduler(self.cpus, start=self.starttime)
+        # Number of sketch and distance tasks to run at once, and the number of threads given to each task
+        try:
+            self.concurrency = max(1, int(getattr(inputobject, 'mashconcurrency', 2)))
+        except (TypeError, ValueError):
+            self.concurrency = 2
+        self.threads = max(1, int(self.cpus) // self.concurrency)
         self.analysistype = analysistype
         # self.fnull = open(os.devnull, 'w')  # define /dev/null
         self.sketching()
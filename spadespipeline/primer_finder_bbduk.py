@@ -1,5 +1,7 @@
 #!/usr/bin/env python 3
 from accessoryFunctions.accessoryFunctions import filer, GenObject, printtime, make_path, MetadataObject
+from accessoryFunctions.blastparser import FIELDNAMES, OUTFMT, parse
+from accessoryFunctions.blastdb import makeblastdb
 import spadespipeline.metadataprinter as metadataprinter
 from Bio.Blast.Applications import NcbiblastnCommandline
 from Bio import SeqIO
@@ -8,7 +10,6 @@ from argparse import ArgumentParser
 from itertools import product
 from threading import Thread
 from subprocess import call
-from csv import DictReader
 from queue import Queue
 import multiprocessing
 from glob import glob
@@ -325,13 +326,7 @@ class PrimerFinder(object):
         Create a BLAST database of the primer file
         """
         # remove the path and the file extension for easier future globbing
-        db = os.path.splitext(self.formattedprimers)[0]
-        nhr = '{}.nhr'.format(db)  # add nhr for searching
-        if not os.path.isfile(str(nhr)):
-            # Create the databases
-            command = 'makeblastdb -in {} -parse_seqids -max_file_sz 2GB -dbtype nucl -out {}'\
-                .format(self.formattedprimers, db)
-            call(command, shell=True, stdout=self.devnull, stderr=self.devnull)
+        makeblastdb(self.formattedprimers, os.path.splitext(self.formattedprimers)[0])
 
     def blastnthreads(self):
         """
@@ -381,8 +376,7 @@ class PrimerFinder(object):
                                            task='blastn-short',
                                            num_alignments=1000000,
                                            num_threads=self.threads,
-                                           outfmt="'6 qseqid sseqid positive mismatch gaps "
-                                                  "evalue bitscore slen length qstart qend qseq sstart send sseq'",
+                                           outfmt=OUTFMT,
                                            out=sample[self.analysistype].report)
             # Save the blast command in the metadata
             sample[self.analysistype].blastcommand = str(blastn)
@@ -415,17 +409,14 @@ class PrimerFinder(object):
                 sample[self.analysistype].blastrecords = list()
                 sample[self.analysistype].range = dict()
                 sample[self.analysistype].genespresent = dict()
-                # Open the sequence profile file as a dictionary
-                blastdict = DictReader(open(sample[self.analysistype].report),
-                                       fieldnames=self.fieldnames,
-                                       dialect='excel-tab')
                 # Go through each BLAST result
-                for row in blastdict:
+                for record in parse(sample[self.analysistype].report):
                     # Ensure that the hit is full-length, and that the number of mismatches is equal to or lesser
                     # than the supplied cutoff value
-                    if int(row['alignment_length']) == self.faidict[row['subject_id']] and \
-                                    int(row['mismatches']) <= self.mismatches:
+                    if record.alignment_length == self.faidict[record.subject_id] and \
+                            record.mismatches <= self.mismatches:
                         # Add the current row to the list for future work
+                        row = record.todict()
                         sample[self.analysistype].blastrecords.append(row)
                         # Populate the dictionaries with the contig name (e.g. CA_CFIA-515_NODE_1_length_1791),
                         # the gene name (e.g. vtx2a), and the primer name (e.g. vtx2a-R3_1) as required
@@ -654,7 +645,7 @@ class PrimerFinder(object):
         # Clean up the BLAST database files
         db = os.path.splitext(self.formattedprimers)[0]
         # A list of all the file extensions associated with the BLASTdb
-        dbextensions = ['.nhr', '.nin', '.nog', '.nsd', '.nsi', '.nsq']
+        dbextensions = ['.nhr', '.nin', '.nog', '.nsd', '.nsi', '.nsq', '.dbmanifest.json', '.dblock']
         # Iterate through all the files, and delete each one - pass on IO errors
         for dbfile in zip(itertools.repeat(db), dbextensions):
             try:
@@ -759,10 +750,7 @@ class PrimerFinder(object):
         # Set the location to send stdout and stderr from system calls
         self.devnull = open(os.devnull, 'wb')
         # Fields used for custom outfmt 6 BLAST output:
-        self.fieldnames = ['query_id', 'subject_id', 'positives', 'mismatches', 'gaps',
-                           'evalue', 'bit_score', 'subject_length', 'alignment_length',
-                           'query_start', 'query_end', 'query_sequence',
-                           'subject_start', 'subject_end', 'subject_sequence']
+        self.fieldnames = FIELDNAMES
         # Set and create the report path
         self.reportpath = os.path.join(self.path, 'reports')
         make_path(self.reportpath)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
-from threading import Thread, Lock
-from queue import Queue
-from accessoryFunctions.accessoryFunctions import printtime, GenObject, make_path, run_subprocess, write_to_logfile
+from threading import Lock
+from accessoryFunctions.accessoryFunctions import printtime, GenObject, make_path, run_streamcall, write_to_logfile
+from accessoryFunctions.scheduler import TaskScheduler
+from accessoryFunctions.checkpoint import checkpoint
+from subprocess import CalledProcessError
 import os
 __author__ = 'adamkoziol'
 
@@ -12,47 +14,56 @@ class Prodigal(object):
 
     def predictthreads(self):
         printtime('Performing gene predictions', self.start)
-        # Create the threads for the analyses
-        for sample in self.metadata:
-            if sample.general.bestassemblyfile != 'NA':
-                threads = Thread(target=self.predict, args=())
-                threads.setDaemon(True)
-                threads.start()
         for sample in self.metadata:
             # Create the .prodigal attribute
             sample.prodigal = GenObject()
-            if sample.general.bestassemblyfile != 'NA':
-                self.predictqueue.put(sample)
-        self.predictqueue.join()
+        # Prodigal is single-threaded - run one task per sample
+        self.scheduler.stage('prodigal', self.predict,
+                             [sample for sample in self.metadata if sample.general.bestassemblyfile != 'NA'])
+        self.scheduler.run()
 
-    def predict(self):
-        while True:
-            sample = self.predictqueue.get()
-            # Populate attributes
-            sample.prodigal.reportdir = os.path.join(sample.general.outputdirectory, 'prodigal')
-            sample.prodigal.results_file = os.path.join(sample.prodigal.reportdir,
-                                                        '{}_prodigalresults.sco'.format(sample.name))
-            sample.prodigal.results = sample.prodigal.results_file
-            sample.commands.prodigal = 'prodigal -i {in1} -o {out1} -f sco -d {genes}'\
-                .format(in1=sample.general.bestassemblyfile,
-                        out1=sample.prodigal.results_file,
-                        genes=os.path.join(sample.prodigal.reportdir, '{}_genes.fa'.format(sample.name)))
-            # Create the folder to store the reports
-            make_path(sample.prodigal.reportdir)
-            # Determine if the report already exists, and that it is not empty
-            size = 0
-            if os.path.isfile(sample.prodigal.results_file):
-                size = os.stat(sample.prodigal.results_file).st_size
-            if not os.path.isfile(sample.prodigal.results_file) or size == 0:
-                # Run the command
-                out, err = run_subprocess(sample.commands.prodigal)
-                threadlock.acquire()
-                write_to_logfile(sample.commands.prodigal, sample.commands.prodigal, self.logfile,
-                                 sample.general.logout, sample.general.logerr, None,
-                                 None)
-                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
-                threadlock.release()
-            self.predictqueue.task_done()
+    def predict(self, sample):
+        """
+        Predict the genes of an assembly
+        :param sample: metadata object
+        """
+        # Populate attributes
+        sample.prodigal.reportdir = os.path.join(sample.general.outputdirectory, 'prodigal')
+        sample.prodigal.results_file = os.path.join(sample.prodigal.reportdir,
+                                                    '{}_prodigalresults.sco'.format(sample.name))
+        sample.prodigal.results = sample.prodigal.results_file
+        genes = os.path.join(sample.prodigal.reportdir, '{}_genes.fa'.format(sample.name))
+        sample.commands.prodigal = 'prodigal -i {in1} -o {out1} -f sco -d {genes}'\
+            .format(in1=sample.general.bestassemblyfile,
+                    out1=sample.prodigal.results_file,
+                    genes=genes)
+        # Create the folder to store the reports
+        make_path(sample.prodigal.reportdir)
+        # Determine if the report was already created from the same assembly with the same command, and that it is
+        # not empty
+        size = 0
+        if os.path.isfile(sample.prodigal.results_file):
+            size = os.stat(sample.prodigal.results_file).st_size
+        if not checkpoint(sample).complete('prodigal', sample.commands.prodigal, [sample.general.bestassemblyfile],
+                                           [sample.prodigal.results_file, genes]) or size == 0:
+            # Run the command. The exit status is checked, so that failed predictions are not recorded as complete
+            try:
+                out, err = run_streamcall(sample.commands.prodigal)
+                succeeded = True
+            except CalledProcessError as exception:
+                out, err = exception.output, exception.stderr
+                succeeded = False
+            threadlock.acquire()
+            write_to_logfile(sample.commands.prodigal, sample.commands.prodigal, self.logfile,
+                             sample.general.logout, sample.general.logerr, None,
+                             None)
+            write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
+            threadlock.release()
+            if succeeded:
+                checkpoint(sample).record('prodigal', sample.commands.prodigal, [sample.general.bestassemblyfile],
+                                          [sample.prodigal.results_file, genes])
+            else:
+                checkpoint(sample).invalidate('prodigal')
 
     def prodigalparse(self):
         printtime('Parsing gene predictions', self.start)
@@ -83,7 +94,6 @@ class Prodigal(object):
         self.metadata = inputobject.runmetadata.samples
         self.start = inputobject.starttime
         self.logfile = inputobject.logfile
-        self.predictqueue = Queue()
-        self.parsequeue = Queue()
+        self.scheduler = TaskScheduler(inputobject.cpus, start=self.start)
         self.predictthreads()
         self.prodigalparse()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+from glob import glob
+import numpy
+import json
+import csv
+import os
+
+__author__ = 'adamkoziol'
+
+
+def normaliseallele(allele):
+    """
+    Sort the alleles of a profile entry with multiple allele matches e.g. 692 10 becomes 10 692, so that they can be
+    compared to the (identically sorted) query alleles. The alleles are treated as integers, so they sort properly
+    :param allele: string of the allele(s) in a sequence type profile
+    :return: string of the sorted allele(s)
+    """
+    alleles = allele.split(' ')
+    if len(alleles) > 1:
+        return ' '.join(str(number) for number in sorted(map(int, alleles)))
+    return allele
+
+
+class ProfileIndex(object):
+    """
+    Allele matrix and inverted index of a sequence type profile scheme. Every distinct allele string of a gene is
+    encoded as an integer, so the profiles become a dense (number of sequence types, number of genes) matrix.
+    The rows of each column are additionally sorted by normalised allele, so the sequence types with a given allele
+    of a gene are a contiguous slice of the sorted rows rather than a scan of every profile
+    """
+
+    def rows(self, gene, allele):
+        """
+        Find the sequence types with the supplied allele of a gene
+        :param gene: name of the gene
+        :param allele: normalised allele string e.g. '10 692' or 'N'
+        :return: numpy array of the row indices of the matching sequence types in .sequencetypes (ascending)
+        """
+        try:
+            column = self.columns[gene]
+            code = self.alleles[column][allele]
+        except KeyError:
+            return numpy.empty(0, dtype=numpy.int64)
+        # As the sort is stable, the rows of each allele are in ascending order
+        return self.order[self.boundaries[column][code]:self.boundaries[column][code + 1], column]
+
+    def profile(self, sequencetype):
+        """
+        :param sequencetype: name of the sequence type
+        :return: dictionary of gene: allele string (as it appears in the profile file) for the sequence type. Unknown
+        sequence types (e.g. 'NA') return an empty dictionary
+        """
+        # The dictionary of sequence type: row is only required for reporting, so it is created on first use
+        if self.positions is None:
+            self.positions = {name: row for row, name in enumerate(self.sequencetypes)}
+        try:
+            row = self.positions[sequencetype]
+        except KeyError:
+            return dict()
+        return {gene: self.rawalleles[column][self.matrix[row, column]] for column, gene in enumerate(self.genes)}
+
+    def closest(self, alleles, count=1):
+        """
+        Find the profiles with the most alleles in common with a query profile by comparing the query to every row of
+        the allele matrix at once
+        :param alleles: dictionary of gene: allele string of the query
+        :param count: number of profiles to return
+        :return: list of (name, number of matching alleles) of the closest profiles, sorted by the number of matching
+        alleles, and then by name
+        """
+        # Encode the query with the allele codes of each gene - alleles absent from the matrix are set to -1, so they
+        # never match
+        if self.rawcodes is None:
+            self.rawcodes = [{allele: code for code, allele in enumerate(rawalleles)} for rawalleles in self.rawalleles]
+        query = numpy.full(len(self.genes), -1, dtype=numpy.int64)
+        for gene, allele in alleles.items():
+            if gene in self.columns:
+                query[self.columns[gene]] = self.rawcodes[self.columns[gene]].get(allele, -1)
+        matches = (self.matrix == query).sum(axis=1)
+        if not len(matches):
+            return list()
+        # Only the profiles with at least as many matches as the count-th best profile need to be sorted
+        if count < len(matches):
+            threshold = numpy.partition(matches, len(matches) - count)[len(matches) - count]
+            candidates = numpy.flatnonzero(matches >= threshold)
+        else:
+            candidates = numpy.arange(len(matches))
+        ranked = sorted(candidates, key=lambda row: (-matches[row], self.sequencetypes[row]))[:count]
+        return [(self.sequencetypes[row], int(matches[row])) for row in ranked]
+
+    def index(self):
+        """
+        Sort the rows of each column of the allele matrix by normalised allele. Columns are sorted individually to
+        limit peak memory usage with large schemes
+        """
+        self.order = numpy.empty(self.matrix.shape, dtype=numpy.int32, order='F')
+        for column in range(self.matrix.shape[1]):
+            self.order[:, column] = numpy.argsort(self.normalised[column][self.matrix[:, column]], kind='stable')
+
+    def save(self, cachefile, key):
+        """
+        Write the matrix, the sorted rows, and the allele strings to an uncompressed .npz file. The file is written
+        to a temporary name and renamed, so concurrent runs never read a partially written cache
+        :param cachefile: name and path of the cache file
+        :param key: list of strings identifying the profile file from which the index was created
+        """
+        temporary = '{}.{}.tmp.npz'.format(cachefile, os.getpid())
+        numpy.savez(temporary,
+                    key=numpy.array(key),
+                    sequencetypes=numpy.array(self.sequencetypes),
+                    genes=numpy.array(self.genes),
+                    matrix=self.matrix,
+                    order=self.order,
+                    rawalleles=numpy.array([allele for alleles in self.rawalleles for allele in alleles]),
+                    allelecounts=numpy.array([len(alleles) for alleles in self.rawalleles], dtype=numpy.int64))
+        os.replace(temporary, cachefile)
+
+    def __init__(self, sequencetypes, genes, matrix, rawalleles, order=None):
+        """
+        :param sequencetypes: list of the names of the sequence types
+        :param genes: list of the genes in the scheme
+        :param matrix: (number of sequence types, number of genes) numpy array of allele codes
+        :param rawalleles: list for each gene of the allele string of each code, as it appears in the profile file
+        :param order: optional array of the rows of each column sorted by normalised allele e.g. loaded from a cache
+        """
+        self.sequencetypes = list(sequencetypes)
+        self.genes = list(genes)
+        self.columns = {gene: column for column, gene in enumerate(self.genes)}
+        # The matrix is only accessed by column, so store it in column-major order
+        self.matrix = numpy.asfortranarray(matrix)
+        self.rawalleles = rawalleles
+        self.positions = None
+        self.rawcodes = None
+        # List of dictionaries of normalised allele: normalised code for each gene, and arrays to convert the allele
+        # codes in the matrix to normalised codes e.g. '692 10' and '10 692' share a normalised code
+        self.alleles = list()
+        self.normalised = list()
+        for alleles in self.rawalleles:
+            codes = dict()
+            # Only entries with multiple alleles need to be normalised
+            self.normalised.append(numpy.array([codes.setdefault(normaliseallele(allele) if ' ' in allele else allele,
+                                                                 len(codes)) for allele in alleles], dtype=numpy.int32))
+            self.alleles.append(codes)
+        self.order = numpy.asfortranarray(order) if order is not None else None
+        if self.order is None:
+            self.index()
+        # Find the boundaries of each normalised code in the sorted rows of each column from the number of rows with
+        # each code
+        self.boundaries = [numpy.concatenate(([0], numpy.cumsum(numpy.bincount(
+            self.normalised[column][self.matrix[:, column]], minlength=len(self.alleles[column])))))
+                           for column in range(len(self.genes))]
+        # The index is shared between all the samples using the scheme
+        self.matrix.flags.writeable = False
+        self.order.flags.writeable = False
+
+
+def readprofile(profilefile, genes):
+    """
+    Parse a tab-delimited sequence type profile file
+    :param profilefile: name and path of the profile file
+    :param genes: list of the genes to include in the index
+    :return: ProfileIndex of the profiles
+    """
+    profiles = dict()
+    with open(profilefile) as profile:
+        reader = csv.reader(profile, dialect='excel-tab')
+        header = next(reader)
+        # rMLST profiles use rST rather than ST
+        stcolumn = header.index('ST') if 'ST' in header else header.index('rST')
+        genecolumns = [header.index(gene) for gene in genes]
+        for row in reader:
+            if row:
+                profiles[row[stcolumn]] = [row[column] for column in genecolumns]
+    matrix = numpy.zeros((len(profiles), len(genes)), dtype=numpy.int32)
+    rawalleles = list()
+    for column in range(len(genes)):
+        codes = dict()
+        matrix[:, column] = [codes.setdefault(alleles[column], len(codes)) for alleles in profiles.values()]
+        # Order the allele strings by code - dictionaries do not keep their insertion order before Python 3.6
+        rawalleles.append(sorted(codes, key=codes.get))
+    return ProfileIndex(profiles, genes, matrix, rawalleles)
+
+
+def readreferenceprofile(profilefile, genes=None):
+    """
+    Parse a JSON file of reference genome: gene: allele (as created by MLST.dumper)
+    :param profilefile: name and path of the JSON file
+    :param genes: optional list of the genes to include in the index. Defaults to the genes of the first genome
+    :return: ProfileIndex of the reference genomes
+    """
+    with open(profilefile) as referencefile:
+        referencetypes = json.load(referencefile)
+    if genes is None:
+        genes = sorted(next(iter(referencetypes.values()))) if referencetypes else list()
+    matrix = numpy.zeros((len(referencetypes), len(genes)), dtype=numpy.int32)
+    rawalleles = list()
+    for column, gene in enumerate(genes):
+        codes = dict()
+        # Genes missing from a reference genome are given an empty allele, which never matches a query allele
+        matrix[:, column] = [codes.setdefault(profile.get(gene, str()), len(codes))
+                             for profile in referencetypes.values()]
+        rawalleles.append(sorted(codes, key=codes.get))
+    return ProfileIndex(referencetypes, genes, matrix, rawalleles)
+
+
+def loadprofile(profilefile, genes=None, reader=readprofile):
+    """
+    Load the index of a profile file from its cache (profile file name + .profileindex.npz) if the cache was created
+    from the current version of the file, otherwise parse the profile, and attempt to cache the index
+    :param profilefile: name and path of the profile file
+    :param genes: list of the genes to include in the index
+    :param reader: function used to parse the profile file - readprofile for tab-delimited sequence type profiles,
+    or readreferenceprofile for JSON reference genome profiles
+    :return: ProfileIndex of the profiles
+    """
+    cachefile = '{}.profileindex.npz'.format(profilefile)
+    stat = os.stat(profilefile)
+    # The cache is keyed on the path, modification time, and size of the profile file, as well as the genes
+    key = [os.path.abspath(profilefile), str(stat.st_mtime_ns), str(stat.st_size)] + list(genes if genes else list())
+    try:
+        with numpy.load(cachefile) as cache:
+            if cache['key'].tolist() == key:
+                counts = cache['allelecounts']
+                offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+                allelestrings = cache['rawalleles'].tolist()
+                return ProfileIndex(cache['sequencetypes'].tolist(), cache['genes'].tolist(), cache['matrix'],
+                                    [allelestrings[offsets[column]:offsets[column + 1]]
+                                     for column in range(len(counts))],
+                                    cache['order'])
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    index = reader(profilefile, genes)
+    try:
+        index.save(cachefile, key)
+    # The profile may be in a read-only location - the index will be created again next time
+    except (IOError, OSError):
+        pass
+    return index
+
+
+def clearprofilecache(folder):
+    """
+    Remove the cached profile indices from a folder e.g. after a new scheme has been downloaded into it
+    :param folder: name and path of the folder containing the profile file(s)
+    """
+    for cachefile in glob(os.path.join(folder, '*.profileindex.npz')):
+        try:
+            os.remove(cachefile)
+        except OSError:
+            pass
@@ -7,20 +7,15 @@ __author__ = 'adamkoziol'
 class Prophages(GeneSeekr):
 
     def blastparser(self, report, sample):
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         resultdict = {}
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            # noinspection PyTypeChecker
-            percentidentity = float('{:0.2f}'.format((float(row['positives']) - float(row['gaps'])) /
-                                                     float(row['subject_length']) * 100))
+        for record in parse(report):
+            # Round the percent identity - (length of the alignment - number of mismatches) / total subject length
+            percentidentity = float('{:0.2f}'.format(record.percentidentity))
             # If the percent identity is greater than the cutoff
             if percentidentity >= self.cutoff:
                 # Update the dictionary with the target and percent identity
-                resultdict.update({row['query_id']: {row['subject_id']: percentidentity}})
+                resultdict.update({record.query_id: {record.subject_id: percentidentity}})
             sample[self.analysistype].blastresults = resultdict
 
     def reporter(self):
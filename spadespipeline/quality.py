@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 from accessoryFunctions.accessoryFunctions import GenObject, MetadataObject, printtime, make_path, \
-    run_subprocess, write_to_logfile
+    run_streamcall, run_subprocess, write_to_logfile
+from accessoryFunctions.scheduler import StageScheduler
 import spadespipeline.metadataprinter as metadataprinter
+from spadespipeline.assemblystats import assemblystats
+from spadespipeline.fastqvalidator import combinestats, fastqstats
+from spadespipeline.genomesize import estimate
 try:
     from confindr import confindr
 except ImportError:
     import confindr
 from biotools import bbtools
-from Bio.SeqUtils import GC
-from Bio import SeqIO
 from subprocess import CalledProcessError
+from multiprocessing import Pool
 from queue import Queue
 from glob import glob
 import threading
@@ -20,110 +23,79 @@ import io
 import os
 __author__ = 'adamkoziol'
 
+# Minimum number of threads, and minimum Java heap size (MB) given to each sample in the concurrent bbtools stages
+STAGERESOURCES = {
+    'kmercountexact': (4, 4000),
+    'tadpole': (4, 4000),
+    'bbnorm': (4, 4000),
+    'bbmerge': (2, 2000),
+    'bbduk_tadpole': (4, 5000)
+}
+
+
+def streamcall(bbdukcall, corrected, paired, threads, memory):
+    """
+    Create the pipeline of bbduk streaming interleaved trimmed reads into tadpole
+    :param bbdukcall: bbduk call writing the trimmed reads to stdout.fq
+    :param corrected: list of the name(s) of the error corrected output file(s)
+    :param paired: boolean of whether the reads are paired (and therefore interleaved in the stream)
+    :param threads: number of threads for tadpole
+    :param memory: maximum Java heap size of tadpole in megabytes
+    :return: string of the pipeline
+    """
+    output = 'out1={} out2={}'.format(*corrected) if paired else 'out={}'.format(corrected[0])
+    return '{bbduk} | tadpole.sh -Xmx{memory}m in=stdin.fq int={interleaved} {output} mode=correct threads={threads}'\
+        .format(bbduk=bbdukcall,
+                memory=memory,
+                interleaved='t' if paired else 'f',
+                output=output,
+                threads=threads)
+
 
 class Quality(object):
 
     def validate_fastq(self):
         """
-        Runs reformat.sh on the FASTQ files. If a CalledProcessError arises, do not proceed with the assembly of
-        these files
+        Check the structure, pairing, and read and base counts of the FASTQ files in a single pass in a pool of worker
+        processes. Files with errors are repaired with reformat.sh and repair.sh. If the files cannot be repaired, do
+        not proceed with the assembly of these files
         """
         printtime('Validating FASTQ files', self.start)
         validated_reads = list()
+        # Tiny files can pass the validation tests - ensure that they don't
+        samples = [sample for sample in self.metadata if os.path.getsize(sample.general.fastqfiles[0]) >= 1000000]
+        fastqfiles = sorted({fastqfile for sample in samples for fastqfile in sample.general.fastqfiles})
+        with Pool(processes=max(1, min(int(self.cpus), len(fastqfiles)))) as pool:
+            filestats = dict(zip(fastqfiles, pool.map(fastqstats, fastqfiles)))
         for sample in self.metadata:
-            # Tiny files can pass the validation tests - ensure that they don't
-            size = os.path.getsize(sample.general.fastqfiles[0])
-            if size >= 1000000:
-                # Try to run reformat.sh on the reads - on any errors try to run repair.sh
-                try:
-                    out, err, cmd = bbtools.validate_reads(forward_in=sample.general.fastqfiles[0],
-                                                           returncmd=True)
-                    write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
+            if sample in samples:
+                stats = combinestats([filestats[fastqfile] for fastqfile in sample.general.fastqfiles])
+                # Store the read statistics, so they do not need to be calculated again
+                sample.run.readcount = stats['readcount']
+                sample.run.totalbases = stats['totalbases']
+                sample.run.meanreadlength = stats['meanreadlength']
+                # The longest read of each file is used as the read length of the run, unless the length was already
+                # set e.g. from the SampleSheet, or from the first reads of the file
+                fastqfiles = sorted(sample.general.fastqfiles)
+                if sample.run.datastore.get('forwardlength', 'NA') == 'NA':
+                    sample.run.forwardlength = filestats[fastqfiles[0]]['maxlength']
+                if len(fastqfiles) == 2 and sample.run.datastore.get('reverselength', 'NA') == 'NA':
+                    sample.run.reverselength = filestats[fastqfiles[1]]['maxlength']
+                if not stats['error']:
+                    message = 'Validated {files}: {reads} reads, {bases} bases'\
+                        .format(files=' '.join(sample.general.fastqfiles),
+                                reads=stats['readcount'],
+                                bases=stats['totalbases'])
+                    write_to_logfile(message, str(), self.logfile, sample.general.logout, sample.general.logerr, None,
+                                     None)
                     # Add the sample to the list of samples with FASTQ files that pass this validation step
                     validated_reads.append(sample)
-                except CalledProcessError:
-                    # Set the file names for the reformatted and repaired files
-                    outputfile1 = os.path.join(sample.general.outputdirectory, '{}_reformatted_R1.fastq.gz'
-                                               .format(sample.name))
-                    repair_file1 = os.path.join(sample.general.outputdirectory, '{}_repaired_R1.fastq.gz'
-                                                .format(sample.name))
-                    if len(sample.general.fastqfiles) == 2:
-                        outputfile2 = os.path.join(sample.general.outputdirectory, '{}_reformatted_R2.fastq.gz'
-                                                   .format(sample.name))
-                        repair_file2 = os.path.join(sample.general.outputdirectory, '{}_repaired_R2.fastq.gz'
-                                                    .format(sample.name))
-                    else:
-                        outputfile2 = str()
-                        repair_file2 = str()
-                    # Try to use reformat.sh to repair the reads - if this fails, discard the sample from the analyses
-                    try:
-                        printtime('Errors detected in FASTQ files for sample {sample}. Please check the following files'
-                                  ' for details {log} {logout} {logerr}. Using reformat.sh to attempt to repair issues'
-                                  .format(sample=sample.name,
-                                          log=self.logfile,
-                                          logout=sample.general.logout,
-                                          logerr=sample.general.logerr), self.start)
-                        if not os.path.isfile(outputfile1):
-                            # Run reformat.sh
-                            out, err, cmd = bbtools.reformat_reads(forward_in=sample.general.fastqfiles[0],
-                                                                   forward_out=outputfile1,
-                                                                   returncmd=True)
-                            write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None,
-                                             None)
-                            # Run repair.sh (if necessary)
-                            if outputfile2:
-                                out, err, cmd = bbtools.repair_reads(forward_in=outputfile1,
-                                                                     forward_out=repair_file1,
-                                                                     returncmd=True)
-                                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr,
-                                                 None, None)
-                        # Ensure that the output file(s) exist before declaring this a success
-                        if os.path.isfile(outputfile1):
-                            # Update the fastqfiles attribute to point to the repaired files
-                            sample.general.fastqfiles = [repair_file1, repair_file2] if repair_file2 else [outputfile1]
-                            # Add the sample object to the list of samples passing the FASTQ validation step
-                            validated_reads.append(sample)
-                    except CalledProcessError:
-                        # The file(s) can be created even if there is STDERR from reformat.sh
-                        if os.path.isfile(outputfile1) and outputfile2:
-                            try:
-                                out, err, cmd = bbtools.repair_reads(forward_in=outputfile1,
-                                                                     forward_out=repair_file1,
-                                                                     returncmd=True)
-                                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr,
-                                                 None, None)
-                                # Update the fastqfiles attribute to point to the repaired files
-                                sample.general.fastqfiles = [repair_file1, repair_file2] if repair_file2 else \
-                                    [repair_file1]
-                                # Add the sample object to the list of samples passing the FASTQ validation step
-                                validated_reads.append(sample)
-                            except CalledProcessError:
-                                # Write in the logs that there was an error detected in the FASTQ files
-                                write_to_logfile('An error was detected in the FASTQ files for sample {}. '
-                                                 'These files will not be processed further'.format(sample.name),
-                                                 'An error was detected in the FASTQ files for sample {}. '
-                                                 'These files will not be processed further'.format(sample.name),
-                                                 self.logfile,
-                                                 sample.general.logout,
-                                                 sample.general.logerr,
-                                                 None,
-                                                 None)
-                                # Update metadata objects with error
-                                self.error(sample, 'fastq_error')
-                        else:
-                            # Write in the logs that there was an error detected in the FASTQ files
-                            write_to_logfile('An error was detected in the FASTQ files for sample {}. '
-                                             'These files will not be processed further'.format(sample.name),
-                                             'An error was detected in the FASTQ files for sample {}. '
-                                             'These files will not be processed further'.format(sample.name),
-                                             self.logfile,
-                                             sample.general.logout,
-                                             sample.general.logerr,
-                                             None,
-                                             None)
-
-                            # Update metadata objects with error
-                            self.error(sample, 'fastq_error')
+                else:
+                    write_to_logfile(str(), stats['error'], self.logfile, sample.general.logout, sample.general.logerr,
+                                     None, None)
+                    # Try to repair the reads - on any errors, the sample is discarded from the analyses
+                    if self.repair_fastq(sample):
+                        validated_reads.append(sample)
             else:
                 # Update metadata objects with error
                 self.error(sample, 'files_too_small')
@@ -132,6 +104,96 @@ class Quality(object):
         # Overwrite self.metadata with objects that do not fail the validation
         self.metadata = validated_reads
 
+    def repair_fastq(self, sample):
+        """
+        Run reformat.sh (and repair.sh for paired reads) on FASTQ files that failed validation
+        :param sample: metadata sample object
+        :return: boolean of whether the sample passes the FASTQ validation step
+        """
+        # Set the file names for the reformatted and repaired files
+        outputfile1 = os.path.join(sample.general.outputdirectory, '{}_reformatted_R1.fastq.gz'
+                                   .format(sample.name))
+        repair_file1 = os.path.join(sample.general.outputdirectory, '{}_repaired_R1.fastq.gz'
+                                    .format(sample.name))
+        if len(sample.general.fastqfiles) == 2:
+            outputfile2 = os.path.join(sample.general.outputdirectory, '{}_reformatted_R2.fastq.gz'
+                                       .format(sample.name))
+            repair_file2 = os.path.join(sample.general.outputdirectory, '{}_repaired_R2.fastq.gz'
+                                        .format(sample.name))
+        else:
+            outputfile2 = str()
+            repair_file2 = str()
+        # Try to use reformat.sh to repair the reads - if this fails, discard the sample from the analyses
+        try:
+            printtime('Errors detected in FASTQ files for sample {sample}. Please check the following files'
+                      ' for details {log} {logout} {logerr}. Using reformat.sh to attempt to repair issues'
+                      .format(sample=sample.name,
+                              log=self.logfile,
+                              logout=sample.general.logout,
+                              logerr=sample.general.logerr), self.start)
+            if not os.path.isfile(outputfile1):
+                # Run reformat.sh
+                out, err, cmd = bbtools.reformat_reads(forward_in=sample.general.fastqfiles[0],
+                                                       forward_out=outputfile1,
+                                                       returncmd=True)
+                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None,
+                                 None)
+                # Run repair.sh (if necessary)
+                if outputfile2:
+                    out, err, cmd = bbtools.repair_reads(forward_in=outputfile1,
+                                                         forward_out=repair_file1,
+                                                         returncmd=True)
+                    write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr,
+                                     None, None)
+            # Ensure that the output file(s) exist before declaring this a success
+            if os.path.isfile(outputfile1):
+                # Update the fastqfiles attribute to point to the repaired files
+                sample.general.fastqfiles = [repair_file1, repair_file2] if repair_file2 else [outputfile1]
+                # The sample passes the FASTQ validation step
+                return True
+        except CalledProcessError:
+            # The file(s) can be created even if there is STDERR from reformat.sh
+            if os.path.isfile(outputfile1) and outputfile2:
+                try:
+                    out, err, cmd = bbtools.repair_reads(forward_in=outputfile1,
+                                                         forward_out=repair_file1,
+                                                         returncmd=True)
+                    write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr,
+                                     None, None)
+                    # Update the fastqfiles attribute to point to the repaired files
+                    sample.general.fastqfiles = [repair_file1, repair_file2] if repair_file2 else \
+                        [repair_file1]
+                    # The sample passes the FASTQ validation step
+                    return True
+                except CalledProcessError:
+                    # Write in the logs that there was an error detected in the FASTQ files
+                    write_to_logfile('An error was detected in the FASTQ files for sample {}. '
+                                     'These files will not be processed further'.format(sample.name),
+                                     'An error was detected in the FASTQ files for sample {}. '
+                                     'These files will not be processed further'.format(sample.name),
+                                     self.logfile,
+                                     sample.general.logout,
+                                     sample.general.logerr,
+                                     None,
+                                     None)
+                    # Update metadata objects with error
+                    self.error(sample, 'fastq_error')
+            else:
+                # Write in the logs that there was an error detected in the FASTQ files
+                write_to_logfile('An error was detected in the FASTQ files for sample {}. '
+                                 'These files will not be processed further'.format(sample.name),
+                                 'An error was detected in the FASTQ files for sample {}. '
+                                 'These files will not be processed further'.format(sample.name),
+                                 self.logfile,
+                                 sample.general.logout,
+                                 sample.general.logerr,
+                                 None,
+                                 None)
+
+                # Update metadata objects with error
+                self.error(sample, 'fastq_error')
+        return False
+
     @staticmethod
     def error(sample, message):
         """
@@ -278,81 +340,132 @@ class Quality(object):
     def trimquality(self):
         """Uses bbduk from the bbmap tool suite to quality and adapter trim"""
         printtime("Trimming fastq files", self.start)
+        # In streaming mode, the trimmed reads are piped directly into tadpole. Samples that fail to stream fall back
+        # to trimming to files
+        if self.streamreads:
+            self.runstage('bbduk_tadpole', self.stream_trim_correct)
+        samples = [sample for sample in self.metadata if type(sample.general.fastqfiles) is list and
+                   sample.name not in self.streamedsamples]
         # Create and start threads for each strain with fastq files
-        for sample in self.metadata:
-            if type(sample.general.fastqfiles) is list:
-                # Create and start threads for each fasta file in the list
-                threads = threading.Thread(target=self.bbduker, args=())
-                # Set the daemon to true - something to do with thread management
-                threads.setDaemon(True)
-                # Start the threading
-                threads.start()
+        for _ in samples:
+            # Create and start threads for each fasta file in the list
+            threads = threading.Thread(target=self.bbduker, args=())
+            # Set the daemon to true - something to do with thread management
+            threads.setDaemon(True)
+            # Start the threading
+            threads.start()
         # Iterate through strains with fastq files to set variables to add to the multithreading queue
-        for sample in self.metadata:
-            # As the metadata can be populated with 'NA' (string) if there are no fastq files, only process if
-            # :fastqfiles is a list
-            if type(sample.general.fastqfiles) is list:
-                # Check to see if the fastq files exist
-                fastqfiles = sorted(sample.general.fastqfiles)
-                # Define the output directory
-                outputdir = sample.general.outputdirectory
-                # Define the name of the trimmed fastq files
-                cleanforward = os.path.join(outputdir, '{}_R1_trimmed.fastq.gz'.format(sample.name))
-                cleanreverse = os.path.join(outputdir, '{}_R2_trimmed.fastq.gz'.format(sample.name))
-                min_len = 50
-                if self.numreads == 2:
-                    # Separate system calls for paired and unpaired fastq files
-                    # http://seqanswers.com/forums/showthread.php?t=42776
-                    # BBduk 37.23 doesn't need the ktrim=l/mink=11 parameters, so they have been removed.
-                    if len(fastqfiles) == 2:
-                        # Incorporate read length into the minlength parameter - set it to 50 unless one or more of the
-                        # reads has a lower calculated length than 50
-                        try:
-                            lesser_length = min(int(sample.run.forwardlength), int(sample.run.reverselength))
-                            min_len = 50 if lesser_length >= 50 else lesser_length
-                            bbdukcall = "bbduk.sh -Xmx1g in1={in1} in2={in2} out1={out1} out2={out2} qtrim=w " \
-                                        "trimq=10 k=25 minlength={ml} ref=adapters tbo" \
-                                .format(in1=fastqfiles[0],
-                                        in2=fastqfiles[1],
-                                        out1=cleanforward,
-                                        out2=cleanreverse,
-                                        ml=min_len)
-                        except ValueError:
-                            bbdukcall = ''
-
-                    elif len(fastqfiles) == 1:
-                        try:
-                            lesser_length = int(sample.run.forwardlength)
-                        except ValueError:
-                            lesser_length = int(sample.run.reverselength)
-                        min_len = 50 if lesser_length >= 50 else lesser_length
-                        bbdukcall = "bbduk.sh -Xmx1g in={in1} out={out1} qtrim=w trimq=10 k=25 minlength={ml} " \
-                                    "ref=adapters" \
-                            .format(in1=fastqfiles[0],
-                                    out1=cleanforward,
-                                    ml=min_len)
-                    else:
-                        bbdukcall = ""
-                # Allows for exclusion of the reverse reads if desired
-                else:
-                    bbdukcall = "bbduk.sh -Xmx1g in={in1} out={out1} qtrim=w trimq=10 k=25 minlength={ml} " \
-                                "ref=adapters"\
-                        .format(in1=fastqfiles[0],
-                                out1=cleanforward,
-                                ml=min_len)
-                    # There is a check to ensure that the trimmed reverse file is created. This will change the file
-                    # being looked for to the forward file
-                    cleanreverse = cleanforward
-                    if self.forwardlength != 'full':
-                        bbdukcall += ' forcetrimright={}'.format(str(self.forwardlength))
-                sample.commands.bbduk = bbdukcall
-                # Add the arguments to the queue
-                self.trimqueue.put((sample, bbdukcall, cleanreverse))
+        for sample in samples:
+            # Define the output directory
+            outputdir = sample.general.outputdirectory
+            # Define the name of the trimmed fastq files
+            cleanforward = os.path.join(outputdir, '{}_R1_trimmed.fastq.gz'.format(sample.name))
+            cleanreverse = os.path.join(outputdir, '{}_R2_trimmed.fastq.gz'.format(sample.name))
+            if self.numreads == 2 and len(sample.general.fastqfiles) == 2:
+                bbdukcall = self.bbduk_call(sample, 'out1={} out2={}'.format(cleanforward, cleanreverse))
+            else:
+                bbdukcall = self.bbduk_call(sample, 'out={}'.format(cleanforward))
+            # Allows for exclusion of the reverse reads if desired. There is a check to ensure that the trimmed
+            # reverse file is created. This will change the file being looked for to the forward file
+            if self.numreads != 2:
+                cleanreverse = cleanforward
+            sample.commands.bbduk = bbdukcall
+            # Add the arguments to the queue
+            self.trimqueue.put((sample, bbdukcall, cleanreverse))
         # Wait on the trimqueue until everything has been processed
         self.trimqueue.join()
         # Add all the trimmed files to the metadata
         printtime('Fastq files trimmed', self.start)
 
+    def bbduk_call(self, sample, output):
+        """
+        Create the bbduk quality and adapter trimming call of a sample
+        :param sample: metadata sample object
+        :param output: output argument(s) of the call e.g. out1=... out2=..., or out=stdout.fq to stream the
+        (interleaved) trimmed reads
+        :return: string of the bbduk call. Empty if the reads cannot be trimmed
+        """
+        fastqfiles = sorted(sample.general.fastqfiles)
+        min_len = 50
+        if self.numreads == 2:
+            # Separate system calls for paired and unpaired fastq files
+            # http://seqanswers.com/forums/showthread.php?t=42776
+            # BBduk 37.23 doesn't need the ktrim=l/mink=11 parameters, so they have been removed.
+            if len(fastqfiles) == 2:
+                # Incorporate read length into the minlength parameter - set it to 50 unless one or more of the
+                # reads has a lower calculated length than 50
+                try:
+                    lesser_length = min(int(sample.run.forwardlength), int(sample.run.reverselength))
+                except ValueError:
+                    return str()
+                min_len = 50 if lesser_length >= 50 else lesser_length
+                return "bbduk.sh -Xmx1g in1={in1} in2={in2} {output} qtrim=w trimq=10 k=25 minlength={ml} " \
+                       "ref=adapters tbo".format(in1=fastqfiles[0],
+                                                 in2=fastqfiles[1],
+                                                 output=output,
+                                                 ml=min_len)
+            elif len(fastqfiles) == 1:
+                try:
+                    lesser_length = int(sample.run.forwardlength)
+                except ValueError:
+                    try:
+                        lesser_length = int(sample.run.reverselength)
+                    except ValueError:
+                        return str()
+                min_len = 50 if lesser_length >= 50 else lesser_length
+                return "bbduk.sh -Xmx1g in={in1} {output} qtrim=w trimq=10 k=25 minlength={ml} ref=adapters" \
+                    .format(in1=fastqfiles[0],
+                            output=output,
+                            ml=min_len)
+            return str()
+        # Allows for exclusion of the reverse reads if desired
+        bbdukcall = "bbduk.sh -Xmx1g in={in1} {output} qtrim=w trimq=10 k=25 minlength={ml} ref=adapters" \
+            .format(in1=fastqfiles[0],
+                    output=output,
+                    ml=min_len)
+        if self.forwardlength != 'full':
+            bbdukcall += ' forcetrimright={}'.format(str(self.forwardlength))
+        return bbdukcall
+
+    def stream_trim_correct(self, sample, threads, memory):
+        """
+        Pipe the interleaved output of bbduk directly into tadpole, so that the trimmed reads are never written to,
+        and read back from, disk. Only the error corrected reads are written. If the pipeline fails, the partial
+        outputs are removed, and the sample is trimmed and corrected with the file-based stages instead
+        :param sample: metadata sample object
+        :param threads: number of threads to use
+        :param memory: memory in megabytes for the pipeline - bbduk uses 1 GB, and tadpole the rest
+        """
+        if type(sample.general.fastqfiles) is not list:
+            return
+        paired = self.numreads == 2 and len(sample.general.fastqfiles) == 2
+        # Use the names of the file-based error correction outputs
+        corrected = [fastq.split('.fastq.gz')[0] + '_trimmed_corrected.fastq.gz'
+                     for fastq in sorted(sample.general.fastqfiles)][:2 if paired else 1]
+        bbdukcall = self.bbduk_call(sample, 'out=stdout.fq')
+        if not bbdukcall:
+            return
+        command = streamcall(bbdukcall, corrected, paired, threads, max(1000, memory - 1000))
+        if not all(os.path.isfile(fastq) for fastq in corrected):
+            try:
+                out, err = run_streamcall(command)
+                self.log(command, command, sample)
+                self.log(out, err, sample)
+            except CalledProcessError:
+                for fastq in corrected:
+                    try:
+                        os.remove(fastq)
+                    except FileNotFoundError:
+                        pass
+                return
+        sample.commands.bbduk = bbdukcall
+        sample[self.analysistype].errorcorrectcmd = command
+        # The corrected reads are also the trimmed reads of the sample
+        sample.general.trimmedfastqfiles = corrected
+        sample.general.trimmedcorrectedfastqfiles = corrected
+        with self.loglock:
+            self.streamedsamples.add(sample.name)
+
     def bbduker(self):
         """Run bbduk system calls"""
         while True:  # while daemon
@@ -465,102 +578,184 @@ class Quality(object):
 
     def estimate_genome_size(self):
         """
-        Use kmercountexact from the bbmap suite of tools to estimate the size of the genome
-        """
-        printtime('Estimating genome size using kmercountexact', self.start)
+        Estimate the size of the genome of each sample from the k-mer spectrum of a fraction of its reads in a pool of
+        worker processes, or with kmercountexact from the bbmap suite of tools if requested
+        """
+        if self.genomesizetool == 'kmercountexact':
+            printtime('Estimating genome size using kmercountexact', self.start)
+            self.runstage('kmercountexact', self.kmercount)
+            return
+        printtime('Estimating genome size from k-mer spectra', self.start)
+        jobs = {sample.name: sorted(sample.general.fastqfiles) for sample in self.metadata
+                if type(sample.general.fastqfiles) is list and sample.general.fastqfiles}
+        results = dict()
+        if jobs:
+            # Each worker holds a count table of 128 MB
+            workers = max(1, min(int(self.cpus), len(jobs), self.scheduler.memory // 256))
+            with Pool(processes=workers) as pool:
+                pending = {name: pool.apply_async(estimate, (fastqfiles, self.kmerfraction))
+                           for name, fastqfiles in jobs.items()}
+                for name, result in pending.items():
+                    results[name] = result.get()
+                # The coverage peak of the sampled reads of low coverage samples is not distinct from the error k-mers.
+                # These samples are estimated again from all their reads
+                if self.kmerfraction < 1.0:
+                    pending = {name: pool.apply_async(estimate, (jobs[name], 1.0))
+                               for name, result in results.items() if not result['genomesize']}
+                    for name, result in pending.items():
+                        results[name] = result.get()
         for sample in self.metadata:
-            # Initialise the name of the output file
-            sample[self.analysistype].peaksfile = os.path.join(sample[self.analysistype].outputdir, 'peaks.txt')
-            # Run the kmer counting command
-            out, err, cmd = bbtools.kmercountexact(forward_in=sorted(sample.general.fastqfiles)[0],
-                                                   peaks=sample[self.analysistype].peaksfile,
-                                                   returncmd=True,
-                                                   threads=self.cpus)
-            # Set the command in the object
-            sample[self.analysistype].kmercountexactcmd = cmd
-            # Extract the genome size from the peaks file
-            sample[self.analysistype].genomesize = bbtools.genome_size(sample[self.analysistype].peaksfile)
-            write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
+            if sample.name in results:
+                sample[self.analysistype].genomesize = results[sample.name]['genomesize']
+                # Depth of the k-mer coverage peaks of all the reads, from the highest peak to the lowest
+                sample[self.analysistype].kmerpeaks = results[sample.name]['coverage']
+
+    def kmercount(self, sample, threads, memory):
+        """
+        Run kmercountexact on the reads of a sample
+        :param sample: metadata sample object
+        :param threads: number of threads to use
+        :param memory: maximum Java heap size in megabytes
+        """
+        # Initialise the name of the output file
+        sample[self.analysistype].peaksfile = os.path.join(sample[self.analysistype].outputdir, 'peaks.txt')
+        # Run the kmer counting command
+        out, err, cmd = bbtools.kmercountexact(forward_in=sorted(sample.general.fastqfiles)[0],
+                                               peaks=sample[self.analysistype].peaksfile,
+                                               returncmd=True,
+                                               threads=threads,
+                                               Xmx='{}m'.format(memory))
+        # Set the command in the object
+        sample[self.analysistype].kmercountexactcmd = cmd
+        # Extract the genome size from the peaks file
+        sample[self.analysistype].genomesize = bbtools.genome_size(sample[self.analysistype].peaksfile)
+        self.log(out, err, sample)
 
     def error_correction(self):
         """
         Use tadpole from the bbmap suite of tools to perform error correction of the reads
         """
         printtime('Error correcting reads', self.start)
-        for sample in self.metadata:
-            sample.general.trimmedcorrectedfastqfiles = [fastq.split('.fastq.gz')[0] + '_trimmed_corrected.fastq.gz'
-                                                         for fastq in sorted(sample.general.fastqfiles)]
-            try:
-                out, err, cmd = bbtools.tadpole(forward_in=sorted(sample.general.trimmedfastqfiles)[0],
-                                                forward_out=sample.general.trimmedcorrectedfastqfiles[0],
-                                                returncmd=True,
-                                                mode='correct',
-                                                threads=self.cpus)
-                # Set the command in the object
-                sample[self.analysistype].errorcorrectcmd = cmd
-                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
-            except CalledProcessError:
-                sample.general.trimmedcorrectedfastqfiles = sample.general.trimmedfastqfiles
-            except KeyError:
-                sample.general.trimmedcorrectedfastqfiles = list()
+        self.runstage('tadpole', self.error_correct)
+
+    def error_correct(self, sample, threads, memory):
+        """
+        Run tadpole on the trimmed reads of a sample
+        :param sample: metadata sample object
+        :param threads: number of threads to use
+        :param memory: maximum Java heap size in megabytes
+        """
+        # Samples trimmed and corrected in streaming mode are already complete
+        if sample.name in self.streamedsamples:
+            return
+        sample.general.trimmedcorrectedfastqfiles = [fastq.split('.fastq.gz')[0] + '_trimmed_corrected.fastq.gz'
+                                                     for fastq in sorted(sample.general.fastqfiles)]
+        try:
+            out, err, cmd = bbtools.tadpole(forward_in=sorted(sample.general.trimmedfastqfiles)[0],
+                                            forward_out=sample.general.trimmedcorrectedfastqfiles[0],
+                                            returncmd=True,
+                                            mode='correct',
+                                            threads=threads,
+                                            Xmx='{}m'.format(memory))
+            # Set the command in the object
+            sample[self.analysistype].errorcorrectcmd = cmd
+            self.log(out, err, sample)
+        except CalledProcessError:
+            sample.general.trimmedcorrectedfastqfiles = sample.general.trimmedfastqfiles
+        except KeyError:
+            sample.general.trimmedcorrectedfastqfiles = list()
 
     def normalise_reads(self):
         """
         Use bbnorm from the bbmap suite of tools to perform read normalisation
         """
         printtime('Normalising reads to a kmer depth of 100', self.start)
-        for sample in self.metadata:
-            # Set the name of the normalised read files
-            sample.general.normalisedreads = [fastq.split('.fastq.gz')[0] + '_normalised.fastq.gz'
-                                              for fastq in sorted(sample.general.fastqfiles)]
-            try:
-                # Run the normalisation command
-                out, err, cmd = bbtools.bbnorm(forward_in=sorted(sample.general.trimmedcorrectedfastqfiles)[0],
-                                               forward_out=sample.general.normalisedreads[0],
-                                               returncmd=True,
-                                               threads=self.cpus)
-                sample[self.analysistype].normalisecmd = cmd
-                write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
-            except CalledProcessError:
-                sample.general.normalisedreads = sample.general.trimmedfastqfiles
-            except IndexError:
-                sample.general.normalisedreads = list()
+        self.runstage('bbnorm', self.normalise)
+
+    def normalise(self, sample, threads, memory):
+        """
+        Run bbnorm on the error corrected reads of a sample
+        :param sample: metadata sample object
+        :param threads: number of threads to use
+        :param memory: maximum Java heap size in megabytes
+        """
+        # Set the name of the normalised read files
+        sample.general.normalisedreads = [fastq.split('.fastq.gz')[0] + '_normalised.fastq.gz'
+                                          for fastq in sorted(sample.general.fastqfiles)]
+        try:
+            # Run the normalisation command
+            out, err, cmd = bbtools.bbnorm(forward_in=sorted(sample.general.trimmedcorrectedfastqfiles)[0],
+                                           forward_out=sample.general.normalisedreads[0],
+                                           returncmd=True,
+                                           threads=threads,
+                                           Xmx='{}m'.format(memory))
+            sample[self.analysistype].normalisecmd = cmd
+            self.log(out, err, sample)
+        except CalledProcessError:
+            sample.general.normalisedreads = sample.general.trimmedfastqfiles
+        except IndexError:
+            sample.general.normalisedreads = list()
 
     def merge_pairs(self):
         """
         Use bbmerge from the bbmap suite of tools to merge paired-end reads
         """
         printtime('Merging paired reads', self.start)
-        for sample in self.metadata:
-            # Can only merge paired-end
-            if len(sample.general.fastqfiles) == 2:
-                # Set the name of the merged, and unmerged files
-                sample.general.mergedreads = \
-                    os.path.join(sample.general.outputdirectory, '{}_paired.fastq.gz'.format(sample.name))
-                sample.general.unmergedforward = \
-                    os.path.join(sample.general.outputdirectory, '{}_unpaired_R1.fastq.gz'.format(sample.name))
-                sample.general.unmergedreverse = \
-                    os.path.join(sample.general.outputdirectory, '{}_unpaired_R2.fastq.gz'.format(sample.name))
-                try:
-                    # Run the merging command - forward_in=sample.general.normalisedreads[0],
-                    out, err, cmd = bbtools.bbmerge(forward_in=sorted(sample.general.trimmedcorrectedfastqfiles)[0],
-                                                    merged_reads=sample.general.mergedreads,
-                                                    returncmd=True,
-                                                    outu1=sample.general.unmergedforward,
-                                                    outu2=sample.general.unmergedreverse,
-                                                    threads=self.cpus)
-                    sample[self.analysistype].bbmergecmd = cmd
-                    write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
-                except CalledProcessError:
-                    delattr(sample.general, 'mergedreads')
-                    delattr(sample.general, 'unmergedforward')
-                    delattr(sample.general, 'unmergedreverse')
-                except IndexError:
-                    delattr(sample.general, 'mergedreads')
-                    delattr(sample.general, 'unmergedforward')
-                    delattr(sample.general, 'unmergedreverse')
-            else:
-                sample.general.mergedreads = sorted(sample.general.trimmedcorrectedfastqfiles)[0]
+        self.runstage('bbmerge', self.merge)
+
+    def merge(self, sample, threads, memory):
+        """
+        Run bbmerge on the error corrected reads of a sample
+        :param sample: metadata sample object
+        :param threads: number of threads to use
+        :param memory: maximum Java heap size in megabytes
+        """
+        # Can only merge paired-end
+        if len(sample.general.fastqfiles) == 2:
+            # Set the name of the merged, and unmerged files
+            sample.general.mergedreads = \
+                os.path.join(sample.general.outputdirectory, '{}_paired.fastq.gz'.format(sample.name))
+            sample.general.unmergedforward = \
+                os.path.join(sample.general.outputdirectory, '{}_unpaired_R1.fastq.gz'.format(sample.name))
+            sample.general.unmergedreverse = \
+                os.path.join(sample.general.outputdirectory, '{}_unpaired_R2.fastq.gz'.format(sample.name))
+            try:
+                # Run the merging command - forward_in=sample.general.normalisedreads[0],
+                out, err, cmd = bbtools.bbmerge(forward_in=sorted(sample.general.trimmedcorrectedfastqfiles)[0],
+                                                merged_reads=sample.general.mergedreads,
+                                                returncmd=True,
+                                                outu1=sample.general.unmergedforward,
+                                                outu2=sample.general.unmergedreverse,
+                                                threads=threads,
+                                                Xmx='{}m'.format(memory))
+                sample[self.analysistype].bbmergecmd = cmd
+                self.log(out, err, sample)
+            except (CalledProcessError, IndexError):
+                delattr(sample.general, 'mergedreads')
+                delattr(sample.general, 'unmergedforward')
+                delattr(sample.general, 'unmergedreverse')
+        else:
+            sample.general.mergedreads = sorted(sample.general.trimmedcorrectedfastqfiles)[0]
+
+    def runstage(self, stage, function):
+        """
+        Run a bbtools stage on the samples concurrently with the stage scheduler
+        :param stage: name of the stage in STAGERESOURCES
+        :param function: method called with each sample, the number of threads, and the memory (MB) for the sample
+        """
+        minthreads, minmemory = STAGERESOURCES[stage]
+        self.scheduler.run(stage, function, self.metadata,
+                           minthreads=minthreads,
+                           minmemory=minmemory,
+                           concurrency=self.stageconcurrency.get(stage))
+
+    def log(self, out, err, sample):
+        """
+        Write the outputs of a tool to the run and sample logs. Samples are processed concurrently, so the writes are
+        serialised
+        """
+        with self.loglock:
+            write_to_logfile(out, err, self.logfile, sample.general.logout, sample.general.logerr, None, None)
 
     def __init__(self, inputobject):
         self.metadata = inputobject.runmetadata.samples
@@ -584,6 +779,34 @@ class Quality(object):
         self.logfile = inputobject.logfile
         self.path = inputobject.path
         self.analysistype = 'quality'
+        # Optional memory budget (MB), and dictionary of stage: number of samples to process at once for the bbtools
+        # stages. Unless specified, the scheduler uses 85% of the system memory, and as many samples as the CPUs allow
+        try:
+            self.memory = inputobject.memory
+        except AttributeError:
+            self.memory = None
+        try:
+            self.stageconcurrency = inputobject.stageconcurrency
+        except AttributeError:
+            self.stageconcurrency = dict()
+        # Optionally pipe the trimmed reads directly into error correction rather than writing them to disk
+        try:
+            self.streamreads = inputobject.streamreads
+        except AttributeError:
+            self.streamreads = False
+        self.streamedsamples = set()
+        # The genome size is estimated from the k-mer spectrum of a fraction of the reads, unless kmercountexact is
+        # requested
+        try:
+            self.genomesizetool = inputobject.genomesizetool
+        except AttributeError:
+            self.genomesizetool = 'kmerspectrum'
+        try:
+            self.kmerfraction = float(inputobject.kmerfraction)
+        except AttributeError:
+            self.kmerfraction = 0.25
+        self.scheduler = StageScheduler(self.cpus, self.memory, self.start)
+        self.loglock = threading.Lock()
         self.reffilepath = inputobject.reffilepath
         # Initialise the quality attribute in the metadata object
         for sample in self.metadata:
@@ -596,94 +819,23 @@ class QualityFeatures(object):
         """
         Run all the methods required for pipeline outputs
         """
-        self.fasta_records()
         self.fasta_stats()
-        self.find_largest_contig()
-        self.find_genome_length()
-        self.find_num_contigs()
-        self.find_n50()
         self.perform_pilon()
-        self.clear_attributes()
 
-    def fasta_records(self):
+    def fasta_stats(self):
         """
-        Use SeqIO to create dictionaries of all records for each FASTA file
+        Calculate the contig lengths, GC%, N50, L50, N75, largest contig, and number of Ns of each assembly in a pool
+        of worker processes. Each FASTA file is read once in large chunks, and only the summary statistics are
+        returned to the parent process
         """
-        for sample in self.metadata:
+        assemblies = [sample.general.bestassemblyfile for sample in self.metadata]
+        with Pool(processes=max(1, min(self.cpus, len(assemblies)))) as pool:
+            statistics = pool.map(assemblystats, assemblies)
+        for sample, stats in zip(self.metadata, statistics):
             # Create the analysis-type specific attribute
             setattr(sample, self.analysistype, GenObject())
-            # Create a dictionary of records for each file
-            try:
-                record_dict = SeqIO.to_dict(SeqIO.parse(sample.general.bestassemblyfile, "fasta"))
-            except FileNotFoundError:
-                record_dict = dict()
-            # Set the records dictionary as the attribute for the object
-            sample[self.analysistype].record_dict = record_dict
-
-    def fasta_stats(self):
-        """
-        Parse the lengths of all contigs for each sample, as well as the total GC%
-        """
-        for sample in self.metadata:
-            # Initialise variables to store appropriate values parsed from contig records
-            contig_lengths = list()
-            fasta_sequence = str()
-            for contig, record in sample[self.analysistype].record_dict.items():
-                # Append the length of the contig to the list
-                contig_lengths.append(len(record.seq))
-                # Add the contig sequence to the string
-                fasta_sequence += record.seq
-            # Set the reverse sorted (e.g. largest to smallest) list of contig sizes as the value
-            sample[self.analysistype].contig_lengths = sorted(contig_lengths, reverse=True)
-            try:
-                # Calculate the GC% of the total genome sequence using GC - format to have two decimal places
-                sample[self.analysistype].gc = float('{:0.2f}'.format(GC(fasta_sequence)))
-            except TypeError:
-                sample[self.analysistype].gc = 'NA'
-
-    def find_largest_contig(self):
-        """
-        Determine the largest contig for each strain
-        """
-        # for file_name, contig_lengths in contig_lengths_dict.items():
-        for sample in self.metadata:
-            # As the list is sorted in descending order, the largest contig is the first entry in the list
-            sample[self.analysistype].longest_contig = sample[self.analysistype].contig_lengths
-
-    def find_genome_length(self):
-        """
-        Determine the total length of all the contigs for each strain
-        """
-        for sample in self.metadata:
-            # Use the sum() method to add all the contig lengths in the list
-            sample[self.analysistype].genome_length = sum(sample[self.analysistype].contig_lengths)
-
-    def find_num_contigs(self):
-        """
-        Count the total number of contigs for each strain
-        """
-        for sample in self.metadata:
-            # Use the len() method to count the number of entries in the list
-            sample[self.analysistype].num_contigs = len(sample[self.analysistype].contig_lengths)
-
-    def find_n50(self):
-        """
-        Calculate the N50 for each strain. N50 is defined as the largest contig such that at least half of the total
-        genome size is contained in contigs equal to or larger than this contig
-        """
-        for sample in self.metadata:
-            # Initialise the N50 attribute in case there is no assembly, and the attribute is not created in the loop
-            sample[self.analysistype].n50 = '-'
-            # Initialise a variable to store a running total of contig lengths
-            currentlength = 0
-            for contig_length in sample[self.analysistype].contig_lengths:
-                # Increment the current length with the length of the current contig
-                currentlength += contig_length
-                # If the current length is now greater than the total genome / 2, the current contig length is the N50
-                if currentlength >= sample[self.analysistype].genome_length * 0.5:
-                    # Populate the dictionary, and break the loop
-                    sample[self.analysistype].n50 = contig_length
-                    break
+            for statistic, value in stats.items():
+                setattr(sample[self.analysistype], statistic, value)
 
     def perform_pilon(self):
         """
@@ -699,22 +851,10 @@ class QualityFeatures(object):
             except KeyError:
                 sample.general.polish = True
 
-    def clear_attributes(self):
-        """
-        Remove the record_dict attribute from the object, as SeqRecords are not JSON-serializable. Also remove
-        the contig_lengths and longest_contig attributes, as they are large lists that make the .json file ugly
-        """
-        for sample in self.metadata:
-            try:
-                delattr(sample[self.analysistype], 'record_dict')
-                delattr(sample[self.analysistype], 'contig_lengths')
-                delattr(sample[self.analysistype], 'longest_contig')
-            except KeyError:
-                pass
-
     def __init__(self, inputobject, analysis):
         self.metadata = inputobject.runmetadata.samples
         self.start = inputobject.starttime
+        self.cpus = int(inputobject.cpus)
         self.analysistype = 'quality_features_{analysis}'.format(analysis=analysis)
 
 
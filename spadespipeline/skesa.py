@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
-from accessoryFunctions.accessoryFunctions import printtime, run_subprocess, write_to_logfile, make_path
+from accessoryFunctions.accessoryFunctions import printtime, run_streamcall, write_to_logfile, make_path
+from accessoryFunctions.checkpoint import checkpoint
 from biotools import bbtools
 from subprocess import CalledProcessError
 from threading import Thread
@@ -86,9 +87,16 @@ class Skesa(object):
     def assemble(self):
         while True:
             sample = self.assemblequeue.get()
-            if not os.path.isfile(sample.general.assemblyfile):
-                # Run the assembly
-                out, err = run_subprocess(sample.commands.assemble)
+            # Only skip the assembly if it was completed with the same command and reads
+            if not checkpoint(sample).complete('assemble', sample.commands.assemble, sample.general.assemblyfastq,
+                                               [sample.general.assemblyfile]):
+                # Run the assembly. The exit status is checked, so that a failed assembly is not recorded as complete
+                try:
+                    out, err = run_streamcall(sample.commands.assemble)
+                    succeeded = True
+                except CalledProcessError as exception:
+                    out, err = exception.output, exception.stderr
+                    succeeded = False
                 self.threadlock.acquire()
                 write_to_logfile(sample.commands.assemble,
                                  sample.commands.assemble,
@@ -105,6 +113,11 @@ class Skesa(object):
                                  None,
                                  None)
                 self.threadlock.release()
+                if succeeded:
+                    checkpoint(sample).record('assemble', sample.commands.assemble, sample.general.assemblyfastq,
+                                              [sample.general.assemblyfile])
+                else:
+                    checkpoint(sample).invalidate('assemble')
             self.assemblequeue.task_done()
 
     def merge(self, sample):
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from accessoryFunctions.accessoryFunctions import combinetargets, filer, GenObject, MetadataObject, printtime, \
+from accessoryFunctions.accessoryFunctions import findcombinedtargets, filer, GenObject, MetadataObject, printtime, \
     make_path, run_subprocess, write_to_logfile
 from accessoryFunctions.metadataprinter import MetadataPrinter
 from spadespipeline.GeneSeekr import GeneSeekr
@@ -663,11 +663,8 @@ class ResFinder(GeneSeekr):
                 targets = glob(os.path.join(self.targetpath, '*.tfa'))
                 targetcheck = glob(os.path.join(self.targetpath, '*.tfa'))
                 if targetcheck:
-                    try:
-                        combinedtargets = glob(os.path.join(self.targetpath, '*.fasta'))[0]
-                    except IndexError:
-                        combinetargets(targets, self.targetpath)
-                        combinedtargets = glob(os.path.join(self.targetpath, '*.fasta'))[0]
+                    # Create the combined targets file, or update it if the targets have changed
+                    combinedtargets = findcombinedtargets(targets, self.targetpath)
                     sample[self.analysistype].targets = targets
                     sample[self.analysistype].combinedtargets = combinedtargets
                     sample[self.analysistype].targetpath = self.targetpath
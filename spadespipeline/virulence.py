@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from accessoryFunctions.accessoryFunctions import combinetargets
 from spadespipeline.GeneSeekr import *
 
 __author__ = 'adamkoziol'
@@ -7,18 +8,13 @@ __author__ = 'adamkoziol'
 class Virulence(GeneSeekr):
 
     def blastparser(self, report, sample):
-        # Open the sequence profile file as a dictionary
-        blastdict = DictReader(open(report), fieldnames=self.fieldnames, dialect='excel-tab')
         resultdict = {}
         # Go through each BLAST result
-        for row in blastdict:
-            # Calculate the percent identity and extract the bitscore from the row
-            # Percent identity is the (length of the alignment - number of mismatches) / total subject length
-            # noinspection PyTypeChecker
-            percentidentity = float('{:0.2f}'.format((float(row['positives']) - float(row['gaps'])) /
-                                                     float(row['subject_length']) * 100))
+        for record in parse(report):
+            # Round the percent identity - (length of the alignment - number of mismatches) / total subject length
+            percentidentity = float('{:0.2f}'.format(record.percentidentity))
             # Find the allele number and the text before the number for different formats
-            target = '{},{}'.format(row['subject_id'], row['query_id'])
+            target = '{},{}'.format(record.subject_id, record.query_id)
             # If the percent identity is greater than the cutoff
             if percentidentity >= self.cutoff:
                 # self.plusdict[sample.name][target] = percentidentity
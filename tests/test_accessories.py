@@ -56,4 +56,47 @@ def test_combine_fastqs():  # TODO: Actually inspect contents of created file.
     combinetargets(glob.glob('tests/dummy_fastq/*fasta'), 'tests')
     assert os.path.isfile('tests/combinedtargets.fasta')
     os.remove('tests/combinedtargets.fasta')
-
+    os.remove('tests/combinedtargets.json')
+
+
+def test_combinetargets_incremental(tmpdir):
+    targetpath = str(tmpdir)
+    target = os.path.join(targetpath, 'genes.tfa')
+    with open(target, 'w') as tfa:
+        tfa.write('>gene-1 description\nACGT-NNACGT\n>gene-2\nAAAA>sspC:6:CP003808.1ATGGAA\n>gene-1\nCCCC\n')
+    original = open(target).read()
+    combined = combinetargets([target], targetpath)
+    assert open(combined).read() == '>gene_1\nACGTACGT\n>gene_2\nAAAA\n>sspC:6:CP003808.1\nATGGAA\n'
+    # The targets are not modified
+    assert open(target).read() == original
+    # The combined file is not created again if the targets are unchanged
+    modified = os.stat(combined).st_mtime_ns
+    assert findcombinedtargets([target], targetpath) == combined
+    assert os.stat(combined).st_mtime_ns == modified
+    # Indices of the combined file are kept while the targets are unchanged
+    indices = [os.path.join(targetpath, 'combinedtargets.1.bt2'), combined + '.fai']
+    for indexfile in indices:
+        open(indexfile, 'w').close()
+    findcombinedtargets([target], targetpath)
+    assert all(os.path.isfile(indexfile) for indexfile in indices)
+    with open(target, 'a') as tfa:
+        tfa.write('>gene_3\nGGGG\n')
+    findcombinedtargets([target], targetpath)
+    assert open(combined).read().endswith('>gene_3\nGGGG\n')
+    # The stale indices are removed when the combined file is created again
+    assert not any(os.path.isfile(indexfile) for indexfile in indices)
+
+
+def test_linkfile(tmpdir):
+    source = tmpdir.join('filtered.fasta')
+    source.write('>contig\nACGT\n')
+    destination = str(tmpdir.join('best.fasta'))
+    assert linkfile(str(source), destination) == 'hardlink'
+    assert os.path.samefile(str(source), destination)
+
+
+def test_run_streamcall():
+    assert run_streamcall('echo reads | cat') == ('reads\n', '')
+    # The failure of any command in the pipeline is detected, not only of the last
+    with pytest.raises(CalledProcessError):
+        run_streamcall('false | cat')
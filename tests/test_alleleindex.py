@@ -0,0 +1,43 @@
+from coreGenome.alleleindex import AlleleIndex, INDEXFILE, fastarecords
+import os
+
+
+def write_alleles(allelefile, alleles, mode='w'):
+    with open(allelefile, mode) as fasta:
+        for name, sequence in alleles:
+            # Wrap the sequences over several lines
+            fasta.write('>{} description\n{}\n{}\n'.format(name, sequence[:4], sequence[4:]))
+
+
+def test_fasta_records(tmpdir):
+    allelefile = str(tmpdir.join('adk.fasta'))
+    write_alleles(allelefile, [('adk-1', 'ACGTACGT'), ('adk-2', 'ACGTACGA')])
+    assert list(fastarecords(allelefile)) == [('adk-1', b'ACGTACGT'), ('adk-2', b'ACGTACGA')]
+
+
+def test_allele_index(tmpdir):
+    adk = str(tmpdir.join('adk.fasta'))
+    fumc = str(tmpdir.join('fumC.fasta'))
+    write_alleles(adk, [('adk-1', 'ACGTACGT'), ('adk-2', 'ACGTACGA')])
+    write_alleles(fumc, [('fumC-1', 'ACGTACGT'), ('fumC-2', 'TTTTCCCC'), ('fumC-3', 'TTTTCCCC')])
+    index = AlleleIndex(str(tmpdir))
+    assert index.allele('adk', 'ACGTACGA') == 'adk-2'
+    assert index.allele('fumC', 'ACGTACGT') == 'fumC-1'
+    # The last of identical alleles is the match, and partial matches are not matches
+    assert index.allele('fumC', 'TTTTCCCC') == 'fumC-3'
+    assert index.allele('adk', 'ACGTACG') is None
+    assert index.allele('gyrB', 'ACGTACGT') is None
+    index.close()
+    assert os.path.isfile(str(tmpdir.join(INDEXFILE)))
+    # New alleles appended to a file are added to the persistent index
+    write_alleles(adk, [('adk-3', 'GGGGAAAA')], mode='a')
+    index = AlleleIndex(str(tmpdir), [adk, fumc])
+    assert index.allele('adk', 'GGGGAAAA') == 'adk-3'
+    assert index.allele('adk', 'ACGTACGT') == 'adk-1'
+    index.close()
+    # Rewritten files are indexed again
+    write_alleles(adk, [('adk-4', 'ACGTACGT')])
+    index = AlleleIndex(str(tmpdir), [adk, fumc])
+    assert index.allele('adk', 'ACGTACGT') == 'adk-4'
+    assert index.allele('adk', 'GGGGAAAA') is None
+    index.close()
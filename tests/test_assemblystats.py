@@ -0,0 +1,25 @@
+from accessoryFunctions.accessoryFunctions import GenObject
+from spadespipeline.assemblystats import assemblystats
+
+
+def test_assemblystats(tmpdir):
+    fasta = str(tmpdir.join('assembly.fasta'))
+    with open(fasta, 'w') as assembly:
+        assembly.write('>contig_1 length=12\nGGCCAATT\nNNAA\n>contig_2\nGCGCGCGC\n>contig_3\nATAT\n')
+    # Reading the file in small chunks splits headers and sequences between chunks
+    for chunksize in (1, 5, 1 << 22):
+        stats = assemblystats(fasta, chunksize)
+        assert stats == {'genome_length': 24, 'num_contigs': 3, 'longest_contig': 12, 'gc': 50.0, 'n_count': 2,
+                         'n50': 12, 'l50': 1, 'n75': 8, 'l75': 2}
+
+
+def test_assemblystats_missing(tmpdir):
+    stats = assemblystats(str(tmpdir.join('missing.fasta')))
+    assert stats['num_contigs'] == 0 and stats['gc'] == 'NA' and stats['n50'] == '-'
+
+
+def test_empty_gc_storable():
+    # The GC% of an empty assembly must be storable in the metadata, which does not accept 0.0
+    sample = GenObject()
+    sample.gc = assemblystats('tests/missing_assembly.fasta')['gc']
+    assert sample.gc == 'NA'
@@ -0,0 +1,87 @@
+from spadespipeline.bamcoverage import CoverageCounts, bamcoverage, filtercontigs, insertsizes
+from array import array
+import pysam
+import os
+
+
+def write_bam(bamfile):
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'contig1', 'LN': 20}, {'SN': 'contig2', 'LN': 10}]}
+    # name, flag, reference, start, cigar, mate start, template length
+    reads = [('pair1', 99, 0, 0, [(0, 10)], 10, 20),
+             ('pair1', 147, 0, 10, [(0, 10)], 0, -20),
+             ('pair2', 99, 0, 2, [(0, 4), (2, 2), (0, 4)], 14, 16),
+             ('pair2', 147, 0, 14, [(0, 4)], 2, -16),
+             ('single', 0, 0, 5, [(4, 2), (0, 5)], -1, 0),
+             ('secondary', 256, 0, 0, [(0, 10)], -1, 0),
+             ('unmapped', 4, -1, -1, None, -1, 0)]
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as bam:
+        for name, flag, reference, start, cigar, matestart, templatelength in reads:
+            record = pysam.AlignedSegment()
+            record.query_name = name
+            record.flag = flag
+            record.reference_id = reference
+            record.reference_start = start
+            record.next_reference_id = reference if matestart >= 0 else -1
+            record.next_reference_start = matestart
+            record.template_length = templatelength
+            record.mapping_quality = 0 if flag & 4 else 40
+            if cigar:
+                record.cigartuples = cigar
+                record.query_sequence = 'A' * sum(length for operation, length in cigar if operation in (0, 1, 4))
+            else:
+                record.query_sequence = 'A' * 10
+            bam.write(record)
+    return bamfile
+
+
+def test_coverage_counts():
+    counter = CoverageCounts(10, buffersize=1)
+    counter.starts, counter.ends = [0, 2, 8], [5, 4, 12]
+    assert counter.depth().tolist() == [1, 1, 2, 2, 1, 0, 0, 0, 1, 1]
+
+
+def test_insert_sizes():
+    assert insertsizes(array('i', [100, 300, 200])) == \
+        {'MeanInsertSize': '200.0000', 'StdInsertSize': '81.6497', 'MedianInsertSize': '200'}
+    assert insertsizes(array('i'))['MeanInsertSize'] == 'NA'
+
+
+def test_bam_coverage(tmpdir):
+    bamfile = write_bam(str(tmpdir.join('coverage.bam')))
+    mapping, depth = bamcoverage(bamfile, buffersize=2)
+    # Depth of contig1: pair1 covers 0-19, pair2 covers 2-5, 8-11, and 14-17, and the single read covers 5-9
+    contig1 = [1, 1, 2, 2, 2, 3, 2, 2, 3, 3, 2, 2, 1, 1, 2, 2, 2, 2, 1, 1]
+    assert depth['length'] == {'contig1': 20, 'contig2': 10}
+    assert depth['bases'] == {'contig1': sum(contig1), 'contig2': 0}
+    assert depth['coverage'] == {'contig1': 1.85, 'contig2': 0}
+    assert depth['stddev']['contig1'] == 0.6538
+    assert mapping['Reads'] == '6'
+    assert mapping['MappedReads'] == '5(83.33%)'
+    assert mapping['MappedBases'] == '37bp'
+    assert mapping['MeanCoveragedata'] == '1.2333'
+    assert mapping['StdCoveragedata'] == '1.0225'
+    assert mapping['MeanInsertSize'] == '18.0000'
+    assert mapping['MedianInsertSize'] == '18'
+    assert mapping['MeanMappingQuality'] == '40.0000'
+
+
+def test_filter_contigs(tmpdir):
+    contigsfile = str(tmpdir.join('contigs.fasta'))
+    filteredfile = str(tmpdir.join('filtered.fasta'))
+    with open(contigsfile, 'w') as contigs:
+        contigs.write('>Contig_1_pilon description\n{}\n{}\n'.format('A' * 70, 'C' * 500))
+        contigs.write('>Contig_2\n{}\n'.format('G' * 600))
+        contigs.write('>Contig_3\n{}\n'.format('T' * 100))
+    # Contig_2 has too little depth, and Contig_3 is too short
+    assert filtercontigs(contigsfile, filteredfile, {'Contig_1': 40.0, 'Contig_2': 5.0, 'Contig_3': 50.0},
+                         threshold=10, name='sample') == (3, 1)
+    with open(filteredfile) as filtered:
+        lines = filtered.read().split('\n')
+    assert lines[0] == '>sample_1_pilon'
+    assert ''.join(lines[1:]) == 'A' * 70 + 'C' * 500
+    assert max(len(line) for line in lines[1:]) == 60
+    os.remove(filteredfile)
+    # The filtered file is not created if no contigs pass
+    assert filtercontigs(contigsfile, filteredfile, dict(), threshold=10, name='sample') == (3, 0)
+    assert not os.path.isfile(filteredfile) and not os.path.isfile(filteredfile + '.tmp')
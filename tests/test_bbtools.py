@@ -98,3 +98,7 @@ def test_bbmerge_with_kwargs():
     assert cmd == 'bbmerge.sh in=tests/dummy_fastq/test_R1.fastq in2=tests/dummy_fastq/test_R2.fastq ' \
                   'out=tests/merged.fastq  threads=1'
     os.remove('tests/merged.fastq')
+
+
+def test_kwargs_to_string_java_options():
+    assert bbtools.kwargs_to_string({'threads': 4, 'Xmx': '4000m'}) == ' threads=4 -Xmx4000m'
@@ -0,0 +1,40 @@
+from accessoryFunctions.blastdb import BlastDatabaseCache, checksum
+import os
+
+
+def test_manifest(tmpdir):
+    fasta = str(tmpdir.join('targets.fasta'))
+    db = os.path.splitext(fasta)[0]
+    with open(fasta, 'w') as fastafile:
+        fastafile.write('>gene_1\nACGTACGT\n')
+    cache = BlastDatabaseCache()
+    # Neither the database nor the manifest exist
+    assert not cache.current(fasta, db)
+    open('{}.nhr'.format(db), 'w').close()
+    # A database without a manifest may be stale
+    assert not cache.current(fasta, db)
+    cache.writemanifest(fasta, db, checksum(fasta))
+    assert cache.current(fasta, db)
+    assert cache.database(fasta) == db
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'failures': 0}
+    # Modifying the time, but not the contents, of the file keeps the database
+    os.utime(fasta, ns=(0, 0))
+    assert cache.current(fasta, db)
+    with open(fasta, 'a') as fastafile:
+        fastafile.write('>gene_2\nTTTT\n')
+    assert not cache.current(fasta, db)
+    # Databases created with other parameters are not reused
+    cache.writemanifest(fasta, db, checksum(fasta))
+    assert not BlastDatabaseCache(parameters='-dbtype nucl').current(fasta, db)
+
+
+def test_lockfile_removed(tmpdir):
+    fasta = str(tmpdir.join('targets.fasta'))
+    db = os.path.splitext(fasta)[0]
+    with open(fasta, 'w') as fastafile:
+        fastafile.write('>gene_1\nACGTACGT\n')
+    # A command that creates no database records a failure
+    cache = BlastDatabaseCache(command='true')
+    assert cache.database(fasta) == db
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'failures': 1}
+    assert not os.path.isfile('{}.dblock'.format(db))
@@ -0,0 +1,45 @@
+from accessoryFunctions.blastparser import parse, parsecolumns
+import pytest
+import os
+
+report = 'tests/blastparser.tsv'
+rows = ['contig1\tgeneA_1\t100\t0\t0\t1e-50\t185\t100\t100\t1\t100\tACGT\t1\t100\tACGT\n',
+        'contig2\tgeneB_2\t95\t3\t2\t1e-40\t150.5\t100\t98\t200\t103\tACGT\t100\t1\n',
+        'contig3\tgeneC\ttruncated\n']
+
+
+def setup_module():
+    with open(report, 'w') as blastreport:
+        blastreport.write(''.join(rows))
+
+
+def teardown_module():
+    os.remove(report)
+
+
+def test_parse():
+    records = list(parse(report))
+    # The truncated line is skipped, and reports without subject sequences are accepted
+    assert len(records) == 2
+    assert records[0].percentidentity == 100
+    assert records[0].subject_sequence == 'ACGT'
+    assert records[1].subject_sequence == ''
+    assert records[1].percentidentity == 93
+    assert records[1].bit_score == 150.5
+    assert (records[1].low, records[1].high, records[1].reverse) == (103, 200, True)
+
+
+def test_record_keys():
+    record = next(parse(report))
+    assert record['subject_id'] == 'geneA_1'
+    assert record.todict()['query_end'] == 100
+    with pytest.raises(KeyError):
+        record['missing']
+
+
+def test_parsecolumns():
+    columns = parsecolumns(report, fields=['subject_id', 'query_start'])
+    assert sorted(columns) == ['percentidentity', 'query_start', 'subject_id']
+    assert columns['subject_id'] == ['geneA_1', 'geneB_2']
+    assert columns['query_start'].tolist() == [1, 200]
+    assert columns['percentidentity'].tolist() == [100, 93]
@@ -0,0 +1,83 @@
+from accessoryFunctions.checkpoint import CheckpointManifest, checkpoint, fingerprint
+from accessoryFunctions.accessoryFunctions import GenObject, MetadataObject
+import os
+
+
+def write(checkpointpath, name, contents):
+    path = os.path.join(checkpointpath, name)
+    with open(path, 'w') as output:
+        output.write(contents)
+    return path
+
+
+def test_fingerprint(tmpdir):
+    checkpointpath = str(tmpdir)
+    path = write(checkpointpath, 'input.fasta', '>contig\nACGT\n')
+    size, mtime, sha256 = fingerprint(path)
+    assert size == 13
+    # Unchanged files are not hashed again
+    assert fingerprint(path, [size, mtime, 'previous'])[2] == 'previous'
+
+
+def test_checkpoint_manifest(tmpdir):
+    checkpointpath = str(tmpdir)
+    reads = write(checkpointpath, 'reads.fastq', '@read\nACGT\n+\nIIII\n')
+    assembly = write(checkpointpath, 'assembly.fasta', '>contig\nACGT\n')
+    manifestfile = os.path.join(checkpointpath, 'checkpoints.json')
+    manifest = CheckpointManifest(manifestfile)
+    command = 'skesa --fastq {} --contigs_out {}'.format(reads, assembly)
+    assert not manifest.complete('assemble', command, [reads], [assembly])
+    assert manifest.record('assemble', command, [reads], [assembly])
+    # The manifest is read by subsequent runs
+    manifest = CheckpointManifest(manifestfile)
+    assert manifest.complete('assemble', command, [reads], [assembly])
+    # Changed parameters invalidate the stage
+    assert not manifest.complete('assemble', command + ' --kmer 21', [reads], [assembly])
+    # As do changes to the outputs e.g. a partially written file
+    write(checkpointpath, 'assembly.fasta', '>contig\nAC')
+    assert not manifest.complete('assemble', command, [reads], [assembly])
+    write(checkpointpath, 'assembly.fasta', '>contig\nACGT\n')
+    # Rewriting identical contents only changes the modification time
+    os.utime(assembly, ns=(0, 0))
+    assert manifest.complete('assemble', command, [reads], [assembly])
+    # Changes to the inputs invalidate the stage
+    write(checkpointpath, 'reads.fastq', '@read\nACGA\n+\nIIII\n')
+    assert not manifest.complete('assemble', command, [reads], [assembly])
+    # Missing outputs are not recorded
+    assert not manifest.record('assemble', command, [reads], [os.path.join(checkpointpath, 'missing.fasta')])
+    assert 'assemble' not in CheckpointManifest(manifestfile).entries
+
+
+def test_checkpoint_sample(tmpdir):
+    checkpointpath = str(tmpdir)
+    sample = MetadataObject()
+    sample.name = 'sample'
+    sample.general = GenObject()
+    sample.general.outputdirectory = os.path.join(checkpointpath, 'sample')
+    manifest = checkpoint(sample)
+    # The manifest of a sample is shared by all the stages
+    assert checkpoint(sample) is manifest
+    assert manifest.manifestfile == os.path.abspath(os.path.join(checkpointpath, 'sample', 'checkpoints.json'))
+
+
+def test_failed_stage_not_recorded(tmpdir):
+    from spadespipeline.prodigal import Prodigal
+    sample = MetadataObject()
+    sample.name = 'sample'
+    sample.general = GenObject()
+    sample.commands = GenObject()
+    sample.prodigal = GenObject()
+    sample.general.outputdirectory = os.path.join(str(tmpdir), 'sample')
+    sample.general.logout = os.devnull
+    sample.general.logerr = os.devnull
+    # The assembly is missing, so the gene prediction fails
+    sample.general.bestassemblyfile = os.path.join(str(tmpdir), 'missing.fasta')
+    manifest = checkpoint(sample)
+    manifest.entries['prodigal'] = {'command': 'prodigal', 'inputs': dict(), 'outputs': dict()}
+    # Skip the constructor, as it runs the predictions of the samples of a run
+    prodigal = Prodigal.__new__(Prodigal)
+    prodigal.logfile = os.devnull
+    prodigal.predict(sample)
+    # The stage is removed from the manifest, rather than recorded as complete
+    assert 'prodigal' not in manifest.entries
+    assert 'prodigal' not in CheckpointManifest(manifest.manifestfile).entries
@@ -0,0 +1,45 @@
+from metagenomefilter.clarkparser import byteranges, classificationrows, loadtotals, taxontotals
+import os
+
+
+def write_classification(classificationfile):
+    with open(classificationfile, 'w') as classification:
+        classification.write('Object_ID, Length, Assignment\n')
+        # The first contig is listed twice
+        classification.write('contig0,100,562\ncontig1,250,28901\ncontig2,40,NA\ncontig3,300,562\n'
+                             'contig0,100,562\ncontig4,75,1280\n')
+
+
+def test_byte_ranges(tmpdir):
+    classificationfile = str(tmpdir.join('sample.csv'))
+    write_classification(classificationfile)
+    ranges = byteranges(classificationfile, 3)
+    assert len(ranges) == 3
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(classificationfile)
+    # Each range starts on a new line, and the rows of all the ranges are the rows of the file
+    rows = [row for start, end in ranges for row in classificationrows(classificationfile, start, end)]
+    assert rows == list(classificationrows(classificationfile))
+    assert rows[0] == (b'contig0', b'100', b'562')
+    assert len(rows) == 6
+
+
+def test_taxon_totals(tmpdir):
+    classificationfile = str(tmpdir.join('sample.csv'))
+    write_classification(classificationfile)
+    # The duplicated contig is only counted once
+    expected = {'562': [2, 400], '28901': [1, 250], 'NA': [1, 40], '1280': [1, 75]}
+    for processes in (1, 3):
+        assert taxontotals(classificationfile, processes) == expected
+    totalsfile = str(tmpdir.join('sample_totals.csv'))
+    assert loadtotals(classificationfile, totalsfile) == expected
+    assert open(totalsfile).readline() == 'TaxID,Contigs,TotalBP\n'
+    # The cached totals are used while they are newer than the classification file
+    with open(totalsfile, 'a') as cached:
+        cached.write('630,1,10\n')
+    assert loadtotals(classificationfile, totalsfile)['630'] == [1, 10]
+    os.utime(totalsfile, (0, 0))
+    assert loadtotals(classificationfile, totalsfile) == expected
+    # Empty files have no assignments
+    emptyfile = str(tmpdir.join('empty.csv'))
+    open(emptyfile, 'w').close()
+    assert taxontotals(emptyfile, processes=2) == dict()
@@ -0,0 +1,78 @@
+from accessoryFunctions.accessoryFunctions import GenObject, MetadataObject
+from spadespipeline.depth import QualiMap
+from threading import Lock, Thread
+from queue import Queue
+import os
+
+
+def qualimap(path, sortthreads=4, sortmemory='1G', sorttempdir=None):
+    # Skip the constructor, as it runs samtools to find its version
+    mapper = QualiMap.__new__(QualiMap)
+    mapper.sortthreads = sortthreads
+    mapper.sortmemory = sortmemory
+    mapper.sorttempdir = sorttempdir
+    mapper.qualimap = False
+    mapper.logfile = os.devnull
+    mapper.threadlock = Lock()
+    mapper.bowqueue = Queue()
+    sample = MetadataObject()
+    sample.name = 'test'
+    sample.general = GenObject()
+    sample.mapping = GenObject()
+    sample.general.QualimapResults = path
+    sample.general.bestassemblyfile = os.path.join(path, 'test.fasta')
+    sample.general.logout = os.devnull
+    sample.general.logerr = os.devnull
+    sample.mapping.BamFile = os.path.join(path, 'test_sorted.bam')
+    return mapper, sample
+
+
+def test_sortcall(tmpdir):
+    mapper, sample = qualimap(str(tmpdir))
+    assert mapper.sortcall(sample) == 'samtools sort -@ 3 -m 1G -T {prefix} -o {bam} -'\
+        .format(prefix=os.path.join(str(tmpdir), 'test_sort'),
+                bam=os.path.join(str(tmpdir), 'test_sorted.bam'))
+
+
+def test_sortcall_tempdir(tmpdir):
+    tempdir = os.path.join(str(tmpdir), 'sorttemp')
+    mapper, sample = qualimap(str(tmpdir), sortthreads=1, sortmemory='768M', sorttempdir=tempdir)
+    assert mapper.sortcall(sample) == 'samtools sort -@ 0 -m 768M -T {prefix} -o {bam} -'\
+        .format(prefix=os.path.join(tempdir, 'test_sort'),
+                bam=os.path.join(str(tmpdir), 'test_sorted.bam'))
+    assert os.path.isdir(tempdir)
+
+
+def test_align_failure_removes_bam(tmpdir):
+    mapper, sample = qualimap(str(tmpdir))
+    # The first command of the pipeline fails after the BAM file has been started
+    alignment = 'false | tee {}'.format(sample.mapping.BamFile)
+    mapper.bowqueue.put((sample, 'true', alignment))
+    thread = Thread(target=mapper.align, args=())
+    thread.daemon = True
+    thread.start()
+    mapper.bowqueue.join()
+    assert not os.path.isfile(sample.mapping.BamFile)
+
+
+def test_coverage_corrupt_bam(tmpdir):
+    from test_bamcoverage import write_bam
+    mapper, sample = qualimap(str(tmpdir))
+    mapper.cpus = 2
+    mapper.start = 0
+    write_bam(sample.mapping.BamFile)
+    corrupt = MetadataObject()
+    corrupt.name = 'corrupt'
+    corrupt.general = GenObject()
+    corrupt.mapping = GenObject()
+    corrupt.general.bestassemblyfile = sample.general.bestassemblyfile
+    corrupt.general.logout = os.devnull
+    corrupt.general.logerr = os.devnull
+    corrupt.mapping.BamFile = os.path.join(str(tmpdir), 'corrupt_sorted.bam')
+    with open(corrupt.mapping.BamFile, 'wb') as bam:
+        bam.write(b'not a BAM file')
+    mapper.metadata = [corrupt, sample]
+    mapper.coverage()
+    # The corrupt BAM file does not prevent the coverage of the other samples from being calculated
+    assert sample.mapping.MeanCoveragedata == '1.2333'
+    assert 'MeanCoveragedata' not in corrupt.mapping.datastore
@@ -0,0 +1,36 @@
+from spadespipeline.fastqvalidator import combinestats, fastqstats
+import gzip
+import os
+
+
+def test_fastqstats_paired(tmpdir):
+    forward = str(tmpdir.join('test_R1.fastq.gz'))
+    with open('tests/dummy_fastq/test_R1.fastq', 'rb') as fastq, gzip.open(forward, 'wb') as compressed:
+        compressed.write(fastq.read())
+    # Small chunks split records between chunks
+    for chunksize in (7, 1 << 22):
+        stats = [fastqstats(forward, chunksize), fastqstats('tests/dummy_fastq/test_R2.fastq', chunksize)]
+        assert stats[0]['error'] is None
+        assert stats[0]['reads'] == 2 and stats[0]['bases'] == 300 + 145 and stats[0]['maxlength'] == 300
+        combined = combinestats(stats)
+        assert combined['error'] is None
+        assert combined['readcount'] == 4 and combined['meanreadlength'] == 222.5
+
+
+def test_fastqstats_errors(tmpdir):
+    truncated = str(tmpdir.join('truncated.fastq'))
+    with open(truncated, 'w') as fastq:
+        fastq.write(''.join(open('tests/dummy_fastq/test_R1.fastq').readlines()[:6]))
+    assert fastqstats(truncated)['error'].startswith('Truncated record')
+    # Reads in a different order are not paired
+    swapped = str(tmpdir.join('swapped.fastq'))
+    lines = open('tests/dummy_fastq/test_R2.fastq').readlines()
+    with open(swapped, 'w') as fastq:
+        fastq.write(''.join(lines[4:] + lines[:4]))
+    assert combinestats([fastqstats('tests/dummy_fastq/test_R1.fastq'), fastqstats(swapped)])['error'] == \
+        'The names of the forward and reverse reads do not match'
+    # Corrupt gzip files cannot be read
+    corrupt = str(tmpdir.join('corrupt.fastq.gz'))
+    with open(corrupt, 'wb') as fastq:
+        fastq.write(os.urandom(100))
+    assert fastqstats(corrupt)['error'].startswith('Could not read')
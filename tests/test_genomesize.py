@@ -0,0 +1,57 @@
+from spadespipeline.genomesize import canonicalkmers, estimate, peaks, sequences
+import numpy
+import os
+
+testfastq = os.path.join('tests', 'dummy_fastq')
+
+
+def reverse_complement(sequence):
+    return sequence.translate(bytes.maketrans(b'ACGT', b'TGCA'))[::-1]
+
+
+def test_canonical_kmers():
+    sequence = b'ACGTTGCAAGGCTTAACCGGATCGATCGTAGCTAGCTAACG'
+    forward = canonicalkmers([sequence])
+    assert len(forward) == len(sequence) - 31 + 1
+    # A k-mer and its reverse complement have the same canonical form
+    assert sorted(forward.tolist()) == sorted(canonicalkmers([reverse_complement(sequence)]).tolist())
+    # K-mers containing ambiguous bases, and k-mers spanning two reads are not counted
+    assert len(canonicalkmers([sequence[:20] + b'N' + sequence[21:]])) == 0
+    assert len(canonicalkmers([sequence[:35], sequence[35:]])) == 5
+
+
+def test_sequences_sampling():
+    fastqfiles = [os.path.join(testfastq, 'test_R1.fastq'), os.path.join(testfastq, 'test_R2.fastq')]
+    assert sum(len(batch) for batch in sequences(fastqfiles)) == 4
+    assert sum(len(batch) for batch in sequences(fastqfiles, 0.5)) == 2
+    # Chunks that split records are joined back together
+    assert [read for batch in sequences(fastqfiles, chunksize=7) for read in batch] == \
+        [read for batch in sequences(fastqfiles) for read in batch]
+
+
+def test_peaks():
+    counts = numpy.arange(101)
+    # Error k-mers decreasing from a count of one, and a coverage peak at 40
+    histogram = (100000 / counts[1:] ** 3).astype(numpy.int64)
+    histogram = numpy.concatenate(([0], histogram + (5000 * numpy.exp(-(counts[1:] - 40) ** 2 / 50)).astype(int)))
+    valley, coveragepeaks = peaks(histogram)
+    assert 5 < valley < 30
+    assert coveragepeaks == [40]
+
+
+def test_estimate(tmpdir):
+    random = numpy.random.RandomState(1)
+    genome = bytes(random.choice(list(b'ACGT'), 20000).astype(numpy.uint8))
+    fastqfile = os.path.join(str(tmpdir), 'genomesize.fastq')
+    with open(fastqfile, 'w') as fastq:
+        for read, start in enumerate(random.randint(0, len(genome) - 100, 8000)):
+            sequence = genome[start:start + 100]
+            if read % 2:
+                sequence = reverse_complement(sequence)
+            fastq.write('@read{}\n{}\n+\n{}\n'.format(read, sequence.decode(), 'I' * 100))
+    # 40X coverage of a 20 kbp genome
+    result = estimate([fastqfile], fraction=1.0, tablebits=20)
+    assert abs(result['genomesize'] - 20000) < 400
+    assert 25 < result['coverage'][0] < 40
+    # The coverage of sampled reads is scaled to all the reads
+    assert abs(estimate([fastqfile], fraction=0.5, tablebits=20)['coverage'][0] - result['coverage'][0]) < 2
@@ -0,0 +1,20 @@
+from accessoryFunctions.intervals import IntervalIndex
+
+
+def test_overlapping():
+    index = IntervalIndex([[2557, 3393], [3393, 4196], [5000, 6000]])
+    overlaps = index.overlapping([(2600, 3393), (3000, 3500), (3393, 3393), (7000, 8000)])
+    # Back-to-back ranges and empty ranges do not overlap
+    assert overlaps == {0: [0, 1], 1: [1]}
+
+
+def test_near_update():
+    index = IntervalIndex()
+    index.add(2494, 3296)
+    index.add(3296, 4132)
+    assert index.near(2493, 3293, 100) == [0]
+    assert index.near(3250, 3300, 100) == [0, 1]
+    assert index.near(5000, 6000, 100) == []
+    index.update(0, 2393, 3296)
+    assert index.intervals == [[2393, 3296], [3296, 4132]]
+    assert index.near(2400, 2500, 10) == [0]
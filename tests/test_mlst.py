@@ -0,0 +1,23 @@
+from accessoryFunctions.accessoryFunctions import GenObject, MetadataObject
+from spadespipeline.mMLST import MLST
+import os
+
+
+def test_blast_report_per_database(tmpdir):
+    # Skip the constructor, as it runs the analyses
+    mlst = MLST.__new__(MLST)
+    mlst.analysistype = 'mlst'
+    sample = MetadataObject()
+    sample.mlst = GenObject()
+    sample.mlst.reportdir = os.path.join(str(tmpdir), '')
+    assembly = os.path.join(str(tmpdir), 'sample.fasta')
+    # Without multiple databases, the report is named after the assembly
+    assert os.path.basename(mlst.blastreport(assembly, sample)).startswith('sample_rawresults_')
+    reports = [mlst.blastreport(assembly, sample, os.path.join(str(tmpdir), db)) for db in ('db1', 'db10')]
+    assert os.path.basename(reports[0]).startswith('sample_db1_rawresults_')
+    assert os.path.basename(reports[1]).startswith('sample_db10_rawresults_')
+    # The existing report of a database is reused, and is not matched by a database with the same prefix
+    with open(reports[1], 'w') as report:
+        report.write('hit\n')
+    assert mlst.blastreport(assembly, sample, os.path.join(str(tmpdir), 'db10')) == reports[1]
+    assert mlst.blastreport(assembly, sample, os.path.join(str(tmpdir), 'db1')) != reports[1]
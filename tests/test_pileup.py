@@ -0,0 +1,77 @@
+from sipprCommon.pileup import expand, pileup, summarise, summarisebam
+import numpy
+import pysam
+import os
+
+reference = 'ACGTACGTACGTACGTACGT'
+
+
+def write_bam(reads, bamfile='tests/pileup.bam'):
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': 'gene1', 'LN': len(reference)}]}
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as bam:
+        for name, start, sequence, cigar in reads:
+            record = pysam.AlignedSegment()
+            record.query_name = name
+            record.query_sequence = sequence
+            record.reference_id = 0
+            record.reference_start = start
+            record.mapping_quality = 60
+            record.cigartuples = cigar
+            bam.write(record)
+    pysam.index(bamfile)
+    return bamfile
+
+
+def test_expand():
+    assert expand([2, 10], [3, 2]).tolist() == [2, 3, 4, 10, 11]
+
+
+def test_pileup_counts():
+    bamfile = write_bam([('read1', 0, reference, [(0, 20)]),
+                         ('read2', 0, reference[:10] + reference[12:], [(0, 10), (2, 2), (0, 8)]),
+                         ('read3', 4, 'ACGTTTACGT', [(0, 4), (1, 2), (0, 4)])])
+    counts, features = pileup(bamfile, {'gene1': len(reference)})
+    assert counts['gene1'].shape == (20, 6)
+    # Position 10 contains a G from read1 and read3, and a deletion from read2
+    assert counts['gene1'][10].tolist() == [0, 0, 2, 0, 1, 0]
+    # Two bases are inserted by read3 before position 8
+    assert counts['gene1'][8, 5] == 2
+    assert features == {'gene1': {8: 2}}
+    os.remove(bamfile)
+    os.remove(bamfile + '.bai')
+
+
+def test_summarise():
+    counts = numpy.zeros((len(reference), 6), dtype=numpy.uint32)
+    # Cover the first 18 bases with the reference base at a depth of 4, and introduce a SNP and a gap
+    for position, base in enumerate(reference[:18]):
+        counts[position, 'ACGT'.index(base)] = 4
+    counts[5] = [3, 0, 0, 1, 0, 0]
+    counts[6] = [0, 0, 1, 0, 3, 0]
+    summary = summarise(counts, reference)
+    assert summary['matches'] == 16
+    assert summary['snplocations'] == [5]
+    assert summary['gaplocations'] == [6, 18, 19]
+    assert summary['sequence'] == 'ACGTAA-TACGTACGTAC'
+    assert summary['depth'] == 72
+    assert summary['maxcoverage'] == 4 and summary['mincoverage'] == 4
+
+
+def test_summarise_iupac():
+    counts = numpy.zeros((4, 6), dtype=numpy.uint32)
+    counts[:, 0] = 5
+    assert summarise(counts, 'ARNC')['matches'] == 1
+    assert summarise(counts, 'ARNC', {'R': ['A', 'G'], 'N': ['A', 'C', 'G', 'T']})['matches'] == 3
+
+
+def test_summarisebam():
+    bamfile = write_bam([('read{}'.format(i), 0, reference, [(0, 20)]) for i in range(3)])
+    with open('tests/pileup.fasta', 'w') as fasta:
+        fasta.write('>gene1\n{}\n'.format(reference))
+    summaries, features = summarisebam(bamfile, 'tests/pileup.fasta', {'gene1': len(reference)})
+    assert summaries['gene1']['matches'] == 20
+    assert summaries['gene1']['sequence'] == reference
+    assert features == dict()
+    for filename in [bamfile, bamfile + '.bai', 'tests/pileup.fasta']:
+        os.remove(filename)
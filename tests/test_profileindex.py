@@ -0,0 +1,60 @@
+from spadespipeline.profileindex import clearprofilecache, loadprofile, normaliseallele, readprofile, \
+    readreferenceprofile
+import os
+
+profilefile = 'tests/profile.txt'
+
+
+def setup_module():
+    with open(profilefile, 'w') as profile:
+        profile.write('ST\tadk\tfumC\tclonal_complex\n'
+                      '1\t1\t692 10\tST-10\n'
+                      '2\t2\t10 692\tST-10\n'
+                      '3\t1\tN\t\n')
+
+
+def teardown_module():
+    os.remove(profilefile)
+
+
+def test_normaliseallele():
+    assert normaliseallele('692 10') == '10 692'
+    assert normaliseallele('N') == 'N'
+
+
+def test_readprofile():
+    index = readprofile(profilefile, ['adk', 'fumC'])
+    assert index.matrix.shape == (3, 2)
+    assert index.rows('adk', '1').tolist() == [0, 2]
+    assert index.rows('fumC', '10 692').tolist() == [0, 1]
+    assert index.rows('fumC', 'N').tolist() == [2]
+    assert index.rows('fumC', '5').tolist() == []
+    assert index.rows('gyrB', '1').tolist() == []
+    # The profiles retain the allele strings as they appear in the file
+    assert index.profile('1') == {'adk': '1', 'fumC': '692 10'}
+    assert index.profile('NA') == dict()
+
+
+def test_loadprofile():
+    cachefile = profilefile + '.profileindex.npz'
+    index = loadprofile(profilefile, ['adk', 'fumC'])
+    assert os.path.isfile(cachefile)
+    cached = loadprofile(profilefile, ['adk', 'fumC'])
+    assert cached.sequencetypes == index.sequencetypes
+    assert cached.rows('fumC', '10 692').tolist() == [0, 1]
+    assert cached.profile('2') == {'adk': '2', 'fumC': '10 692'}
+    clearprofilecache('tests')
+    assert not os.path.isfile(cachefile)
+
+
+def test_closest():
+    referencefile = 'tests/referenceprofile.json'
+    with open(referencefile, 'w') as reference:
+        reference.write('{"Escherichia_1": {"adk": "1", "fumC": "2"}, "Listeria_1": {"adk": "1", "fumC": "3"}, '
+                        '"Escherichia_2": {"adk": "1", "fumC": "3"}}')
+    index = readreferenceprofile(referencefile)
+    assert index.genes == ['adk', 'fumC']
+    # Ties are broken by name
+    assert index.closest({'adk': '1', 'fumC': '3'}, 2) == [('Escherichia_2', 2), ('Listeria_1', 2)]
+    assert index.closest({'adk': '4', 'fumC': '2', 'gyrB': '1'}) == [('Escherichia_1', 1)]
+    os.remove(referencefile)
@@ -0,0 +1,117 @@
+from accessoryFunctions.accessoryFunctions import GenObject, MetadataObject
+from spadespipeline.quality import Quality, streamcall
+import numpy
+import shutil
+import os
+
+testfastq = os.path.join('tests', 'dummy_fastq')
+
+
+class Inputs(object):
+
+    def __init__(self, samples, numreads=2, forwardlength='full'):
+        self.runmetadata = GenObject()
+        self.runmetadata.samples = samples
+        self.cpus = 1
+        self.starttime = 0
+        self.forwardlength = forwardlength
+        self.reverselength = 'full'
+        self.numreads = numreads
+        self.logfile = os.devnull
+        self.path = 'tests'
+        self.reffilepath = 'tests'
+
+
+def sample(fastqfiles, forwardlength=150, reverselength=150):
+    metadata = MetadataObject()
+    metadata.name = 'test'
+    metadata.general = GenObject()
+    metadata.run = GenObject()
+    metadata.commands = GenObject()
+    metadata.general.fastqfiles = fastqfiles
+    metadata.general.logout = os.devnull
+    metadata.general.logerr = os.devnull
+    metadata.run.forwardlength = forwardlength
+    metadata.run.reverselength = reverselength
+    return metadata
+
+
+def test_streamcall_paired():
+    assert streamcall('bbduk.sh in1=a_R1.fastq.gz in2=a_R2.fastq.gz out=stdout.fq', ['c_R1.fastq.gz', 'c_R2.fastq.gz'],
+                      True, 4, 3000) == \
+        'bbduk.sh in1=a_R1.fastq.gz in2=a_R2.fastq.gz out=stdout.fq | tadpole.sh -Xmx3000m in=stdin.fq int=t ' \
+        'out1=c_R1.fastq.gz out2=c_R2.fastq.gz mode=correct threads=4'
+
+
+def test_streamcall_single():
+    assert streamcall('bbduk.sh in=a.fastq.gz out=stdout.fq', ['c.fastq.gz'], False, 2, 1000) == \
+        'bbduk.sh in=a.fastq.gz out=stdout.fq | tadpole.sh -Xmx1000m in=stdin.fq int=f out=c.fastq.gz mode=correct ' \
+        'threads=2'
+
+
+def test_bbduk_call_paired():
+    paired = sample([os.path.join(testfastq, 'test_R2.fastq'), os.path.join(testfastq, 'test_R1.fastq')],
+                    reverselength=40)
+    quality = Quality(Inputs([paired]))
+    assert quality.bbduk_call(paired, 'out1=R1.fastq.gz out2=R2.fastq.gz') == \
+        'bbduk.sh -Xmx1g in1=tests/dummy_fastq/test_R1.fastq in2=tests/dummy_fastq/test_R2.fastq ' \
+        'out1=R1.fastq.gz out2=R2.fastq.gz qtrim=w trimq=10 k=25 minlength=40 ref=adapters tbo'
+    # Reads without a recorded length cannot be trimmed
+    paired.run.forwardlength = 'NA'
+    assert quality.bbduk_call(paired, 'out=stdout.fq') == str()
+
+
+def test_bbduk_call_single():
+    single = sample([os.path.join(testfastq, 'single.fastq')], reverselength='NA')
+    quality = Quality(Inputs([single]))
+    assert quality.bbduk_call(single, 'out=single_trimmed.fastq.gz') == \
+        'bbduk.sh -Xmx1g in=tests/dummy_fastq/single.fastq out=single_trimmed.fastq.gz qtrim=w trimq=10 k=25 ' \
+        'minlength=50 ref=adapters'
+    # Reads without a recorded length cannot be trimmed
+    single.run.forwardlength = 'NA'
+    assert quality.bbduk_call(single, 'out=stdout.fq') == str()
+
+
+def test_bbduk_call_forcetrimright():
+    paired = sample([os.path.join(testfastq, 'test_R1.fastq'), os.path.join(testfastq, 'test_R2.fastq')])
+    quality = Quality(Inputs([paired], numreads=1, forwardlength=100))
+    # Only the forward reads are trimmed when the reverse reads are excluded
+    assert quality.bbduk_call(paired, 'out=R1.fastq.gz') == \
+        'bbduk.sh -Xmx1g in=tests/dummy_fastq/test_R1.fastq out=R1.fastq.gz qtrim=w trimq=10 k=25 minlength=50 ' \
+        'ref=adapters forcetrimright=100'
+
+
+def test_stream_trim_correct(tmpdir):
+    fastqfiles = list()
+    for read in ('R1', 'R2'):
+        fastqfile = os.path.join(str(tmpdir), 'test_{}.fastq.gz'.format(read))
+        shutil.copyfile(os.path.join(testfastq, 'test_{}.fastq'.format(read)), fastqfile)
+        fastqfiles.append(fastqfile)
+    corrected = [os.path.join(str(tmpdir), 'test_{}_trimmed_corrected.fastq.gz'.format(read)) for read in ('R1', 'R2')]
+    paired = sample(fastqfiles)
+    quality = Quality(Inputs([paired]))
+    # Existing corrected reads are used without running the pipeline
+    for fastqfile in corrected:
+        open(fastqfile, 'w').close()
+    quality.stream_trim_correct(paired, 4, 5000)
+    assert paired.quality.errorcorrectcmd == \
+        'bbduk.sh -Xmx1g in1={0} in2={1} out=stdout.fq qtrim=w trimq=10 k=25 minlength=50 ref=adapters tbo | ' \
+        'tadpole.sh -Xmx4000m in=stdin.fq int=t out1={2} out2={3} mode=correct threads=4'\
+        .format(*fastqfiles + corrected)
+    assert paired.general.trimmedcorrectedfastqfiles == corrected
+    assert quality.streamedsamples == {'test'}
+
+
+def test_estimate_genome_size_low_coverage(tmpdir):
+    random = numpy.random.RandomState(1)
+    genome = bytes(random.choice(list(b'ACGT'), 20000).astype(numpy.uint8))
+    fastqfile = os.path.join(str(tmpdir), 'test.fastq')
+    # 10X coverage of a 20 kbp genome - too low for the default fraction of the reads to have a distinct coverage peak
+    with open(fastqfile, 'w') as fastq:
+        for read, start in enumerate(random.randint(0, len(genome) - 100, 2000)):
+            fastq.write('@read{}\n{}\n+\n{}\n'.format(read, genome[start:start + 100].decode(), 'I' * 100))
+    single = sample([fastqfile], reverselength='NA')
+    quality = Quality(Inputs([single]))
+    quality.estimate_genome_size()
+    # The genome size is estimated again from all the reads
+    assert abs(single.quality.genomesize - 20000) < 3000
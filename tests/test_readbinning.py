@@ -0,0 +1,57 @@
+from metagenomefilter.readbinning import binreads, fastqrecords, loadassignments, readkey
+import gzip
+import os
+
+binningpath = os.path.join('tests', 'binning')
+
+
+def write_reads(fastqfile, reads):
+    with open(fastqfile, 'w') as fastq:
+        for name, sequence in reads:
+            fastq.write('@{} 1:N:0\n{}\n+\n{}\n'.format(name, sequence, 'I' * len(sequence)))
+
+
+def test_load_assignments():
+    os.makedirs(binningpath, exist_ok=True)
+    assignmentfile = os.path.join(binningpath, 'assignments.csv')
+    with open(assignmentfile, 'w') as assignments:
+        assignments.write('Object_ID, Length, Assignment\nread1,4,562\nread2,4,28901\nread3,4,NA\nread1,4,28901\n')
+    keys, indices = loadassignments(assignmentfile, ['28901', '562'])
+    assert dict(zip(keys.tolist(), indices.tolist())) == {readkey(b'read1'): 1, readkey(b'read2'): 0}
+    # Parsing the file in several processes keeps the first assignment of each read
+    keys, indices = loadassignments(assignmentfile, ['28901', '562'], processes=3)
+    assert dict(zip(keys.tolist(), indices.tolist())) == {readkey(b'read1'): 1, readkey(b'read2'): 0}
+    os.remove(assignmentfile)
+
+
+def test_fastq_records():
+    os.makedirs(binningpath, exist_ok=True)
+    fastqfile = os.path.join(binningpath, 'reads.fastq')
+    write_reads(fastqfile, [('read{}'.format(read), 'ACGT' * read) for read in range(1, 6)])
+    records = [record for batch in fastqrecords(fastqfile, batchsize=2, chunksize=10) for record in batch]
+    assert [name for name, record in records] == [b'read1', b'read2', b'read3', b'read4', b'read5']
+    assert records[0][1] == b'@read1 1:N:0\nACGT\n+\nIIII\n'
+    os.remove(fastqfile)
+
+
+def test_bin_reads():
+    os.makedirs(binningpath, exist_ok=True)
+    fastqfile = os.path.join(binningpath, 'reads.fastq')
+    reads = [('read{}'.format(read), 'ACGT' * read) for read in range(1, 7)]
+    write_reads(fastqfile, reads)
+    assignmentfile = os.path.join(binningpath, 'assignments.csv')
+    with open(assignmentfile, 'w') as assignments:
+        assignments.write('Object_ID, Length, Assignment\n')
+        for read, taxid in zip(range(1, 7), ['562', '28901', '562', 'NA', '1280', '562']):
+            assignments.write('read{},{},{}\n'.format(read, read * 4, taxid))
+    outputs = {taxid: os.path.join(binningpath, 'sample_{}.fastq.gz'.format(taxid)) for taxid in ('562', '28901')}
+    # A small buffer forces each bin to be compressed in several parts
+    assert binreads(fastqfile, assignmentfile, outputs, buffersize=10, threads=2) == {'562': 3, '28901': 1}
+    with gzip.open(outputs['562'], 'rt') as binned:
+        assert binned.read().split('\n')[0::4][:-1] == ['@read1 1:N:0', '@read3 1:N:0', '@read6 1:N:0']
+    with gzip.open(outputs['28901'], 'rt') as binned:
+        assert binned.read() == '@read2 1:N:0\nACGTACGT\n+\nIIIIIIII\n'
+    assert not [filename for filename in os.listdir(binningpath) if filename.endswith('.tmp')]
+    for filename in os.listdir(binningpath):
+        os.remove(os.path.join(binningpath, filename))
+    os.rmdir(binningpath)
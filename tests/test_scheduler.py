@@ -0,0 +1,111 @@
+from accessoryFunctions.scheduler import StageScheduler, TaskScheduler, batches
+import threading
+import pytest
+
+
+def test_allocate():
+    scheduler = StageScheduler(cpus=32, memory=64000)
+    # As many samples as the CPUs allow
+    assert scheduler.allocate(jobs=100, minthreads=4, minmemory=4000) == (8, 4, 8000)
+    # Never more samples than there are jobs
+    assert scheduler.allocate(jobs=2, minthreads=4, minmemory=4000) == (2, 16, 32000)
+    # The memory budget limits the number of concurrent samples, even if more are requested
+    assert scheduler.allocate(jobs=100, minthreads=1, minmemory=16000, concurrency=10) == (4, 8, 16000)
+
+
+def test_batches():
+    items = list(range(10))
+    # As many batches as fit in memory, and never more batches than items
+    assert batches(items, memory=16000, batchmemory=5000) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert batches(items[:2], memory=64000, batchmemory=4000) == [[0], [1]]
+    # At least one batch, even if the tool does not fit in the memory budget
+    assert batches(items, memory=1000, batchmemory=4000) == [items]
+    # Large sets of items are split further
+    assert batches(items, memory=1000, batchmemory=4000, maxsize=4) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert batches(list(), memory=1000, batchmemory=4000) == list()
+
+
+def test_run():
+    scheduler = StageScheduler(cpus=4, memory=8000)
+    lock = threading.Lock()
+    calls = list()
+
+    def function(sample, threads, memory):
+        with lock:
+            calls.append((sample, threads, memory))
+
+    scheduler.run('stage', function, [1, 2, 3], minthreads=2, minmemory=1000)
+    assert sorted(calls) == [(1, 2, 4000), (2, 2, 4000), (3, 2, 4000)]
+    assert scheduler.stages['stage']['samples'] == 3 and scheduler.stages['stage']['workers'] == 2
+
+
+class Sample(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+def test_task_dependencies():
+    scheduler = TaskScheduler(cpus=4, memory=8000)
+    lock = threading.Lock()
+    events = list()
+    samples = [Sample('A'), Sample('B')]
+
+    def record(stage):
+        def function(sample):
+            with lock:
+                events.append((stage, sample.name))
+        return function
+
+    scheduler.stage('assemble', record('assemble'), samples, cpus=4)
+    # Typing only waits for the assembly of the same sample
+    names = scheduler.stage('typing', record('typing'), samples, cpus=2, after=['assemble'])
+    assert scheduler.tasks[('typing', 'A')]['dependencies'] == [('assemble', 'A')]
+    report = scheduler.add('report', record('report'), (Sample('all'),), dependencies=names)
+    statuses = scheduler.run()
+    assert set(statuses.values()) == {'complete'}
+    for sample in samples:
+        assert events.index(('assemble', sample.name)) < events.index(('typing', sample.name))
+    assert events[-1] == ('report', 'all') and report == 'report'
+    # Tasks never exceed the CPUs of the scheduler
+    assert scheduler.freecpus == 4 and scheduler.freememory == 8000
+
+
+def test_task_resource_limits():
+    scheduler = TaskScheduler(cpus=4, memory=8000)
+    lock = threading.Lock()
+    usage = {'cpus': 0, 'memory': 0, 'maxcpus': 0, 'maxmemory': 0}
+    release = threading.Event()
+
+    def function(cpus, memory):
+        with lock:
+            usage['cpus'] += cpus
+            usage['memory'] += memory
+            usage['maxcpus'] = max(usage['maxcpus'], usage['cpus'])
+            usage['maxmemory'] = max(usage['maxmemory'], usage['memory'])
+        release.wait(0.05)
+        with lock:
+            usage['cpus'] -= cpus
+            usage['memory'] -= memory
+
+    for task in range(6):
+        scheduler.add(task, function, (2, 3000), cpus=2, memory=3000)
+    # Requirements larger than the scheduler are limited to its resources
+    scheduler.add('large', function, (4, 8000), cpus=16, memory=100000)
+    scheduler.run()
+    assert usage['maxcpus'] <= 4 and usage['maxmemory'] <= 8000
+
+
+def test_task_failure():
+    scheduler = TaskScheduler(cpus=2, memory=1000)
+
+    def fail():
+        raise ValueError('failed')
+
+    scheduler.add('fail', fail)
+    scheduler.add('dependent', lambda: None, dependencies=['fail'])
+    scheduler.add('independent', lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.run()
+    assert scheduler.tasks['dependent']['status'] == 'skipped'
+    assert scheduler.tasks['independent']['status'] == 'complete'